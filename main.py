@@ -1,5 +1,9 @@
-from src.front.main_ui import Front
+import sys
 
 if __name__ == '__main__':
+    if len(sys.argv) > 1: # headless command, see src/front/cli.py
+        from src.front.cli import main
+        sys.exit(main())
+    from src.front.main_ui import Front
     f = Front()
-    f.start()
\ No newline at end of file
+    f.start()
@@ -1,7 +1,86 @@
-import main
+import io
+import os
+import sys
+import time
 import cProfile
+import tempfile
+import subprocess
 
-cProfile.run('main.Front().start()')
+STARTUP_MODULES = ['src.front.main_ui', 'src.front.cli'] # what main.py imports for the UI and the command line
+STARTUP_BUDGET = 0.2 # seconds
+HEAVY_MODULES = ['matplotlib', 'numpy', 'serial', 'pyarrow'] # only imported by the features which use them
+
+
+def startup_time(module, repeat=5):
+    '''
+    The best import time of a module in a fresh interpreter over repeat runs, and the heavy modules it loaded
+    '''
+    code = ('import sys, time\n'
+            't = time.perf_counter()\n'
+            f'import {module}\n'
+            'print(time.perf_counter() - t)\n'
+            f'print(" ".join(name for name in {HEAVY_MODULES!r} if name in sys.modules))\n')
+    best, loaded = None, []
+    for i in range(repeat):
+        out = subprocess.run([sys.executable, '-c', code], capture_output=True, text=True, check=True,
+                             cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        seconds = float(out[0])
+        best = seconds if best is None else min(best, seconds)
+        loaded = out[1].split() if len(out) > 1 else []
+    return best, loaded
+
+
+def check_startup():
+    '''
+    Print the startup time of the tool, returns False if it is over STARTUP_BUDGET or loads a heavy module
+    '''
+    ok = True
+    for module in STARTUP_MODULES:
+        seconds, loaded = startup_time(module)
+        print(f'{module}: {seconds * 1000:.1f} ms' + (f', loads {", ".join(loaded)}' if loaded else ''))
+        ok = ok and seconds <= STARTUP_BUDGET and not loaded
+    return ok
+
+
+class CountingFile(io.FileIO):
+    '''
+    Raw file which counts the write calls of the buffered file on top of it
+    '''
+    writes = 0
+
+    def write(self, data):
+        self.writes += 1
+        return super().write(data)
+
+
+def writer_benchmark(size=64 << 20, packet_length=95, batch=10):
+    '''
+    Write size bytes of packets the way the log pipeline does, once per packet to a buffered file
+    and in batches through LogWriter with each fsync policy, print the throughput and the write latency
+    '''
+    from src.communication.log_writer import LogWriter
+
+    packet = bytes(packet_length)
+    batches = size // (packet_length * batch)
+    with tempfile.TemporaryDirectory() as folder:
+        path = os.path.join(folder, 'bench.bin')
+        start = time.perf_counter()
+        raw = CountingFile(path, 'wb')
+        with io.BufferedWriter(raw) as logf:
+            for i in range(batches * batch):
+                logf.write(packet)
+        seconds = time.perf_counter() - start
+        print(f'file.write per packet: {size / seconds / 1e6:.0f} MB/s, {raw.writes} writes')
+        for fsync in ['never', 'size', 'time']:
+            start = time.perf_counter()
+            with LogWriter(path, fsync=fsync, fsync_interval=0.5) as writer:
+                for i in range(batches):
+                    writer.writelines([packet] * batch)
+            seconds = time.perf_counter() - start
+            stats = writer.stats()
+            print(f"LogWriter fsync {fsync}: {size / seconds / 1e6:.0f} MB/s, {stats['writes']} writes "
+                  f"(mean {stats['write latency mean ms']:.2f} ms, max {stats['write latency max ms']:.2f} ms), "
+                  f"{stats['fsyncs']} fsyncs (max {stats['fsync latency max ms']:.1f} ms)")
 
 
 def main(x):
@@ -12,7 +91,17 @@ def main(x):
         idx = 20
     elif odr == 50:
         idx = 2
-    elif odr == 20: 
+    elif odr == 20:
         idx = 1
     elif odr == 10:
-        idx = 1
\ No newline at end of file
+        idx = 1
+
+
+if __name__ == '__main__':
+    if sys.argv[1:] == ['startup']: # python perf_anal.py startup
+        sys.exit(0 if check_startup() else 1)
+    if sys.argv[1:] == ['writer']: # python perf_anal.py writer
+        writer_benchmark()
+        sys.exit(0)
+    from src.front.main_ui import Front
+    cProfile.runctx('Front().start()', globals(), {'Front': Front})
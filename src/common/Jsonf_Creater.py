@@ -15,6 +15,37 @@ JSON_DATA = {
     "myVisual": {
         'maxt': 10,
         'dt': 0.02,
+    },
+    "myParse": {
+        'export formats': ['csv'],
+        'incremental': False,
+        'parse cache': True,
+        'cache hash': False,
+        'statistics': False,
+        'slice': {
+            'packet range': None,
+            'time range': None,
+            'decimate': 1,
+            'decimation': 'pick'
+        },
+        'csv delimiter': ',',
+        'csv precision': {
+            'accels': None,
+            'rates': None,
+            'temps': None,
+            'angles': None,
+            'counters': None
+        }
+    },
+    "myAnalysis": {
+        'sample rate': None,
+        'plots': True
+    },
+    "myLog": {
+        'block size kb': 1024,
+        'fsync': 'never',
+        'fsync mb': 16,
+        'fsync seconds': 5
     }
 }
 
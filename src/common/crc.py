@@ -0,0 +1,88 @@
+CRC_SEED = 0x1D0F
+CRC_POLY = 0x1021
+
+
+def make_crc_table(poly=CRC_POLY):
+    '''
+    CRC-CCITT of every byte value, used to process one byte per lookup instead of one bit per loop
+    '''
+    table = []
+    for byte in range(256):
+        crc = byte << 8
+        for i in range(8):
+            if crc & 0x8000:
+                crc = (crc << 1) ^ poly
+            else:
+                crc = crc << 1
+        table.append(crc & 0xFFFF)
+    return table
+
+CRC_TABLE = make_crc_table()
+CRC_TABLE_NP = None # numpy copy of CRC_TABLE for the batch functions, made on first use so calc_crc() does not load numpy
+
+
+def calc_crc(payload, crc=CRC_SEED):
+    '''
+    Calculates 16-bit CRC-CCITT of payload (bytes or list of int)
+    '''
+    table = CRC_TABLE
+    for bytedata in payload:
+        crc = ((crc << 8) & 0xFF00) ^ table[(crc >> 8) ^ bytedata]
+    return crc
+
+
+def calc_crc_batch(rows, crc=CRC_SEED):
+    '''
+    Calculates the CRC-CCITT of every row of a (n, length) uint8 array, returns a uint16 array
+    '''
+    import numpy as np
+    global CRC_TABLE_NP
+
+    if CRC_TABLE_NP is None:
+        CRC_TABLE_NP = np.array(CRC_TABLE, dtype=np.uint16)
+    rows = np.asarray(rows, dtype=np.uint8)
+    result = np.full(len(rows), crc, dtype=np.uint16)
+    for j in range(rows.shape[1]):
+        result = (result << 8) ^ CRC_TABLE_NP[(result >> 8) ^ rows[:, j]]
+    return result
+
+
+def check_crc_batch(packets):
+    '''
+    packets: (n, packet_length) uint8 array of Aceinna packets, the crc covers packet[2:-2] and is stored big-endian in packet[-2:]
+    '''
+    import numpy as np
+
+    packets = np.asarray(packets, dtype=np.uint8)
+    crc = (packets[:, -2].astype(np.uint16) << 8) | packets[:, -1]
+    return calc_crc_batch(packets[:, 2:-2]) == crc
+
+
+def calc_sum8_batch(rows):
+    '''
+    8-bit sum of every row of a (n, length) uint8 array
+    '''
+    import numpy as np
+
+    return (np.asarray(rows, dtype=np.uint8).sum(axis=1, dtype=np.uint32) & 0xFF).astype(np.uint8)
+
+
+def check_sum8_batch(packets):
+    '''
+    packets: (n, packet_length) uint8 array of S3 packets, the sum covers packet[2:-1] and is stored in packet[-1]
+    '''
+    import numpy as np
+
+    packets = np.asarray(packets, dtype=np.uint8)
+    return calc_sum8_batch(packets[:, 2:-1]) == packets[:, -1]
+
+
+def check_packet(packet, checksum):
+    '''
+    Whether the checksum of one packet is right, checksum: 'crc', 'sum8' or None as in packet_schema
+    '''
+    if checksum == 'crc':
+        return calc_crc(packet[2:-2]) == (packet[-2] << 8) | packet[-1]
+    if checksum == 'sum8':
+        return sum(packet[2:-1]) & 0xFF == packet[-1]
+    return True
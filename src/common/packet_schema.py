@@ -0,0 +1,349 @@
+import struct
+import numpy as np
+
+# Packet types as data: adding a packet type only needs an entry here.
+#
+# header: first bytes of the packet
+# length: length of the whole packet (header + length byte + payload + checksum), default of variable length packets
+# framing: (bytes before the payload, bytes after the payload)
+# checksum: 'crc' (CRC-CCITT of [2:-2]), 'sum8' (8-bit sum of [2:-1]) or None
+# type code: value of the packet type field (field 3) of the device
+# variable length: the packet length of a log is read from the length byte of its first packet
+# endian, fields: payload layout, (field name, struct format, scale, channel group),
+#                 the scale is a number, a callable or None for raw values.
+#                 Packets without fields are only framed (logged), not decoded.
+# columns: fields written to the parsed output, all fields if missing
+# plot: fields shown by the live visualization, [[x, y, z], ...] per sensor
+# time: (device time field, gps week field, wrap-around period of the time field) used by the packet index
+# sequence: (packet counter field which counts up by one per packet, wrap-around period) used by the data quality check
+PACKET_SCHEMAS = {}
+
+
+def fm_chip_num(packet_length):
+    '''
+    FM payload: chip_num * 7 int32 counts + 2 or 3 uint16 trailer fields
+    '''
+    return int((packet_length - 11) / 28)
+
+
+FM_CHIP_FIELDS = [('xAccelCounts', 'accels'), ('yAccelCounts', 'accels'), ('zAccelCounts', 'accels'),
+                  ('xRateCounts', 'rates'), ('yRateCounts', 'rates'), ('zRateCounts', 'rates'), ('TempCounts', 'temps')]
+FM_TAIL_FIELDS = ['sensorSubset', 'sampleIdx', 'reserved']
+
+
+def fm_fields(packet_length):
+    chip_num = fm_chip_num(packet_length)
+    fields = []
+    for chip in range(1, chip_num + 1):
+        fields += [(f'{name}{chip}', 'i', None, group) for name, group in FM_CHIP_FIELDS]
+    tail_num = (packet_length - 7 - chip_num * 28) // 2
+    fields += [(name, 'H', None, 'counters') for name in FM_TAIL_FIELDS[:tail_num]]
+    return fields
+
+
+def fm_plot(packet_length):
+    chips = range(1, fm_chip_num(packet_length) + 1)
+    return {'accels': [[f'xAccelCounts{c}', f'yAccelCounts{c}', f'zAccelCounts{c}'] for c in chips],
+            'gyros': [[f'xRateCounts{c}', f'yRateCounts{c}', f'zRateCounts{c}'] for c in chips],
+            'temps': [[f'TempCounts{c}'] for c in chips],
+            'angles': []}
+
+
+def round_half(v, ndigits):
+    '''
+    round(x, ndigits) of a value or an array with the results of Python's round(). np.round rounds the scaled
+    product, which differs in the last digit when the exact value is (close to) a half, those values are
+    rounded by round().
+    '''
+    if np.ndim(v) == 0:
+        return round(float(v), ndigits)
+    v = np.asarray(v, dtype=np.float64)
+    result = np.round(v, ndigits)
+    scaled = np.abs(v * 10.0 ** ndigits)
+    close = np.abs(scaled - np.floor(scaled) - 0.5) < 1e-6
+    if close.any():
+        result[close] = [round(x, ndigits) for x in v[close].tolist()]
+    return result
+
+
+def s3_rate(v):
+    return round_half(v * 0.000001, 5)
+
+
+def s3_accel(v):
+    return round_half(v * 0.000001, 5) * 0.1
+
+
+def s3_temp(v):
+    return round_half(v * 0.008, 3)
+
+
+PACKET_SCHEMAS['S1'] = {
+    'header': [0x55, 0x55, 0x53, 0x31], 'length': 31, 'framing': (5, 2), 'checksum': 'crc', 'type code': '5331',
+    'endian': '>',
+    'fields': [
+        ('xAccel', 'h', 20 / 2**16, 'accels'),
+        ('yAccel', 'h', 20 / 2**16, 'accels'),
+        ('zAccel', 'h', 20 / 2**16, 'accels'),
+        ('xRate', 'h', 1260 / 2**16, 'rates'),
+        ('yRate', 'h', 1260 / 2**16, 'rates'),
+        ('zRate', 'h', 1260 / 2**16, 'rates'),
+        ('xRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('yRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('zRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('boardTemp', 'h', 200 / 2**16, 'temps'),
+        ('timer', 'H', 15.259022, 'counters'),
+        ('BITstatus', 'H', None, 'counters'),
+    ],
+    'plot': {'accels': [['xAccel', 'yAccel', 'zAccel']], 'gyros': [['xRate', 'yRate', 'zRate']], 'temps': [['boardTemp']], 'angles': []},
+    'time': ('timer', None, 65536 * 15.259022),
+}
+
+PACKET_SCHEMAS['S2'] = {
+    'header': [0x55, 0x55, 0x53, 0x32], 'length': 45, 'framing': (5, 2), 'checksum': 'crc', 'type code': '5332',
+    'endian': '<',
+    'fields': [
+        ('gps_week', 'H', None, 'counters'),
+        ('gps_time_of_week', 'I', None, 'counters'),
+        ('x_accel', 'f', None, 'accels'),
+        ('y_accel', 'f', None, 'accels'),
+        ('z_accel', 'f', None, 'accels'),
+        ('x_gyro', 'f', None, 'rates'),
+        ('y_gyro', 'f', None, 'rates'),
+        ('z_gyro', 'f', None, 'rates'),
+        ('temp', 'f', None, 'temps'),
+        ('master_bit', 'I', None, 'counters'),
+    ],
+    'plot': {'accels': [['x_accel', 'y_accel', 'z_accel']], 'gyros': [['x_gyro', 'y_gyro', 'z_gyro']], 'temps': [['temp']], 'angles': []},
+    'time': ('gps_time_of_week', 'gps_week', None),
+}
+
+PACKET_SCHEMAS['F1'] = {
+    'header': [0x55, 0x55, 0x46, 0x31], 'length': 61, 'framing': (5, 2), 'checksum': 'crc',
+}
+
+PACKET_SCHEMAS['A1'] = {
+    'header': [0x55, 0x55, 0x41, 0x31], 'length': 39, 'framing': (5, 2), 'checksum': 'crc', 'type code': '4131',
+    'endian': '>',
+    'fields': [
+        ('rollAngle', 'h', 360 / 2**16, 'angles'),
+        ('pitchAngle', 'h', 360 / 2**16, 'angles'),
+        ('yawAngleMag', 'h', 360 / 2**16, 'angles'),
+        ('xRateCorrected', 'h', 1260 / 2**16, 'rates'),
+        ('yRateCorrected', 'h', 1260 / 2**16, 'rates'),
+        ('zRateCorrected', 'h', 1260 / 2**16, 'rates'),
+        ('xAccel', 'h', 20 / 2**16, 'accels'),
+        ('yAccel', 'h', 20 / 2**16, 'accels'),
+        ('zAccel', 'h', 20 / 2**16, 'accels'),
+        ('xMag', 'h', 2 / 2**16, 'mags'),
+        ('yMag', 'h', 2 / 2**16, 'mags'),
+        ('zMag', 'h', 2 / 2**16, 'mags'),
+        ('xRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('timeITOW', 'I', None, 'counters'),
+        ('BITstatus', 'H', None, 'counters'),
+    ],
+    'columns': ['rollAngle', 'pitchAngle', 'yawAngleMag', 'xRateCorrected', 'yRateCorrected', 'zRateCorrected',
+                'xAccel', 'yAccel', 'zAccel', 'xRateTemp', 'timeITOW', 'BITstatus'],
+    'plot': {'accels': [['xAccel', 'yAccel', 'zAccel']], 'gyros': [['xRateCorrected', 'yRateCorrected', 'zRateCorrected']],
+             'temps': [['xRateTemp']], 'angles': [['rollAngle', 'pitchAngle']]},
+    'time': ('timeITOW', None, None),
+}
+
+PACKET_SCHEMAS['A2'] = {
+    'header': [0x55, 0x55, 0x41, 0x32], 'length': 37, 'framing': (5, 2), 'checksum': 'crc', 'type code': '4132',
+    'endian': '>',
+    'fields': [
+        ('rollAngle', 'h', 360 / 2**16, 'angles'),
+        ('pitchAngle', 'h', 360 / 2**16, 'angles'),
+        ('yawAngleTrue', 'h', 360 / 2**16, 'angles'),
+        ('xRateCorrected', 'h', 1260 / 2**16, 'rates'),
+        ('yRateCorrected', 'h', 1260 / 2**16, 'rates'),
+        ('zRateCorrected', 'h', 1260 / 2**16, 'rates'),
+        ('xAccel', 'h', 20 / 2**16, 'accels'),
+        ('yAccel', 'h', 20 / 2**16, 'accels'),
+        ('zAccel', 'h', 20 / 2**16, 'accels'),
+        ('xRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('yRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('zRateTemp', 'h', 200 / 2**16, 'temps'),
+        ('timeITOW', 'I', None, 'counters'),
+        ('BITstatus', 'H', None, 'counters'),
+    ],
+    'plot': {'accels': [['xAccel', 'yAccel', 'zAccel']], 'gyros': [['xRateCorrected', 'yRateCorrected', 'zRateCorrected']],
+             'temps': [['xRateTemp']], 'angles': [['rollAngle', 'pitchAngle']]},
+    'time': ('timeITOW', None, None),
+}
+
+PACKET_SCHEMAS['FM'] = {
+    'header': [0x55, 0x55, 0x46, 0x4D], 'length': 95, 'framing': (5, 2), 'checksum': 'crc', 'type code': '464d',
+    'variable length': True, # the number of chips follows from the packet length
+    'endian': '<',
+    'fields': fm_fields,
+    'plot': fm_plot,
+    'time': ('sampleIdx', None, 65536),
+    'sequence': ('sampleIdx', 65536),
+}
+
+PACKET_SCHEMAS['a2'] = { # the payload layout is not documented, only framed (logged) like F1
+    'header': [0x55, 0x55, 0x61, 0x32], 'length': 55, 'framing': (5, 2), 'checksum': 'crc', 'type code': '6132',
+}
+
+PACKET_SCHEMAS['S3'] = {
+    'header': [0x55, 0xAA, 0x24], 'length': 40, 'framing': (3, 1), 'checksum': 'sum8', 'type code': '5333',
+    'endian': '<',
+    'fields': [
+        ('num', 'I', None, 'counters'),
+        ('xRate', 'i', s3_rate, 'rates'),
+        ('yRate', 'i', s3_rate, 'rates'),
+        ('zRate', 'i', s3_rate, 'rates'),
+        ('xAccel', 'i', s3_accel, 'accels'),
+        ('yAccel', 'i', s3_accel, 'accels'),
+        ('zAccel', 'i', s3_accel, 'accels'),
+        ('boardTempCounts', 'h', s3_temp, 'temps'),
+        ('supplierid', 'H', None, 'counters'),
+        ('productid', 'I', None, 'counters'),
+    ],
+    'plot': {'accels': [['xAccel', 'yAccel', 'zAccel']], 'gyros': [['xRate', 'yRate', 'zRate']], 'temps': [['boardTempCounts']], 'angles': []},
+    'time': ('num', None, 2**32),
+    'sequence': ('num', 2**32),
+}
+
+PACKET_SCHEMAS['AT'] = {
+    'header': [0xBD, 0xDB, 0x54], 'length': 39, 'framing': (3, 2), 'checksum': None, 'type code': '4154',
+    'endian': '<',
+    'fields': [
+        ('xRate', 'h', 300 / 32768, 'rates'),
+        ('yRate', 'h', 300 / 32768, 'rates'),
+        ('zRate', 'h', 300 / 32768, 'rates'),
+        ('xAccel', 'h', 12 / 32768, 'accels'),
+        ('yAccel', 'h', 12 / 32768, 'accels'),
+        ('zAccel', 'h', 12 / 32768, 'accels'),
+        ('Temp', 'h', 200.0 / 32768, 'temps'),
+        ('Fixed value 0', 'B', None, 'counters'),
+        ('Flags0', 'B', None, 'counters'),
+        ('Flags1', 'B', None, 'counters'),
+        ('Frame count', 'H', None, 'counters'),
+        ('GPS Week', 'H', None, 'counters'),
+        ('GPS TimeOfWeek', 'I', 1E-03, 'counters'),
+        ('year', 'H', None, 'counters'),
+        ('month', 'B', None, 'counters'),
+        ('day', 'B', None, 'counters'),
+        ('hour', 'B', None, 'counters'),
+        ('minute', 'B', None, 'counters'),
+        ('second', 'B', None, 'counters'),
+        ('milliseconds', 'H', None, 'counters'),
+    ],
+    'plot': {'accels': [['xAccel', 'yAccel', 'zAccel']], 'gyros': [['xRate', 'yRate', 'zRate']], 'temps': [['Temp']], 'angles': []},
+    'time': ('GPS TimeOfWeek', 'GPS Week', None),
+    'sequence': ('Frame count', 65536),
+}
+
+
+def scaler(scale):
+    if scale is None or callable(scale):
+        return scale
+    return lambda v: v * scale
+
+
+class PacketSchema:
+    '''
+    A packet type compiled from its PACKET_SCHEMAS entry: a struct.Struct for single packets (live data)
+    and numpy dtypes for batches of packets (log files).
+
+    data_type: The type of the packets
+    packet_length: The length of a whole packet, only needed if it differs from the default (FM)
+    '''
+    def __init__(self, data_type, packet_length=None):
+        spec = PACKET_SCHEMAS[data_type]
+        self.data_type = data_type
+        self.header = bytes(spec['header'])
+        self.packet_length = packet_length if packet_length is not None else spec['length']
+        self.prefix, self.suffix = spec['framing']
+        self.checksum = spec['checksum']
+        self.type_code = spec.get('type code')
+        self.variable_length = spec.get('variable length', False)
+        self.time = spec.get('time')
+        self.sequence = spec.get('sequence')
+
+        fields = spec.get('fields') or []
+        if callable(fields):
+            fields = fields(self.packet_length)
+        plot = spec.get('plot') or {}
+        if callable(plot):
+            plot = plot(self.packet_length)
+        self.fields = fields
+        self.plot = plot
+        self.names = [name for name, _, _, _ in fields]
+        self.columns = spec.get('columns', self.names)
+        self.scales = {name: scale for name, _, scale, _ in fields}
+        self.groups = {name: group for name, _, _, group in fields}
+        self.struct = None
+        self.raw_dtype = None
+        self.dtype = None
+        if not fields:
+            return
+
+        endian = spec['endian']
+        self.struct = struct.Struct(endian + ''.join(fmt for _, fmt, _, _ in fields))
+        if self.prefix + self.struct.size + self.suffix != self.packet_length:
+            raise ValueError(f'invalid {data_type} packet length {self.packet_length}')
+        self.converters = [scaler(scale) for _, _, scale, _ in fields]
+
+        raw_fields = [('_prefix', f'V{self.prefix}')]
+        raw_fields += [(name, endian + fmt) for name, fmt, _, _ in fields]
+        raw_fields += [('_suffix', f'V{self.suffix}')]
+        self.raw_dtype = np.dtype(raw_fields)
+        out_fields = []
+        for name in self.columns:
+            raw_type = self.raw_dtype.fields[name][0]
+            if self.scales[name] is not None or raw_type.kind == 'f':
+                out_fields.append((name, 'f8'))
+            else:
+                out_fields.append((name, raw_type.newbyteorder('=')))
+        self.dtype = np.dtype(out_fields)
+
+    @property
+    def decodable(self):
+        return self.struct is not None
+
+    def unpack(self, packet):
+        '''
+        Scaled field values of one whole packet, in the order of self.names
+        '''
+        values = self.struct.unpack_from(packet, self.prefix)
+        return tuple(value if convert is None else convert(value) for value, convert in zip(values, self.converters))
+
+    def plot_positions(self):
+        '''
+        plot with the field names replaced by their positions in unpack()
+        '''
+        position = {name: i for i, name in enumerate(self.names)}
+        return {key: [[position[name] for name in names] for names in sensors] for key, sensors in self.plot.items()}
+
+
+COMPILED_SCHEMAS = {}
+
+
+def get_schema(data_type, packet_length=None):
+    '''
+    The compiled schema of a packet type, every schema is compiled once per packet length
+    '''
+    if packet_length == PACKET_SCHEMAS[data_type]['length']:
+        packet_length = None
+    key = (data_type, packet_length)
+    if key not in COMPILED_SCHEMAS:
+        COMPILED_SCHEMAS[key] = PacketSchema(data_type, packet_length)
+    return COMPILED_SCHEMAS[key]
+
+
+def decodable_types():
+    return [data_type for data_type, spec in PACKET_SCHEMAS.items() if spec.get('fields')]
+
+
+def type_of_code(type_code):
+    '''
+    Packet type of the packet type field value of the device, 'NAK' if unknown
+    '''
+    for data_type, spec in PACKET_SCHEMAS.items():
+        if spec.get('type code') == type_code:
+            return data_type
+    return 'NAK'
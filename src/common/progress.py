@@ -0,0 +1,55 @@
+import time
+
+PROGRESS_INTERVAL = 0.1 # seconds
+PROGRESS_STEP = 1.0 # percent
+
+
+class ProgressThrottle:
+    '''
+    Rate limit progress reports: a value is reported if min_interval seconds passed or the progress
+    advanced by min_step since the last report, reaching length is always reported (once).
+
+    min_interval: Minimum time between two reports, None to only use the step
+    min_step: Minimum progress between two reports, None to only use the time
+    length: The value of a finished progress
+    '''
+    def __init__(self, min_interval=PROGRESS_INTERVAL, min_step=PROGRESS_STEP, length=100):
+        self.min_interval = min_interval
+        self.min_step = min_step
+        self.length = length
+        self.last_time = None
+        self.last_progress = None
+
+    def update(self, progress):
+        '''
+        True if progress should be reported
+        '''
+        now = time.monotonic()
+        if self.last_progress is None:
+            report = True
+        elif progress >= self.length:
+            report = self.last_progress < self.length
+        else:
+            report = ((self.min_interval is not None and now - self.last_time >= self.min_interval)
+                      or (self.min_step is not None and progress - self.last_progress >= self.min_step))
+        if report:
+            self.last_time = now
+            self.last_progress = progress
+        return report
+
+    @property
+    def finished(self):
+        return self.last_progress is not None and self.last_progress >= self.length
+
+
+def throttle_progress(progresses, min_interval=PROGRESS_INTERVAL, min_step=PROGRESS_STEP, length=100):
+    '''
+    Rate limit a progress generator, length is yielded at the end if the generator finished below it.
+    A generator which yielded nothing (e.g. the bootloader did not start) yields nothing.
+    '''
+    throttle = ProgressThrottle(min_interval, min_step, length)
+    for progress in progresses:
+        if throttle.update(progress):
+            yield progress
+    if throttle.last_progress is not None and not throttle.finished:
+        yield length
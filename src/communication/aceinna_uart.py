@@ -1,16 +1,20 @@
-import os
 import sys
 import time
 import curses
 import serial
 import struct
-import asyncio
 import threading
 import collections
-import numpy as np
 
 from ..common.print_center import pass_print, error_print
 from ..common.Jsonf_Creater import JsonCreate
+from .packet_buffer import PacketBuffer
+from .log_pipeline import LogPipeline
+from .acquisition_health import AcquisitionHealth, HEALTH_LOG_INTERVAL
+
+SERIAL_RX_BUFFER_SIZE = 1 << 16 # driver buffer, ~1.4s at 460800 baud so a busy host does not lose bytes
+LOG_STATUS_INTERVAL = 0.1 # seconds between the status updates of a log
+LOG_IDLE_TIMEOUT = 3.0 # seconds without packets which end a log without a UI
 
 class Uart:
     def __init__(self, port, baud, odr=100):
@@ -20,17 +24,11 @@ class Uart:
         self.ser = None
         self.isLog = False
         self.tlock = threading.Lock()
+        self.received = threading.Event() # set by receive() when packets were queued
         self.myqueue = collections.deque(maxlen=1000 * self.odr)
-        self.pkt_info_dict = {
-            'S1': ([0x53, 0x31], 31),
-            'S2': ([0x53, 0x32], 45),
-            'F1': ([0x46, 0x31], 61),
-            'A1': ([0x41, 0x31], 39),
-            'A2': ([0x41, 0x32], 37),
-            'FM': ([0x46, 0x4D], 95),
-            'S3': ([0x55, 0xAA, 0x24], 40),
-            'AT': ([0xBD, 0XDB, 0x54], 39)
-        }
+        self.packet_lengths = {} # packet lengths reported by the device, see pkt_info_update()
+        self.log_pipeline = None # the LogPipeline of the current or last log, for its status()
+        self.counters = AcquisitionHealth(baud, odr) # see health()
 
     def ser_init(self):
         try:
@@ -40,7 +38,7 @@ class Uart:
                                     stopbits=serial.STOPBITS_ONE, 
                                     bytesize=serial.EIGHTBITS,
                                     timeout=0.1)
-            self.ser.set_buffer_size(rx_size=2048, tx_size=2048)
+            self.ser.set_buffer_size(rx_size=SERIAL_RX_BUFFER_SIZE, tx_size=2048)
         except serial.SerialException as e:
             error_print("Error occurred while trying to create serial port")
             self.ser = None
@@ -61,108 +59,144 @@ class Uart:
                 self.ser.close()
                 # pass_print("Serial port is closed.")
 
-    def rev_data_to_buffer(self, data_type, data_length):
+    def rev_data_to_buffer(self, data_type, data_length, checksum=None):
         '''
         This function is used to receive and play serial port data
         '''
-        buffer = b''
+        buffer = PacketBuffer(data_type, data_length)
+        self.counters.reset(checksum)
         self.isLog = True
         self.ser.flushInput()
         self.ser.flushOutput()
         while self.isLog:
-            data_size = self.ser.in_waiting
-            data = self.ser.read(data_size)
-            buffer += data
-            while len(buffer) >= data_length:
-                packet_header_pos = buffer.find(data_type)
-                packet_ender_pos = packet_header_pos + data_length
-                if packet_header_pos != -1 and packet_ender_pos <= len(buffer):
-                    packet = buffer[packet_header_pos: packet_ender_pos]
-                    self.tlock.acquire()
-                    self.myqueue.append(bytes(packet))
-                    self.tlock.release()
-                    buffer = buffer[packet_ender_pos:]
-                else:
-                    break
-            time.sleep(0.01)
+            self.receive(buffer)
         self.myqueue.clear()
 
-    async def rev_data_to_buffer_(self, data_type, data_length):
+    def receive(self, buffer):
         '''
-        This function is used to receive and play serial port data
+        Read the bytes which complete the next packet (at least) into the framing buffer
+        and queue the complete packets in one batch
         '''
-        buffer = b''
-        self.isLog = True
-        self.ser.flushInput()
-        self.ser.flushOutput()
-        while self.isLog:
-            data_size = self.ser.in_waiting
-            data = self.ser.read(data_size)
-            buffer += data
-            while len(buffer) >= data_length:
-                packet_header_pos = buffer.find(data_type)
-                packet_ender_pos = packet_header_pos + data_length
-                if packet_header_pos != -1 and packet_ender_pos <= len(buffer):
-                    packet = buffer[packet_header_pos: packet_ender_pos]
-                    self.myqueue.append(bytes(packet))
-                    buffer = buffer[packet_ender_pos:]
-                else:
-                    break
-            await asyncio.sleep(0.01)
-        self.myqueue.clear()
+        data = self.read_waiting(buffer.packet_length - len(buffer))
+        if not data:
+            return
+        buffer.feed(data)
+        packets = buffer.packets()
+        self.counters.framed(buffer, packets)
+        if packets:
+            with self.tlock:
+                dropped = max(len(self.myqueue) + len(packets) - self.myqueue.maxlen, 0) # the deque drops the oldest
+                self.myqueue.extend(packets)
+            self.counters.queued(len(self.myqueue), self.myqueue.maxlen, dropped)
+            self.received.set()
 
-    async def log_data_to_file_(self, logf_name):
-        while self.isLog == False:
-            await asyncio.sleep(0.1)
-        data_dir = ".\data"
-        if not os.path.exists(data_dir):
-            os.mkdir(data_dir)
-        logf = open(logf_name, 'wb')
-        timeout = 1 / self.odr
-        while self.isLog:
-            while len(self.myqueue) > 0:
-                data = self.myqueue.popleft()
-                logf.write(data)
-            await asyncio.sleep(timeout)
+    def read_waiting(self, min_size=1):
+        '''
+        Block until min_size bytes arrived or the port timeout passed, returns them with all other waiting bytes.
+        The thread sleeps in the driver (select on posix, overlapped I/O on Windows) instead of polling in_waiting,
+        so it wakes as soon as the data is there and uses no CPU while the port is idle.
+        '''
+        start = time.perf_counter()
+        data = self.ser.read(max(self.ser.in_waiting, min_size, 1))
+        self.counters.read(len(data), time.perf_counter() - start)
+        return data
 
-    async def data_log_(self, data_type, logf_name, stdscr):
-        data_length = self.pkt_info_dict.get(data_type)[1]
-        if data_type == 'S3' or data_type == 'AT':
-            data_type = bytes(self.pkt_info_dict.get(data_type)[0])
-        else:
-            data_type = bytes([0x55,0x55] + self.pkt_info_dict.get(data_type)[0])
+    def wait_packets(self, timeout=0.1):
+        '''
+        Block until receive() queued packets or timeout passed
+        '''
+        self.received.wait(timeout)
+        self.received.clear()
+
+    def health(self):
+        '''
+        The counters and rates of the current or last acquisition, see acquisition_health.AcquisitionHealth
+        '''
+        return self.counters.snapshot()
 
-        async def supervisory_(stdscr):
+    def data_log(self, data_type, logf_name, stdscr, log_options=None):
+        '''
+        Log until 'S' is pressed, the packets are read and written by a LogPipeline, the UI only shows its status
+
+        log_options: the keyword arguments of log_writer.LogWriter (block size, fsync policy)
+        '''
+        schema = self.packet_schema(data_type)
+        pipeline = LogPipeline(self, schema.header, schema.packet_length, logf_name, log_options=log_options,
+                               checksum=schema.checksum)
+        self.log_pipeline = pipeline
+        pipeline.start()
+        health_time = time.time()
+        try:
             stdscr.nodelay(True)
             stdscr.addstr(2, 0, "Press 'S' to stop logging.")
-            stdscr.refresh()
             key = stdscr.getch()
-            while key != ord('s'):
+            while key not in [ord('s'), ord('S')] and pipeline.running:
+                self.show_log_status(stdscr, pipeline.status())
+                if time.time() - health_time >= HEALTH_LOG_INTERVAL:
+                    health_time = time.time()
+                    self.show_health(stdscr)
+                time.sleep(LOG_STATUS_INTERVAL)
                 key = stdscr.getch()
-                await asyncio.sleep(0.01)
-            self.isLog = False
-            stdscr.move(2, 0)
-            stdscr.clrtoeol()
+        finally:
+            status = pipeline.stop()
+        self.show_log_status(stdscr, status)
+        self.show_health(stdscr)
+        writer = status['writer']
+        stdscr.addstr(4, 0, f"{writer['bytes written'] / 1024:.0f} KB in {writer['writes']} writes, "
+                            f"write latency max {writer['write latency max ms']:.1f} ms, {writer['fsyncs']} fsyncs")
+        stdscr.move(2, 0)
+        stdscr.clrtoeol()
+        if status['error'] is not None:
+            stdscr.addstr(2, 0, f"Data logging stopped: {status['error']}")
+        else:
             stdscr.addstr(2, 0, "Data logging finished.")
-            stdscr.refresh()
-  
-        await asyncio.gather(
-            self.rev_data_to_buffer_(data_type, data_length),
-            self.log_data_to_file_(logf_name),
-            supervisory_(stdscr)
-        )
+        stdscr.refresh()
+
+    def show_log_status(self, stdscr, status):
+        stdscr.move(3, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(3, 0, f"{status['packets written']} packets written, {status['packets dropped']} dropped, "
+                            f"queue {status['queue']}/{status['queue size']}")
+        stdscr.refresh()
+
+    def show_health(self, stdscr):
+        stdscr.move(5, 0)
+        stdscr.clrtoeol()
+        stdscr.addstr(5, 0, self.counters.log_line()[:max(stdscr.getmaxyx()[1] - 1, 0)])
+        stdscr.refresh()
+
+    def data_record(self, data_type, logf_name, duration=None, max_packets=None, log_options=None, idle_timeout=LOG_IDLE_TIMEOUT):
+        '''
+        Log without a UI until duration seconds passed or max_packets packets were written (or both),
+        yields the number of packets written so far. The log fails with a TimeoutError (see log_pipeline.status())
+        when no packet arrived for idle_timeout seconds, None to wait forever.
+        '''
+        schema = self.packet_schema(data_type)
+        pipeline = LogPipeline(self, schema.header, schema.packet_length, logf_name, max_packets, log_options,
+                               schema.checksum)
+        self.log_pipeline = pipeline
+        pipeline.start()
+        start_time = time.time()
+        try:
+            while pipeline.running and (duration is None or time.time() - start_time < duration):
+                if idle_timeout is not None and pipeline.idle() > idle_timeout:
+                    pipeline.fail(TimeoutError(f'no packets received for {idle_timeout:g} s'))
+                    break
+                yield pipeline.packets_written
+                remaining = LOG_STATUS_INTERVAL if duration is None else duration - (time.time() - start_time)
+                time.sleep(max(min(remaining, LOG_STATUS_INTERVAL), 0))
+            pipeline.stop()
+            yield pipeline.packets_written
+        finally:
+            pipeline.stop()
 
-    def data_log(self, data_type, logf_name, stdscr):
-        asyncio.run(self.data_log_(data_type, logf_name, stdscr)) 
-        
     def write_read_response(self, packet, resp_length=None):
         self.ser.write(packet)
         start_time = time.time()
         resp_pos = -1
         data = b''
         while time.time() - start_time < 3:
-            read_size = self.ser.in_waiting
-            data += self.ser.read(read_size)
+            data += self.read_waiting()
             if packet[:4] == bytes([0x55, 0x55, 0x47, 0x50]): # UUGP
                 resp_header = packet[:2] + packet[5:7]
             else:
@@ -178,131 +212,56 @@ class Uart:
                     return True, resp
         return False, None
 
+    def packet_schema(self, data_type):
+        from ..common.packet_schema import get_schema # numpy, only needed for logging and live data
+
+        return get_schema(data_type, self.packet_lengths.get(data_type))
+
     def pkt_info_update(self, data_type):
-        if data_type == 'S3' or data_type == 'AT':
+        '''
+        Read the packet length from the length byte of the received packets (Aceinna packets only)
+        '''
+        from ..common.packet_schema import get_schema
+
+        data_type_payload = get_schema(data_type).header
+        if data_type_payload[:2] != bytes([0x55, 0x55]):
             return
-        data_type_payload = bytes([0x55, 0x55] + self.pkt_info_dict[data_type][0])
         data = b''
         start_time = time.time()
         while time.time() - start_time < 3:
-            read_size = self.ser.in_waiting
-            data += self.ser.read(read_size)
+            data += self.read_waiting()
             data_header_pos = data.find(data_type_payload)
             if data_header_pos != -1 and len(data) >= data_header_pos + 5:
                 data_length = data[data_header_pos + 4] + 7
-                self.pkt_info_dict[data_type] = (self.pkt_info_dict[data_type][0], data_length)
+                self.packet_lengths[data_type] = data_length
                 break
         
     def realtime_data(self, stdscr, data_type, parser):
         '''
         data_type: The type of the data to be visualized
-        parser: parse function of data
+        parser: decoder of a whole packet, e.g. PacketSchema.unpack
         '''
         idx = 20 if self.odr > 50 else 10 if self.odr == 50 else self.odr # 20hz
         cnt = 0
         retry_times = 0
-        x, y, z = 4, 5, -2 # Aceinna packet protocol: x(num of packet type bytes) y(num of packet type bytes + num of payload length bytes) z(negative num of crc bytes) 
-        packet_type_payload = [0x55, 0x55] + self.pkt_info_dict[data_type][0]
-        data_length = self.pkt_info_dict.get(data_type)[1]
-        if data_type == 'S1':
-            target_data_pos = {'accels': [[0, 1, 2]],
-                               'gyros': [[3, 4, 5]],
-                               'temps': [[9]],
-                               'angles': []
-                               }
-        elif data_type == 'S2':
-            target_data_pos = {'accels': [[2, 3, 4]],
-                               'gyros': [[5, 6, 7]],
-                               'temps': [[8]],
-                               'angles': []
-                               }
-        elif data_type == 'S3':
-            x, y, z = 3, 3, -1
-            target_data_pos = {'accels': [[4, 5, 6]],
-                               'gyros': [[1, 2, 3]],
-                               'temps': [[7]],
-                               'angles': []
-                               }
-            packet_type_payload = self.pkt_info_dict[data_type][0]
-        elif data_type == 'A1':
-            target_data_pos = {'accels': [[6, 7, 8]],
-                               'gyros': [[3, 4, 5]],
-                               'temps': [[12]],
-                               'angles': [[0, 1]]
-                               }
-        elif data_type == 'A2':
-            target_data_pos = {'accels': [[6, 7, 8]],
-                               'gyros': [[3, 4, 5]],
-                               'temps': [[9]],
-                               'angles': [[0, 1]]
-                               }
-        elif data_type == 'FM':
-            chip_num = int((self.pkt_info_dict[data_type][1] - 11) / 28)
-            if chip_num == 1:
-                target_data_pos = {'accels': [[0, 1, 2]],
-                                'gyros': [[3, 4, 5]],
-                                'temps': [[6]],
-                                'angles': []
-                                }
-            elif chip_num == 2:
-                target_data_pos = {'accels': [[0, 1, 2], [7, 8, 9]],
-                               'gyros': [[3, 4, 5], [10, 11, 12]],
-                               'temps': [[6], [13]],
-                               'angles': []
-                                }
-            elif chip_num == 3:
-                target_data_pos = {'accels': [[0, 1, 2], [7, 8, 9], [14, 15, 16]],
-                               'gyros': [[3, 4, 5], [10, 11, 12], [17, 18, 19]],
-                               'temps': [[6], [13], [20]],
-                               'angles': []
-                                }
-            elif chip_num == 4:
-                target_data_pos = {'accels': [[0, 1, 2], [7, 8, 9], [14, 15, 16], [21, 22, 23]],
-                               'gyros': [[3, 4, 5], [10, 11, 12], [17, 18, 19], [24, 25, 26]],
-                               'temps': [[6], [13], [20], [27]],
-                               'angles': []
-                                }
-        elif data_type == 'AT':
-            x, y, z = 3, 3, -2
-            target_data_pos = {'accels': [[3, 4, 5]],
-                               'gyros': [[0, 1, 2]],
-                               'temps': [[6]],
-                               'angles': []
-                               }
-            packet_type_payload = self.pkt_info_dict[data_type][0]
+        schema = self.packet_schema(data_type)
+        packet_type_payload = schema.header
+        data_length = schema.packet_length
+        target_data_pos = schema.plot_positions()
 
-        rev_thread = threading.Thread(target=self.rev_data_to_buffer, args=(bytes(packet_type_payload), data_length))
+        rev_thread = threading.Thread(target=self.rev_data_to_buffer, args=(packet_type_payload, data_length, schema.checksum))
         rev_thread.start() 
         start_time = time.time()
         while self.isLog:
             if len(self.myqueue) != 0:
                 data = self.myqueue.popleft()
-                if data[:x] == bytes(packet_type_payload):
+                if data[:len(packet_type_payload)] == packet_type_payload:
                     cnt += 1
                     if cnt == self.odr / idx:
-                        payload = data[y:z]
-                        if data_type == 'FM':
-                            latest = parser(payload, chip_num)
-                        else:
-                            latest = parser(payload)
-                        accels, gyros, temps, angles = [], [], [], []
-                        for i, key in enumerate(target_data_pos):
-                            if key == 'accels':
-                                for lst in target_data_pos[key]:
-                                    accels.append([latest[i] for i in lst]) 
-                            elif key == 'gyros':
-                                for lst in target_data_pos[key]:
-                                    gyros.append([latest[i] for i in lst])
-                            elif key == 'temps':
-                                for lst in target_data_pos[key]:
-                                    temps.append([latest[i] for i in lst])
-                            elif key == 'angles':
-                                for lst in target_data_pos[key]:
-                                    angles.append([latest[i] for i in lst]) 
-                        mylatest = [accels, gyros, temps, angles]
-                        for lst in mylatest:
-                            if len(lst) == 0:
-                                mylatest.remove(lst)
+                        latest = parser(data)
+                        mylatest = []
+                        for key in ['accels', 'gyros', 'temps', 'angles']:
+                            mylatest.append([[latest[i] for i in lst] for lst in target_data_pos[key]] or [[]])
 
                         '''data: np.array{[[[ax1, ay1, az1], [ax2, ay2, az2], [ax3, ay3, az3]],
                           [[gx1, gy1, gz1], [gx2, gy2, gz2], [gx3, gy3, gz3]],
@@ -319,11 +278,13 @@ class Uart:
                         self.ser_close()
                         time.sleep(0.1)
                         self.ser_init()
-                        rev_thread = threading.Thread(target=self.rev_data_to_buffer, args=(data_length,))
+                        rev_thread = threading.Thread(target=self.rev_data_to_buffer, args=(packet_type_payload, data_length, schema.checksum))
                         rev_thread.start() 
                 if retry_times >= 3:
                     self.isLog = False
                     stdscr.addstr(2, 0, "Data visualization inital failed, Check your User Setting and try again")
             elif time.time() - start_time > 3:
                 self.isLog = False
-                stdscr.addstr(2, 0, "Data visualization inital failed, Check your User Setting and try again")
\ No newline at end of file
+                stdscr.addstr(2, 0, "Data visualization inital failed, Check your User Setting and try again")
+            else:
+                self.wait_packets()
\ No newline at end of file
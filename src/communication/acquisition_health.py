@@ -0,0 +1,111 @@
+import time
+
+from ..common.crc import check_packet
+
+HEALTH_RATE_WINDOW = 1.0 # seconds, the current rates are measured over at least this long
+HEALTH_LOG_INTERVAL = 1.0 # seconds between the health lines of a log
+
+
+class AcquisitionHealth:
+    '''
+    Counters of the data acquisition of a Uart, to prove a capture is complete and to size the baud rate and ODR:
+
+    bytes read, read calls and their latency (Uart.read_waiting)
+    packets framed, checksum failures, resync events and the bytes skipped by them (PacketBuffer)
+    packets dropped because a queue was full and the high water mark of the queue in use
+    (the packets of Uart.myqueue or the batches of the LogPipeline handoff)
+
+    The counters and the rate window are only updated by the reader thread (read() runs at least once per port
+    timeout, so the rates also drop when no data arrives). snapshot() and log_line() only read them and may be
+    called from any thread.
+    '''
+    def __init__(self, baud, odr):
+        self.baud = baud
+        self.odr = odr
+        self.reset()
+
+    def reset(self, checksum=None):
+        '''
+        Start counting a new acquisition, checksum: the checksum of its packets as in packet_schema
+        '''
+        self.checksum = checksum
+        self.started = time.perf_counter()
+        self.bytes_read = 0
+        self.reads = 0
+        self.read_time = 0.0
+        self.max_read = 0.0
+        self.packets_framed = 0
+        self.checksum_failures = 0
+        self.resyncs = 0
+        self.bytes_discarded = 0
+        self.packets_dropped = 0
+        self.queue_high_water = 0
+        self.queue_size = 0
+        self.sample = (self.started, 0, 0) # time, bytes read and packets framed at the start of the rate window
+        self.rates = (0.0, 0.0) # bytes and packets per second of the last window
+
+    def read(self, size, elapsed):
+        self.bytes_read += size
+        self.reads += 1
+        self.read_time += elapsed
+        self.max_read = max(self.max_read, elapsed)
+        now = time.perf_counter()
+        start, bytes_read, packets_framed = self.sample
+        if now - start >= HEALTH_RATE_WINDOW:
+            self.rates = ((self.bytes_read - bytes_read) / (now - start), (self.packets_framed - packets_framed) / (now - start))
+            self.sample = (now, self.bytes_read, self.packets_framed)
+
+    def framed(self, buffer, packets):
+        '''
+        Count the packets framed by a PacketBuffer, check their checksums and take its resync counters
+        '''
+        self.packets_framed += len(packets)
+        if self.checksum is not None:
+            for packet in packets:
+                if not check_packet(packet, self.checksum):
+                    self.checksum_failures += 1
+        self.resyncs = buffer.resyncs
+        self.bytes_discarded = buffer.discarded
+
+    def queued(self, depth, size, dropped=0):
+        '''
+        depth: entries in the queue after a put, size: its capacity, dropped: packets which did not fit
+        '''
+        self.queue_high_water = max(self.queue_high_water, depth)
+        self.queue_size = size
+        self.packets_dropped += dropped
+
+    def snapshot(self):
+        elapsed = time.perf_counter() - self.started
+        rates = self.rates
+        if self.sample[0] == self.started and elapsed > 0: # the averages until the first window is complete
+            rates = (self.bytes_read / elapsed, self.packets_framed / elapsed)
+        return {
+            'seconds': elapsed,
+            'bytes read': self.bytes_read,
+            'packets framed': self.packets_framed,
+            'packets dropped': self.packets_dropped,
+            'checksum failures': self.checksum_failures,
+            'resyncs': self.resyncs,
+            'bytes discarded': self.bytes_discarded,
+            'queue high water': self.queue_high_water,
+            'queue size': self.queue_size,
+            'bytes per second': rates[0],
+            'packets per second': rates[1],
+            'average packets per second': self.packets_framed / elapsed if elapsed > 0 else 0.0,
+            'expected packets per second': self.odr,
+            'link load': rates[0] * 10 / self.baud if self.baud else 0.0, # 10 bits per byte with 8N1
+            'read calls': self.reads,
+            'read latency mean ms': self.read_time / self.reads * 1000 if self.reads else None,
+            'read latency max ms': self.max_read * 1000,
+        }
+
+    def log_line(self, health=None):
+        health = health or self.snapshot()
+        latency = health['read latency mean ms']
+        return (f"{health['packets per second']:.0f}/{health['expected packets per second']} pkt/s, "
+                f"{health['bytes per second'] / 1024:.1f} KB/s ({health['link load']:.0%} of the link), "
+                f"{health['packets framed']} framed, {health['packets dropped']} dropped, "
+                f"{health['checksum failures']} bad checksums, {health['resyncs']} resyncs "
+                f"({health['bytes discarded']} B), queue high water {health['queue high water']}/{health['queue size']}, "
+                f"read {latency or 0:.1f}/{health['read latency max ms']:.1f} ms mean/max")
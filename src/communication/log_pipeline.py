@@ -0,0 +1,181 @@
+import os
+import time
+import queue
+import threading
+
+from .packet_buffer import PacketBuffer
+from .log_writer import LogWriter
+
+LOG_QUEUE_SECONDS = 60 # the handoff holds this many seconds of batches, a batch holds one packet at least
+LOG_PUT_TIMEOUT = 0.5 # seconds the reader waits for room in the handoff before it drops a batch
+
+
+class LogPipeline:
+    '''
+    Log the packets of a Uart to a file with two threads:
+
+    reader: reads the port (Uart.read_waiting), frames the packets (PacketBuffer) and hands them over in batches
+    writer: writes the batches to the file through a LogWriter
+
+    The handoff between them is bounded. When the writer falls behind (disk stall, loaded machine) the reader
+    waits up to LOG_PUT_TIMEOUT for room while the serial driver buffers the port (backpressure), only then the
+    batch is dropped and counted. The UI does not take part in the data path, it only reads status().
+
+    uart: an open Uart
+    header, packet_length: the packets to log
+    max_packets: stop after this many packets were written
+    log_options: the keyword arguments of LogWriter (block size, fsync policy)
+    checksum: the checksum of the packets as in packet_schema, the failures are counted in uart.counters
+    '''
+    def __init__(self, uart, header, packet_length, logf_name, max_packets=None, log_options=None, checksum=None):
+        self.uart = uart
+        self.buffer = PacketBuffer(header, packet_length)
+        self.logf_name = logf_name
+        self.max_packets = max_packets
+        self.log_options = log_options or {}
+        self.checksum = checksum
+        self.logf = None
+        self.handoff = queue.Queue(maxsize=max(int(LOG_QUEUE_SECONDS * uart.odr), 1))
+        self.running = False
+        self.error = None # the exception which ended the log early
+        self.packets_read = 0
+        self.packets_written = 0
+        self.packets_dropped = 0
+        self.batches_dropped = 0
+        self.bytes_written = 0
+        self.queue_high_water = 0
+        self.reader_blocked = 0.0 # seconds the reader waited for room in the handoff
+        self.last_packet = None # time.perf_counter() of the last framed packet, or of start()
+        self.reader = threading.Thread(target=self.read, daemon=True)
+        self.writer = threading.Thread(target=self.write, daemon=True)
+
+    def start(self):
+        log_dir = os.path.dirname(self.logf_name)
+        if log_dir:
+            os.makedirs(log_dir, exist_ok=True)
+        self.logf = LogWriter(self.logf_name, **self.log_options)
+        try:
+            self.uart.ser.flushInput()
+            self.uart.ser.flushOutput()
+            self.uart.counters.reset(self.checksum)
+            self.running = True
+            self.last_packet = time.perf_counter()
+            self.reader.start()
+            self.writer.start()
+        except BaseException:
+            self.running = False
+            if self.reader.is_alive():
+                self.reader.join()
+            self.logf.close() # the writer thread, which closes it otherwise, did not start
+            raise
+
+    def stop(self):
+        '''
+        Stop reading, write what was handed over and close the file, returns status()
+        '''
+        self.running = False
+        if self.reader.is_alive():
+            self.reader.join()
+        if self.writer.is_alive():
+            self.writer.join()
+        return self.status()
+
+    def read(self):
+        try:
+            while self.running:
+                data = self.uart.read_waiting(self.buffer.packet_length - len(self.buffer))
+                if not data:
+                    continue
+                self.buffer.feed(data)
+                packets = self.buffer.packets()
+                self.uart.counters.framed(self.buffer, packets)
+                if packets:
+                    self.last_packet = time.perf_counter()
+                    self.packets_read += len(packets)
+                    self.hand_over(packets)
+        except Exception as e: # e.g. the device was unplugged
+            self.fail(e)
+        finally:
+            while self.writer.is_alive(): # tell the writer there is no more data
+                try:
+                    self.handoff.put(None, timeout=0.1)
+                    break
+                except queue.Full:
+                    pass
+
+    def hand_over(self, packets):
+        start = time.perf_counter()
+        dropped = 0
+        try:
+            self.handoff.put(packets, timeout=LOG_PUT_TIMEOUT)
+        except queue.Full:
+            dropped = len(packets)
+            self.packets_dropped += dropped
+            self.batches_dropped += 1
+        self.reader_blocked += time.perf_counter() - start
+        self.queue_high_water = max(self.queue_high_water, self.handoff.qsize())
+        self.uart.counters.queued(self.handoff.qsize(), self.handoff.maxsize, dropped)
+
+    def write(self):
+        try:
+            while True:
+                try:
+                    packets = self.handoff.get(timeout=min(self.logf.flush_interval, self.logf.fsync_interval))
+                except queue.Empty:
+                    if self.error is None:
+                        self.write_tick()
+                    continue
+                if packets is None:
+                    break
+                if self.max_packets is not None:
+                    packets = packets[:self.max_packets - self.packets_written]
+                if not packets or self.error is not None:
+                    continue # after the packet limit or a write error the handoff is drained until the reader stops
+                try:
+                    self.logf.writelines(packets)
+                except OSError as e:
+                    self.fail(e)
+                    continue
+                self.packets_written += len(packets)
+                self.bytes_written += len(packets) * self.buffer.packet_length
+                if self.max_packets is not None and self.packets_written >= self.max_packets:
+                    self.running = False
+        finally:
+            try:
+                self.logf.close() # the last partial block and the final fsync
+            except OSError as e:
+                self.fail(e)
+
+    def write_tick(self):
+        try:
+            self.logf.tick()
+        except OSError as e:
+            self.fail(e)
+
+    def fail(self, error):
+        if self.error is None:
+            self.error = error
+        self.running = False
+
+    def idle(self):
+        '''
+        Seconds since the last packet was framed
+        '''
+        return time.perf_counter() - self.last_packet if self.last_packet is not None else 0.0
+
+    def status(self):
+        return {
+            'running': self.running,
+            'packets read': self.packets_read,
+            'packets written': self.packets_written,
+            'packets dropped': self.packets_dropped,
+            'batches dropped': self.batches_dropped,
+            'bytes written': self.bytes_written,
+            'queue': self.handoff.qsize(),
+            'queue size': self.handoff.maxsize,
+            'queue high water': self.queue_high_water,
+            'reader blocked': self.reader_blocked,
+            'unframed bytes': self.buffer.discarded,
+            'error': None if self.error is None else str(self.error),
+            'writer': self.logf.stats() if self.logf is not None else None,
+        }
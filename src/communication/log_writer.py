@@ -0,0 +1,152 @@
+import os
+import time
+
+LOG_BLOCK_SIZE = 1 << 20 # 1MB
+LOG_FLUSH_INTERVAL = 1.0 # seconds, a partial block is written at least this often
+FSYNC_POLICIES = ['never', 'size', 'time']
+
+
+def writer_options(log_setting):
+    '''
+    The LogWriter keyword arguments of the 'myLog' settings
+    '''
+    return {'block_size': int(log_setting.get('block size kb', LOG_BLOCK_SIZE >> 10)) << 10,
+            'fsync': log_setting.get('fsync', 'never'),
+            'fsync_bytes': int(log_setting.get('fsync mb', 16) * (1 << 20)),
+            'fsync_interval': log_setting.get('fsync seconds', 5.0)}
+
+
+class LogWriter:
+    '''
+    Write-combining writer of a log file. The data is copied into a preallocated block which is written with one
+    system call when it is full, the blocks end on multiples of block_size in the file. A partial block is written
+    when flush_interval seconds passed (see tick()), so a crash loses at most that much data.
+
+    fsync: 'never' (the OS writes the cache back), 'size' (every fsync_bytes written) or 'time' (every
+           fsync_interval seconds), the file is synced on close unless the policy is 'never'
+
+    stats() reports the write throughput and the latency of the write and fsync calls.
+    '''
+    def __init__(self, path, block_size=LOG_BLOCK_SIZE, fsync='never', fsync_bytes=16 << 20, fsync_interval=5.0,
+                 flush_interval=LOG_FLUSH_INTERVAL):
+        if fsync not in FSYNC_POLICIES:
+            raise ValueError(f'unknown fsync policy {fsync}, choose from {FSYNC_POLICIES}')
+        self.path = path
+        self.block_size = block_size
+        self.fsync = fsync
+        self.fsync_bytes = fsync_bytes
+        self.fsync_interval = fsync_interval
+        self.flush_interval = flush_interval
+        self.block = bytearray(block_size)
+        self.pending = 0 # bytes in self.block
+        self.offset = 0 # bytes written to the file
+        self.synced = 0 # bytes synced to the disk
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_TRUNC | getattr(os, 'O_BINARY', 0))
+        self.opened = time.perf_counter()
+        self.closed = None
+        self.last_flush = self.opened
+        self.last_sync = self.opened
+        self.writes = 0
+        self.write_time = 0.0
+        self.max_write = 0.0
+        self.fsyncs = 0
+        self.fsync_time = 0.0
+        self.max_fsync = 0.0
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+    def write(self, data):
+        self.append(data)
+        self.tick()
+
+    def writelines(self, chunks):
+        '''
+        Write a batch of packets (bytes or memoryview)
+        '''
+        self.append(b''.join(chunks))
+        self.tick()
+
+    def append(self, data):
+        view = memoryview(data)
+        while len(view):
+            room = self.block_size - (self.offset + self.pending) % self.block_size # bytes to the next block end
+            size = min(room, len(view))
+            if self.pending == 0 and size == room:
+                self.write_out(view[:size]) # a whole block of data, written without the copy
+            else:
+                self.block[self.pending:self.pending + size] = view[:size]
+                self.pending += size
+                if size == room:
+                    self.flush()
+            view = view[size:]
+
+    def tick(self):
+        '''
+        Write the partial block and sync by the policy if their time has come, call it when there is no data
+        '''
+        now = time.perf_counter()
+        sync = self.fsync == 'time' and now - self.last_sync >= self.fsync_interval
+        if self.pending and (sync or now - self.last_flush >= self.flush_interval):
+            self.flush()
+        if sync and self.offset > self.synced:
+            self.sync()
+
+    def flush(self):
+        if self.pending:
+            pending, self.pending = self.pending, 0
+            self.write_out(memoryview(self.block)[:pending])
+
+    def write_out(self, view):
+        start = time.perf_counter()
+        size = len(view)
+        while len(view):
+            view = view[os.write(self.fd, view):]
+        elapsed = time.perf_counter() - start
+        self.writes += 1
+        self.write_time += elapsed
+        self.max_write = max(self.max_write, elapsed)
+        self.offset += size
+        self.last_flush = start + elapsed
+        if self.fsync == 'size' and self.offset - self.synced >= self.fsync_bytes:
+            self.sync()
+
+    def sync(self):
+        start = time.perf_counter()
+        os.fsync(self.fd)
+        elapsed = time.perf_counter() - start
+        self.fsyncs += 1
+        self.fsync_time += elapsed
+        self.max_fsync = max(self.max_fsync, elapsed)
+        self.synced = self.offset
+        self.last_sync = start + elapsed
+
+    def close(self):
+        if self.fd is None:
+            return
+        try:
+            self.flush()
+            if self.fsync != 'never' and self.offset > self.synced:
+                self.sync()
+        finally:
+            os.close(self.fd)
+            self.fd = None
+            self.closed = time.perf_counter()
+
+    def stats(self):
+        elapsed = (self.closed or time.perf_counter()) - self.opened
+        return {
+            'bytes written': self.offset,
+            'writes': self.writes,
+            'fsyncs': self.fsyncs,
+            'fsync policy': self.fsync,
+            'average rate MB/s': self.offset / elapsed / 1e6 if elapsed > 0 else 0.0,
+            'write throughput MB/s': self.offset / self.write_time / 1e6 if self.write_time > 0 else None,
+            'write latency mean ms': self.write_time / self.writes * 1000 if self.writes else None,
+            'write latency max ms': self.max_write * 1000,
+            'fsync latency mean ms': self.fsync_time / self.fsyncs * 1000 if self.fsyncs else None,
+            'fsync latency max ms': self.max_fsync * 1000,
+        }
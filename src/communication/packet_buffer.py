@@ -0,0 +1,79 @@
+PACKET_BUFFER_SIZE = 1 << 16 # 64KB, >1s of FM packets at 460800 baud
+
+
+class PacketBuffer:
+    '''
+    Framing buffer of the live packets. The received bytes are copied into a preallocated bytearray and
+    the packets are found in place; the bytes left after the last packet are moved to the front only when
+    the end of the buffer is reached, instead of slicing the whole buffer once per packet.
+
+    packets() hands out the complete packets as memoryview slices of one bytes copy per call, so they stay
+    valid after the buffer is reused and can be queued in one batch.
+
+    header: The header of the packets, e.g. b'UUS1'
+    packet_length: The length of a whole packet
+    '''
+    def __init__(self, header, packet_length, size=PACKET_BUFFER_SIZE):
+        self.header = bytes(header)
+        self.packet_length = packet_length
+        self.buffer = bytearray(max(size, 2 * packet_length))
+        self.start = 0 # the first byte which is not framed yet
+        self.end = 0 # the end of the received bytes
+        self.discarded = 0 # bytes skipped while searching for a header
+        self.resyncs = 0 # times bytes were skipped to find the next header
+
+    def __len__(self):
+        return self.end - self.start
+
+    def feed(self, data):
+        '''
+        Append received bytes
+        '''
+        size = len(data)
+        if self.end + size > len(self.buffer):
+            self.compact(size)
+        self.buffer[self.end:self.end + size] = data
+        self.end += size
+
+    def compact(self, room=0):
+        '''
+        Move the unframed bytes to the front, the buffer grows if room bytes still do not fit
+        '''
+        pending = self.end - self.start
+        if pending + room > len(self.buffer):
+            buffer = bytearray(max(2 * len(self.buffer), pending + room))
+            buffer[:pending] = self.buffer[self.start:self.end]
+            self.buffer = buffer
+        else:
+            self.buffer[:pending] = self.buffer[self.start:self.end]
+        self.start, self.end = 0, pending
+
+    def packets(self):
+        '''
+        The complete packets received so far, as a list of memoryview slices
+        '''
+        buffer, header, length = self.buffer, self.header, self.packet_length
+        positions = []
+        pos = self.start
+        while True:
+            found = buffer.find(header, pos, self.end)
+            if found == -1:
+                # no header in the rest, only its first bytes may be at the end
+                pos = max(pos, self.end - len(header) + 1)
+                break
+            if found != pos:
+                self.resyncs += 1
+            if found + length > self.end:
+                pos = found # the start of a partial packet
+                break
+            positions.append(found)
+            pos = found + length
+        self.discarded += pos - self.start - len(positions) * length
+        self.start = pos
+        if self.start == self.end:
+            self.start = self.end = 0 # nothing to move
+        if not positions:
+            return []
+        first = positions[0]
+        view = memoryview(buffer[first:positions[-1] + length]) # the only copy of the packets
+        return [view[p - first:p - first + length] for p in positions]
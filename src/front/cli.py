@@ -0,0 +1,265 @@
+import os
+import sys
+import json
+import glob
+import time
+import argparse
+import contextlib
+
+from ..common.Jsonf_Creater import JsonCreate
+from ..common.progress import throttle_progress
+from ..communication.log_writer import writer_options, FSYNC_POLICIES
+from ..communication.acquisition_health import HEALTH_LOG_INTERVAL
+from ..functions.imu_func import IMUFunc
+
+EXIT_OK = 0
+EXIT_FAILED = 1 # the command ran but did not succeed (no files, no packets logged...)
+EXIT_USAGE = 2 # invalid arguments (argparse)
+EXIT_DEVICE = 3 # the serial port could not be opened or the device did not respond
+EXIT_INTERRUPTED = 130 # Ctrl-C
+
+
+class Cli:
+    '''
+    Headless command line interface for scripts, cron jobs and test rigs:
+
+        python main.py log --duration 60
+        python main.py parse "data/*.bin" --formats csv npz
+        python main.py get 1 2 3
+        python main.py set 1=1 2=5 --permanent
+        python main.py upgrade bin/fw.bin
+
+    Progress and results are printed to stdout as one JSON object per line, e.g.
+    {"event": "progress", "command": "parse", "progress": 42.0}, messages go to stderr. Whatever else the
+    commands print (e.g. the serial port errors of Uart) goes to stderr as well, so stdout only holds the JSON lines.
+    log also prints a "health" event with the acquisition counters of Uart.health() every second.
+    The serial settings default to the setting file of the interactive UI.
+    '''
+    def __init__(self):
+        self.quiet = False
+        self.command = None
+        self.out = sys.stdout # the JSON lines, sys.stdout is sent to stderr while a command runs
+
+    def parser(self):
+        parser = argparse.ArgumentParser(prog='main.py', description='Aceinna IMU tool, run without arguments for the interactive UI')
+        parser.add_argument('--quiet', action='store_true', help='do not print progress')
+        subparsers = parser.add_subparsers(dest='command', required=True)
+
+        def add_serial(subparser):
+            subparser.add_argument('--port', help='serial port, default: myUart->port name')
+            subparser.add_argument('--baud', type=int, help='baud rate, default: myUart->baud rate')
+            subparser.add_argument('--odr', type=int, help='output rate in Hz, default: myUart->output rate')
+
+        log = subparsers.add_parser('log', help='log the packets of the device to a .bin file')
+        add_serial(log)
+        log.add_argument('--duration', type=float, help='seconds to log')
+        log.add_argument('--packets', type=int, help='number of packets to log')
+        log.add_argument('--type', dest='packet_type', help='packet type, default: myPacket->packet type')
+        log.add_argument('--out', help='log file, default: data/<device type>_<packet type>_<time>.bin')
+        log.add_argument('--fsync', choices=FSYNC_POLICIES, help='sync the log to the disk never, every --fsync-mb or every --fsync-seconds, default: myLog->fsync')
+        log.add_argument('--fsync-mb', type=float, help='default: myLog->fsync mb')
+        log.add_argument('--fsync-seconds', type=float, help='default: myLog->fsync seconds')
+
+        parse = subparsers.add_parser('parse', help='parse or convert logs')
+        parse.add_argument('files', nargs='+', help='log files or glob patterns, e.g. "data/*.bin"')
+        parse.add_argument('--formats', nargs='+', help='csv npy npz parquet arrow, default: myParse->export formats')
+        parse.add_argument('--workers', type=int, help='worker processes, default: number of cores')
+        parse.add_argument('--incremental', action='store_true', help='only parse what was appended since the last run')
+        parse.add_argument('--no-cache', action='store_true', help='parse even if the outputs are up to date')
+        parse.add_argument('--stats', action='store_true', help='write the channel statistics as well')
+        parse.add_argument('--packet-range', nargs=2, type=int, metavar=('FIRST', 'STOP'), help='packet numbers to export')
+        parse.add_argument('--time-range', nargs=2, type=float, metavar=('START', 'END'), help='device time range to export')
+        parse.add_argument('--decimate', type=int, default=1, help='export every Nth sample')
+        parse.add_argument('--decimation', choices=['pick', 'mean', 'fir'], default='pick')
+
+        get = subparsers.add_parser('get', help='read fields of the device')
+        add_serial(get)
+        get.add_argument('ids', nargs='+', type=int, help='field ids')
+        get.add_argument('--permanent', action='store_true', help='read the EEPROM (RF) instead of the RAM (GF)')
+
+        set_ = subparsers.add_parser('set', help='set fields of the device')
+        add_serial(set_)
+        set_.add_argument('values', nargs='+', help='id=value with the value in hex, e.g. 1=1 3=5331')
+        set_.add_argument('--permanent', action='store_true', help='write the EEPROM (WF), needs a reboot')
+
+        upgrade = subparsers.add_parser('upgrade', help='upgrade the firmware of the device')
+        add_serial(upgrade)
+        upgrade.add_argument('firmware', help='firmware .bin file')
+        upgrade.add_argument('--device', help='device type, default: myPacket->device type')
+        return parser
+
+    def run(self, argv):
+        '''
+        Run one command, returns the exit code
+        '''
+        try:
+            args = self.parser().parse_args(argv)
+        except SystemExit as e:
+            return EXIT_OK if e.code == 0 else EXIT_USAGE
+        self.quiet = args.quiet
+        self.command = args.command
+        self.out = sys.stdout
+        try:
+            with contextlib.redirect_stdout(sys.stderr):
+                p = JsonCreate().create()
+                return getattr(self, f'cmd_{args.command}')(args, p)
+        except KeyboardInterrupt:
+            self.message('interrupted')
+            return EXIT_INTERRUPTED
+        except SystemExit: # Uart.ser_init() and the firmware upgrade exit when the port or the device fails
+            self.message('the serial port could not be opened or the device failed')
+            return EXIT_DEVICE
+
+    def emit(self, event, **kwargs):
+        print(json.dumps({'event': event, 'command': self.command, **kwargs}), file=self.out, flush=True)
+
+    def message(self, text):
+        print(text, file=sys.stderr, flush=True)
+
+    def report_progress(self, progresses, length=100, **kwargs):
+        for progress in throttle_progress(progresses, length=length):
+            if not self.quiet:
+                self.emit('progress', progress=round(progress, 1), **kwargs)
+
+    def serial(self, args, p):
+        return (args.port or p['myUart']['port name'], args.baud or p['myUart']['baud rate'],
+                args.odr or p['myUart']['output rate'])
+
+    def cmd_log(self, args, p):
+        if args.duration is None and args.packets is None:
+            self.message('log needs --duration or --packets')
+            return EXIT_USAGE
+        com, baud, odr = self.serial(args, p)
+        device_type = p['myPacket']['device type']
+        packet_type = args.packet_type or p['myPacket']['packet type']
+        path = args.out
+        if path is None:
+            time_stamp = time.strftime("%Y_%m_%d_%H_%M_%S", time.localtime())
+            os.makedirs('data', exist_ok=True)
+            path = os.path.join('data', f'{device_type}_{packet_type}_{time_stamp}.bin')
+        log_setting = dict(p.get('myLog', {}))
+        for key, value in [('fsync', args.fsync), ('fsync mb', args.fsync_mb), ('fsync seconds', args.fsync_seconds)]:
+            if value is not None:
+                log_setting[key] = value
+        imu_func = IMUFunc(com, baud, odr)
+        written = [0]
+        start_time = time.time()
+        health_time = [start_time]
+
+        def progresses():
+            for packets in imu_func.imu_data_capture(packet_type, path, args.duration, args.packets, writer_options(log_setting)):
+                written[0] = packets
+                if not self.quiet and time.time() - health_time[0] >= HEALTH_LOG_INTERVAL:
+                    health_time[0] = time.time()
+                    self.emit('health', **imu_func.uut.health())
+                by_time = (time.time() - start_time) / args.duration * 100 if args.duration else 0
+                by_packets = packets / args.packets * 100 if args.packets else 0
+                yield min(max(by_time, by_packets), 100)
+
+        self.report_progress(progresses(), file=path)
+        status = imu_func.uut.log_pipeline.status() if imu_func.uut.log_pipeline is not None else {}
+        health = imu_func.uut.health()
+        self.message(imu_func.uut.counters.log_line(health))
+        self.emit('done', file=path, packets=written[0], dropped=status.get('packets dropped', 0), error=status.get('error'),
+                  writer=status.get('writer'), health=health)
+        if imu_func.uut.log_pipeline is not None and isinstance(imu_func.uut.log_pipeline.error, TimeoutError):
+            return EXIT_DEVICE # the device sent no packets, see Uart.data_record()
+        return EXIT_OK if written[0] > 0 and status.get('error') is None else EXIT_FAILED
+
+    def cmd_parse(self, args, p):
+        from ..functions.parallel_parse import ParallelParser
+
+        data_paths = []
+        for pattern in args.files:
+            for path in sorted(glob.glob(pattern)) or ([pattern] if os.path.isfile(pattern) else []):
+                if path not in data_paths:
+                    data_paths.append(path)
+        if not data_paths:
+            self.message('no files match')
+            return EXIT_FAILED
+        parse_setting = p.get('myParse', {})
+        export_options = {'csv_precision': parse_setting.get('csv precision'),
+                          'csv_delimiter': parse_setting.get('csv delimiter', ',')}
+        parser = ParallelParser(workers=args.workers, export_formats=args.formats or parse_setting.get('export formats', 'csv'),
+                                export_options=export_options, incremental=args.incremental,
+                                use_cache=not args.no_cache and parse_setting.get('parse cache', True),
+                                cache_hash=parse_setting.get('cache hash', False), stats=args.stats,
+                                packet_range=args.packet_range, time_range=args.time_range,
+                                decimate=args.decimate, decimation=args.decimation)
+        try:
+            parser.check_slice(data_paths)
+        except ValueError as e:
+            self.message(str(e))
+            return EXIT_USAGE
+        try:
+            self.report_progress(parser.parse_files(data_paths))
+        except Exception as e: # e.g. an export error, the files parsed before it are in the results
+            self.message(f'parse failed: {e!r}')
+        results = {path: parser.results.get(path, {'status': 'failed', 'rows': None}) for path in data_paths}
+        failed = [path for path, result in results.items() if result['status'] not in ['parsed', 'cached']]
+        for path in failed:
+            self.message(f"{path}: {results[path]['status']}")
+        self.emit('done', files=data_paths, results=results)
+        return EXIT_FAILED if failed else EXIT_OK
+
+    def cmd_get(self, args, p):
+        imu_func = IMUFunc(*self.serial(args, p))
+        if args.permanent:
+            values = imu_func.imu_read_field_val(args.ids)
+        else:
+            values = imu_func.imu_get_field_val(args.ids)
+        if values is None:
+            self.message('the device did not respond')
+            return EXIT_DEVICE
+        self.emit('done', fields={str(id): value for id, value in values.items()})
+        return EXIT_OK
+
+    def cmd_set(self, args, p):
+        values = {}
+        for item in args.values:
+            id, sep, value = item.partition('=')
+            if not sep or not id.isdigit():
+                self.message(f'invalid field {item}, expected id=value')
+                return EXIT_USAGE
+            try:
+                int(value, 16)
+            except ValueError:
+                self.message(f'invalid value {value} of field {id}, expected hex')
+                return EXIT_USAGE
+            values[int(id)] = value
+        imu_func = IMUFunc(*self.serial(args, p))
+        if not imu_func.imu_set_field_val(values, args.permanent):
+            self.message('the device did not acknowledge the fields')
+            return EXIT_DEVICE
+        self.emit('done', fields={str(id): value for id, value in values.items()}, permanent=args.permanent)
+        return EXIT_OK
+
+    def cmd_upgrade(self, args, p):
+        from ..functions.imu_upgrade import BOOT_BUAD_DICT, IMU330BA
+
+        device_type = args.device or p['myPacket']['device type']
+        if device_type not in BOOT_BUAD_DICT:
+            self.message(f'unsupported device type {device_type}, expected one of {", ".join(BOOT_BUAD_DICT)}')
+            return EXIT_USAGE
+        if not os.path.isfile(args.firmware):
+            self.message(f'{args.firmware} not found')
+            return EXIT_FAILED
+        com, baud, odr = self.serial(args, p)
+        unit = IMU330BA(com, baud, odr, args.firmware, device_type)
+        unit.uart.ser_init()
+        unit.UUT = unit.uart.ser
+        try:
+            if not unit.start_bootloader():
+                self.message('jump to bootloader failed')
+                return EXIT_DEVICE
+            self.report_progress(unit.upgrade_fw(), file=args.firmware)
+            time.sleep(1)
+            unit.start_app()
+        finally:
+            unit.uart.ser_close()
+        self.emit('done', file=args.firmware)
+        return EXIT_OK
+
+
+def main(argv=None):
+    return Cli().run(sys.argv[1:] if argv is None else argv)
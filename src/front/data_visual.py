@@ -175,11 +175,11 @@ class Scope:
         return myax_status_lst
 
 class Visual:
-    def __init__(self, stdscr, data_type, maxt, dt, emitter=None, chip_number=None):
+    def __init__(self, stdscr, data_type, maxt, dt, emitter=None, chip_number=None, angles=False):
         self.data_type = data_type
         if data_type == 'FM':
             self.fig, axs = plt.subplots(3, chip_number, figsize=(10, 6))
-        elif data_type == 'A1' or data_type == 'A2':
+        elif angles:
             self.fig, axs = plt.subplots(4, 1, figsize=(10, 6))
         else:
             self.fig, axs = plt.subplots(3, 1, figsize=(10, 6))
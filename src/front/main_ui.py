@@ -2,13 +2,12 @@ import os
 import sys
 import time
 import curses
-import argparse
 import subprocess
 
-from ..communication.aceinna_uart import Uart
 from ..common.Jsonf_Creater import JsonCreate
+from ..communication.log_writer import writer_options
 from ..functions.imu_func import IMUFunc
-from ..functions.imu_upgrade import IMU330BA
+from ..functions.hex_import import import_hex_file
 from .progress_bar import progress_bar
 
 class Front:
@@ -121,7 +120,7 @@ class Front:
             os.makedirs(data_path)
         file_list, file_dict = self.data_folder_manager()
 
-        menu_items = file_list + ['Data Folder'] + ['Back']
+        menu_items = file_list + ['Parse All'] + ['Quality Check'] + ['Noise Analysis'] + ['Data Folder'] + ['Back']
         current_row = 0
         is_running = True
 
@@ -130,7 +129,13 @@ class Front:
             choice = self.process_menu_input(stdscr, menu_items, current_row)
             if choice == -1:
                 selected_item = menu_items[current_row]
-                if selected_item == 'Data Folder':
+                if selected_item == 'Parse All':
+                    self.parse_all(stdscr, list(file_dict.values()))
+                elif selected_item == 'Quality Check':
+                    self.quality_check(stdscr, list(file_dict.values()))
+                elif selected_item == 'Noise Analysis':
+                    self.noise_analysis(stdscr, list(file_dict.values()))
+                elif selected_item == 'Data Folder':
                     self.open_data_folder(stdscr)
                 elif selected_item == 'Back':
                     is_running = False
@@ -234,7 +239,8 @@ class Front:
                 if logFlag == False:
                     imu_func = IMUFunc(com, baud, odr)
                     self.product_register(stdscr, imu_func)                 
-                    imu_func.imu_data_record(data_type=packet_type, logf_name=path, stdscr=stdscr)
+                    imu_func.imu_data_record(data_type=packet_type, logf_name=path, stdscr=stdscr,
+                                             log_options=writer_options(p.get('myLog', {})))
                     logFlag = True
             key = stdscr.getch()                
 
@@ -264,44 +270,80 @@ class Front:
     def data_folder_manager(self):
         folder_path =  '.\\data'
         file_list = []
+        file_dict = {}
         for root, dirs, files in os.walk(folder_path):
+            dirs[:] = [d for d in dirs if not d.endswith('_npy')] # the column folders of the npy export, no logs in them
             for f in files:
-                if f[-3:] == 'bin':
-                    file_list.append(f)
-                elif f[-3:] == 'txt':
-                    append_flag = True
-                    with open(root+"\\"+f, 'r') as txtf:
-                        txt_data = ''
-                        data = txtf.read()
-                        while len(data) != 0:
-                            txt_data += data
-                            data = txtf.read()
-                        txtf.close() 
-                    txt_data = txt_data.replace(" ", "")
-                    bin_data = bytes.fromhex(txt_data)
+                if f[-3:] == 'txt':
+                    try:
+                        import_hex_file(os.path.join(root, f))
+                    except ValueError: # not a hex dump
+                        continue
                     f = f[:-3] + 'bin'
-                    with open(root+"\\"+f, 'wb') as binf:
-                        binf.write(bin_data)
-                        binf.close()
-                    for file_name in file_list:
-                        if f == file_name:
-                            append_flag = False
-                    if append_flag:
-                        file_list.append(f)
-            root = root
-        file_dict = {}
-        for f in file_list:
-            if f[-3:] == 'bin':
-                file_dict.update({f: os.path.join(root, f)})
+                if f[-3:] == 'bin' and f not in file_dict:
+                    file_list.append(f)
+                    file_dict[f] = os.path.join(root, f)
         return file_list, file_dict
 
+    def parse_options(self):
+        p = self.jsonf.create()
+        parse_setting = p.get('myParse', {}) # setting files written by older versions have no 'myParse'
+        slice_setting = parse_setting.get('slice', {})
+        export_options = {'csv_precision': parse_setting.get('csv precision'),
+                          'csv_delimiter': parse_setting.get('csv delimiter', ',')}
+        return {'export_formats': parse_setting.get('export formats', 'csv'), 'export_options': export_options,
+                'incremental': parse_setting.get('incremental', False),
+                'use_cache': parse_setting.get('parse cache', True), 'cache_hash': parse_setting.get('cache hash', False),
+                'stats': parse_setting.get('statistics', False),
+                'packet_range': slice_setting.get('packet range'), 'time_range': slice_setting.get('time range'),
+                'decimate': slice_setting.get('decimate', 1), 'decimation': slice_setting.get('decimation', 'pick')}
+
     @progress_bar(step=0, length=100)
     def parse(self, stdscr, file_path):
-        imu_func = IMUFunc()
-        for progress in imu_func.imu_data_parse(file_path):
-            yield progress
+        from ..functions.parallel_parse import ParallelParser
+
+        parser = ParallelParser(**self.parse_options())
+        try:
+            for progress in parser.parse_files([file_path]):
+                yield progress
+        except ValueError as e: # e.g. a range of a log with several packet types
+            stdscr.addstr(5, 0, str(e))
         # stdscr.addstr(5, 0, "data parse finished")
 
+    @progress_bar(step=0, length=100)
+    def parse_all(self, stdscr, file_paths):
+        from ..functions.parallel_parse import ParallelParser
+
+        parser = ParallelParser(**self.parse_options())
+        try:
+            for progress in parser.parse_files(file_paths):
+                yield progress
+        except ValueError as e:
+            stdscr.addstr(5, 0, str(e))
+
+    @progress_bar(step=0, length=100)
+    def quality_check(self, stdscr, file_paths):
+        from ..functions.parallel_parse import check_files_quality
+
+        for progress in check_files_quality(file_paths):
+            yield progress
+
+    @progress_bar(step=0, length=100)
+    def noise_analysis(self, stdscr, file_paths):
+        p = self.jsonf.create()
+        analysis_setting = p.get('myAnalysis', {})
+        # the output rate is 'NAK' or 0 after an auto update which read an unknown or a quiet rate
+        rates = [rate for rate in (analysis_setting.get('sample rate'), p['myUart']['output rate'])
+                 if isinstance(rate, (int, float)) and rate > 0]
+        if not rates:
+            stdscr.addstr(5, 0, "no sample rate, set myAnalysis->sample rate or myUart->output rate")
+            return
+        rate = rates[0]
+        imu_func = IMUFunc()
+        for i, file_path in enumerate(file_paths):
+            for progress in imu_func.imu_data_allan(file_path, rate, plots=analysis_setting.get('plots', True)):
+                yield (i * 100 + progress) / len(file_paths)
+
     def open_data_folder(self, stdscr):
         current_path = os.getcwd()
         data_path = os.path.join(current_path, "data")
@@ -400,6 +442,8 @@ class Front:
 
     @progress_bar(step=0, length=100)
     def upgrade(self, stdscr, p, fpath):
+        from ..functions.imu_upgrade import IMU330BA
+
         row_num = self.count_used_rows(stdscr)
         com = p["myUart"]['port name']
         baud = p["myUart"]['baud rate']
@@ -443,6 +487,8 @@ class Front:
             stdscr.refresh()
 
     def auto_update_product_settings(self, stdscr, p):
+        from ..common.packet_schema import type_of_code
+
         com = p['myUart']['port name']
         baud = p['myUart']['baud rate']
         odr = p['myUart']['output rate']
@@ -471,24 +517,13 @@ class Front:
         '7': 460800
         }
 
-        packet_type_mapping = {
-        '5331': 'S1',
-        '5332': 'S2',
-        '4131': 'A1',
-        '4132': 'A2',
-        '464d': 'FM',
-        '6132': 'a2',
-        '5333': 'S3',
-        '4154': 'AT'
-        }
-
         for id, value in user_info.items():
             if id == 1:
                 odr = odr_mapping.get(value, 'NAK')
             elif id == 2:
                 baud = baud_mapping.get(value, 'NAK')
             elif id == 3:
-                packet_type = packet_type_mapping.get(value, 'NAK')
+                packet_type = type_of_code(value)
 
         p["myUart"]['output rate'] = odr
         p["myUart"]['baud rate'] = baud
@@ -3,6 +3,8 @@ import time
 import threading
 from functools import wraps
 
+from ..common.progress import throttle_progress
+
 def progress_bar(step, length):
     def decorator(func):
         @wraps(func)
@@ -27,9 +29,9 @@ def progress_bar(step, length):
             # set the progress bar initial value
             progress_min = 0
 
-            # Simulated progress update
-            for index, progress in enumerate(func(*args, **kwargs)):
-                progress += (index + 1) * step
+            # Simulated progress update, the window is redrawn at a limited rate and shows length at the end
+            progresses = (progress + (index + 1) * step for index, progress in enumerate(func(*args, **kwargs)))
+            for progress in throttle_progress(progresses, length=length):
                 progress = round(progress, 1)
                 if progress < length:
                     update_progress(progress)
@@ -0,0 +1,183 @@
+import os
+import json
+import concurrent.futures
+import numpy as np
+
+ALLAN_GROUPS = ['accels', 'rates']
+ALLAN_TAUS_PER_DECADE = 10
+PSD_SEGMENT_LENGTH = 1 << 14
+PSD_SEGMENT_BATCH = 64 # segments transformed at once
+BIAS_INSTABILITY_FACTOR = np.sqrt(2 * np.log(2) / np.pi) # flat floor of the ADEV of flicker noise, ~0.664
+
+
+def analysis_path_of(data_path):
+    return f'{data_path[:-4]}.allan.json'
+
+
+def cluster_sizes(n, taus_per_decade=ALLAN_TAUS_PER_DECADE):
+    '''
+    Log spaced cluster sizes (in samples) from 1 to the largest size with two clusters in n samples
+    '''
+    max_m = (n - 1) // 2
+    if max_m < 1:
+        return np.empty(0, dtype=np.int64)
+    num = int(np.log10(max_m) * taus_per_decade) + 1
+    return np.unique(np.logspace(0, np.log10(max_m), num).astype(np.int64))
+
+
+def overlapping_adev(x, rate, m):
+    '''
+    Overlapping Allan deviation of the samples x at the cluster sizes m.
+
+    The samples are integrated once (cumulative sum), every cluster size is then one vectorized
+    second difference of the integral, O(N) time and memory per cluster size instead of O(N^2).
+
+    returns (tau in seconds, adev in the unit of x)
+    '''
+    theta = np.empty(len(x) + 1)
+    theta[0] = 0
+    np.cumsum(x - np.mean(x), out=theta[1:]) # the ADEV does not depend on the mean, removing it keeps the sum small
+    theta /= rate
+    tau = m / rate
+    adev = np.empty(len(m))
+    for i, mi in enumerate(m.tolist()):
+        d = theta[2 * mi:] - 2 * theta[mi:-mi] + theta[:-2 * mi]
+        adev[i] = np.sqrt(np.dot(d, d) / (2 * tau[i] ** 2 * len(d)))
+    return tau, adev
+
+
+def welch_psd(x, rate, segment_length=PSD_SEGMENT_LENGTH):
+    '''
+    One-sided power spectral density with Welch's method (Hann window, 50% overlap)
+
+    returns (frequency in Hz, psd in unit^2/Hz)
+    '''
+    segment_length = min(segment_length, len(x))
+    step = max(segment_length // 2, 1)
+    window = np.hanning(segment_length) if segment_length > 1 else np.ones(1)
+    segments = np.lib.stride_tricks.sliding_window_view(x, segment_length)[::step]
+    power = np.zeros(segment_length // 2 + 1)
+    for i in range(0, len(segments), PSD_SEGMENT_BATCH):
+        batch = segments[i:i + PSD_SEGMENT_BATCH]
+        batch = (batch - batch.mean(axis=1, keepdims=True)) * window
+        power += (np.abs(np.fft.rfft(batch, axis=1)) ** 2).sum(axis=0)
+    psd = power / (len(segments) * rate * np.dot(window, window))
+    psd[1:(segment_length + 1) // 2] *= 2 # the negative frequencies, DC and Nyquist appear once
+    return np.fft.rfftfreq(segment_length, 1 / rate), psd
+
+
+def noise_coefficients(tau, adev):
+    '''
+    returns (random walk coefficient: the -1/2 slope line of the ADEV at tau = 1s, in unit*sqrt(s),
+             bias instability: the flat floor of the ADEV, in unit,
+             tau of the bias instability)
+    '''
+    if len(tau) < 2:
+        return None, None, None
+    slopes = np.diff(np.log10(adev)) / np.diff(np.log10(tau))
+    i = int(np.argmin(np.abs(slopes + 0.5)))
+    random_walk = np.sqrt(adev[i] * np.sqrt(tau[i]) * adev[i + 1] * np.sqrt(tau[i + 1]))
+    j = int(np.argmin(adev))
+    return float(random_walk), float(adev[j] / BIAS_INSTABILITY_FACTOR), float(tau[j])
+
+
+def analyze_channel(x, rate, taus_per_decade=ALLAN_TAUS_PER_DECADE, segment_length=PSD_SEGMENT_LENGTH):
+    '''
+    Worker of AllanAnalysis: ADEV, PSD and noise coefficients of one channel
+    '''
+    x = np.asarray(x, dtype='f8')
+    tau, adev = overlapping_adev(x, rate, cluster_sizes(len(x), taus_per_decade))
+    freq, psd = welch_psd(x, rate, segment_length)
+    random_walk, bias_instability, bias_tau = noise_coefficients(tau, adev)
+    band = (freq >= rate / 20) & (freq <= rate / 4) # white noise part of the spectrum, below the anti-alias filter
+    noise_density = float(np.sqrt(np.median(psd[band]))) if band.any() else None
+    return {'samples': len(x), 'tau': tau, 'adev': adev, 'freq': freq, 'psd': psd, 'random walk': random_walk,
+            'bias instability': bias_instability, 'bias instability tau': bias_tau, 'noise density': noise_density}
+
+
+class AllanAnalysis:
+    '''
+    Allan deviation and noise density of the accel and gyro channels of a log, every channel is analyzed
+    on its own worker process.
+
+    The report '<data name>.allan.json' holds per channel the ADEV curve, the bias instability (unit),
+    the random walk (unit/sqrt(h), angle random walk of the gyros, velocity random walk of the accels)
+    and the noise density (unit/sqrt(Hz)). The plots '<data name>.adev.png' and '<data name>.psd.png'
+    need matplotlib, which is only imported when they are drawn.
+
+    rate: The sample rate of the log in Hz
+    workers: The number of worker processes, defaults to the number of cores
+    '''
+    def __init__(self, data_path, rate, workers=None, taus_per_decade=ALLAN_TAUS_PER_DECADE,
+                 segment_length=PSD_SEGMENT_LENGTH, plots=True):
+        self.data_path = data_path
+        self.rate = rate
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.taus_per_decade = taus_per_decade
+        self.segment_length = segment_length
+        self.plots = plots
+        self.results = {}
+
+    def run(self, channels, groups):
+        '''
+        channels: {channel name: samples}
+        groups: {channel name: channel group}
+
+        Yields the progress, the report and plots are written at the end
+        '''
+        self.results = {}
+        if channels:
+            with concurrent.futures.ProcessPoolExecutor(max_workers=min(self.workers, len(channels))) as executor:
+                futures = {executor.submit(analyze_channel, x, self.rate, self.taus_per_decade, self.segment_length): name
+                           for name, x in channels.items()}
+                for future in concurrent.futures.as_completed(futures):
+                    self.results[futures[future]] = future.result()
+                    yield len(self.results) / len(channels) * 100
+        self.results = {name: self.results[name] for name in channels} # keep the column order
+        self.save(groups)
+        if self.plots:
+            self.plot(groups)
+        yield 100
+
+    def save(self, groups):
+        report = {'data': os.path.basename(self.data_path), 'sample rate': self.rate, 'channels': {}}
+        for name, result in self.results.items():
+            random_walk = result['random walk']
+            walk_name = 'angle random walk' if groups[name] == 'rates' else 'velocity random walk'
+            report['channels'][name] = {
+                'group': groups[name],
+                'samples': result['samples'],
+                'bias instability': result['bias instability'],
+                'bias instability tau': result['bias instability tau'],
+                walk_name: None if random_walk is None else random_walk * 60,
+                'noise density': result['noise density'],
+                'tau': result['tau'].tolist(),
+                'adev': result['adev'].tolist(),
+            }
+        with open(analysis_path_of(self.data_path), 'w') as reportf:
+            json.dump(report, reportf, indent=4)
+
+    def plot(self, groups):
+        from matplotlib.figure import Figure # only needed for the plots
+
+        base = self.data_path[:-4]
+        for suffix, x_key, y_key, x_label, y_label in [('adev', 'tau', 'adev', 'tau (s)', 'Allan deviation'),
+                                                       ('psd', 'freq', 'psd', 'frequency (Hz)', 'PSD (unit^2/Hz)')]:
+            plot_groups = [group for group in ALLAN_GROUPS if group in groups.values()]
+            if not plot_groups:
+                return
+            fig = Figure(figsize=(8, 4 * len(plot_groups)))
+            for i, group in enumerate(plot_groups):
+                ax = fig.add_subplot(len(plot_groups), 1, i + 1)
+                for name, result in self.results.items():
+                    if groups[name] == group and len(result[x_key]):
+                        x, y = result[x_key], result[y_key]
+                        keep = x > 0 # no DC on a log axis
+                        ax.loglog(x[keep], y[keep], label=name)
+                ax.set_title(group)
+                ax.set_xlabel(x_label)
+                ax.set_ylabel(y_label)
+                ax.grid(True, which='both', alpha=0.3)
+                ax.legend(fontsize='small')
+            fig.tight_layout()
+            fig.savefig(f'{base}.{suffix}.png')
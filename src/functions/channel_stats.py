@@ -0,0 +1,144 @@
+import os
+import json
+import numpy as np
+
+
+def stats_path_of(data_path):
+    return f'{data_path[:-4]}.stats.json'
+
+
+class ChannelStats:
+    '''
+    Running statistics of the channels of one packet type with constant memory.
+
+    Blocks of rows are reduced with numpy and combined with Chan's parallel update of the mean and
+    sum of squared deviations, so the result does not depend on how the log was split into blocks.
+    The bias drift is the change of the least squares line of each channel over the packet number.
+
+    channels: The names of the channels
+    '''
+    def __init__(self, channels):
+        self.channels = list(channels)
+        k = len(self.channels)
+        self.n = 0
+        self.mean = np.zeros(k)
+        self.m2 = np.zeros(k)
+        self.min = np.full(k, np.inf)
+        self.max = np.full(k, -np.inf)
+        self.t_mean = 0.0 # packet number
+        self.t_m2 = 0.0
+        self.c = np.zeros(k) # co-moment of packet number and value
+
+    def add(self, latest):
+        '''
+        latest: decoded rows, a numpy structured array holding the channels
+        '''
+        if len(latest) == 0:
+            return
+        x = np.column_stack([latest[name].astype('f8') for name in self.channels])
+        block = ChannelStats(self.channels)
+        block.n = len(x)
+        block.mean = x.mean(axis=0)
+        d = x - block.mean
+        block.m2 = np.einsum('ij,ij->j', d, d)
+        block.min = x.min(axis=0)
+        block.max = x.max(axis=0)
+        t = np.arange(block.n) - (block.n - 1) / 2
+        block.t_mean = (block.n - 1) / 2
+        block.t_m2 = float(t @ t)
+        block.c = t @ d
+        self.merge(block)
+
+    def merge(self, other):
+        '''
+        Combine with the statistics of the packets which follow these
+        '''
+        if other.n == 0:
+            return
+        if self.n == 0:
+            self.set_state(other.state())
+            return
+        n = self.n + other.n
+        w = self.n * other.n / n
+        delta = other.mean - self.mean
+        dt = (other.t_mean + self.n) - self.t_mean
+        self.m2 = self.m2 + other.m2 + delta * delta * w
+        self.c = self.c + other.c + delta * dt * w
+        self.t_m2 = self.t_m2 + other.t_m2 + dt * dt * w
+        self.mean = self.mean + delta * other.n / n
+        self.t_mean = self.t_mean + dt * other.n / n
+        self.min = np.minimum(self.min, other.min)
+        self.max = np.maximum(self.max, other.max)
+        self.n = n
+
+    def state(self):
+        return {'channels': self.channels, 'n': self.n, 'mean': self.mean.tolist(), 'm2': self.m2.tolist(),
+                'min': self.min.tolist(), 'max': self.max.tolist(), 't_mean': self.t_mean, 't_m2': self.t_m2, 'c': self.c.tolist()}
+
+    def set_state(self, state):
+        self.channels = list(state['channels'])
+        self.n = state['n']
+        self.mean, self.m2, self.min, self.max, self.c = [np.array(state[key], dtype='f8') for key in ['mean', 'm2', 'min', 'max', 'c']]
+        self.t_mean = state['t_mean']
+        self.t_m2 = state['t_m2']
+
+    @classmethod
+    def from_state(cls, state):
+        stats = cls(state['channels'])
+        stats.set_state(state)
+        return stats
+
+    def summary(self):
+        '''
+        {channel: {'mean', 'std' (rms noise), 'rms', 'min', 'max', 'bias drift'}}
+        '''
+        if self.n == 0:
+            return {}
+        std = np.sqrt(self.m2 / (self.n - 1)) if self.n > 1 else np.zeros(len(self.channels))
+        rms = np.sqrt(self.mean * self.mean + self.m2 / self.n)
+        drift = self.c / self.t_m2 * (self.n - 1) if self.t_m2 > 0 else np.zeros(len(self.channels))
+        summary = {}
+        for i, name in enumerate(self.channels):
+            summary[name] = {'mean': float(self.mean[i]), 'std': float(std[i]), 'rms': float(rms[i]),
+                             'min': float(self.min[i]), 'max': float(self.max[i]), 'bias drift': float(drift[i])}
+        return summary
+
+
+def stats_channels(decoder):
+    '''
+    The channels of a packet type which get statistics: all output columns but the counters
+    '''
+    return [name for name in decoder.head_line if decoder.groups[name] != 'counters']
+
+
+class LogStats:
+    '''
+    Channel statistics of every packet type in one log, save() writes '<data name>.stats.json'
+    '''
+    def __init__(self, data_path):
+        self.data_path = data_path
+        self.stats = {}
+
+    def get(self, data_type, decoder):
+        if data_type not in self.stats:
+            self.stats[data_type] = ChannelStats(stats_channels(decoder))
+        return self.stats[data_type]
+
+    def add(self, data_type, decoder, latest):
+        self.get(data_type, decoder).add(latest)
+
+    def merge(self, data_type, decoder, stats):
+        self.get(data_type, decoder).merge(stats)
+
+    def state(self):
+        return {data_type: stats.state() for data_type, stats in self.stats.items()}
+
+    def set_state(self, state):
+        self.stats = {data_type: ChannelStats.from_state(stats_state) for data_type, stats_state in state.items()}
+
+    def save(self):
+        summary = {'data': os.path.basename(self.data_path), 'packet types': {}}
+        for data_type, stats in self.stats.items():
+            summary['packet types'][data_type] = {'packets': stats.n, 'channels': stats.summary()}
+        with open(stats_path_of(self.data_path), 'w') as statsf:
+            json.dump(summary, statsf, indent=4)
@@ -0,0 +1,279 @@
+import os
+import csv
+import shutil
+import struct
+import zipfile
+import tempfile
+import importlib.util
+import numpy as np
+
+NPY_HEADER_SIZE = 128 # fixed, so the header can be rewritten in place when the length is known
+
+
+def available_formats():
+    formats = ['csv', 'npy', 'npz']
+    if importlib.util.find_spec('pyarrow') is not None: # optional, imported by the exporters which use it
+        formats += ['parquet', 'arrow']
+    return formats
+
+
+def npy_header(dtype, length):
+    '''
+    .npy version 1.0 header padded to NPY_HEADER_SIZE bytes
+    '''
+    header = "{'descr': %r, 'fortran_order': False, 'shape': (%d,), }" % (np.lib.format.dtype_to_descr(np.dtype(dtype)), length)
+    header = header.ljust(NPY_HEADER_SIZE - 10 - 1) + '\n'
+    return b'\x93NUMPY\x01\x00' + struct.pack('<H', len(header)) + header.encode('latin1')
+
+
+class NpyColumnWriter:
+    '''
+    Append values to a one dimensional .npy file without holding the column in memory
+
+    append: Keep the values of an existing file, its header is rewritten in place on close
+    '''
+    def __init__(self, path, dtype, append=False):
+        self.dtype = np.dtype(dtype)
+        self.length = 0
+        if append and os.path.exists(path):
+            with open(path, 'rb') as npyf:
+                np.lib.format.read_magic(npyf)
+                shape, _, dtype = np.lib.format.read_array_header_1_0(npyf)
+                header_size = npyf.tell()
+            if header_size == NPY_HEADER_SIZE and dtype == self.dtype:
+                self.length = shape[0]
+                self.f = open(path, 'r+b')
+                self.f.seek(0, os.SEEK_END)
+                return
+            values = np.load(path) # not written by NpyColumnWriter, rewrite it with a fixed size header
+            self.f = open(path, 'wb')
+            self.f.write(npy_header(self.dtype, 0))
+            self.write(values)
+            return
+        self.f = open(path, 'wb')
+        self.f.write(npy_header(self.dtype, 0))
+
+    def write(self, values):
+        values = np.asarray(values, dtype=self.dtype)
+        self.f.write(values.tobytes())
+        self.length += len(values)
+
+    def close(self):
+        self.f.seek(0)
+        self.f.write(npy_header(self.dtype, self.length))
+        self.f.close()
+
+
+class Exporter:
+    '''
+    Base of the exporters, rows arrive as numpy structured arrays in blocks.
+
+    encode() turns a block into what write_encoded() stores, so a worker process can do the expensive part.
+    open(append=True) keeps the rows of an existing output, used by the incremental parse.
+    '''
+    extension = ''
+
+    def __init__(self, data_path, decoder):
+        self.data_path = data_path
+        self.head_line = decoder.head_line
+        self.dtype = decoder.dtype
+        self.groups = decoder.groups
+        self.out_path = f'{data_path[:-4]}{self.extension}'
+
+    def open(self, append=False):
+        pass
+
+    def encode(self, latest):
+        return latest
+
+    def write_encoded(self, encoded):
+        pass
+
+    def write(self, latest):
+        self.write_encoded(self.encode(latest))
+
+    def close(self):
+        pass
+
+
+class CsvExporter(Exporter):
+    '''
+    Rows are formatted a whole block at a time with one printf-style template.
+
+    precision: significant digits per channel group, e.g. {'accels': 6, 'rates': 6, 'temps': 4, 'counters': None},
+               None (or a missing group) keeps the full precision
+    delimiter: The column delimiter
+    '''
+    extension = '.csv'
+
+    def __init__(self, data_path, decoder, precision=None, delimiter=','):
+        super().__init__(data_path, decoder)
+        self.delimiter = delimiter
+        precision = precision or {}
+        column_fmts = []
+        for name in self.head_line:
+            digits = precision.get(self.groups[name])
+            if self.dtype[name].kind != 'f':
+                column_fmts.append('%d')
+            elif digits is None:
+                column_fmts.append('%r')
+            else:
+                column_fmts.append(f'%.{int(digits)}g')
+        self.row_fmt = delimiter.join(column_fmts) + '\r\n'
+
+    def open(self, append=False):
+        if append and os.path.exists(self.out_path):
+            self.csvfile = open(self.out_path, 'a', newline='')
+            return
+        self.csvfile = open(self.out_path, 'w', newline='')
+        csv.writer(self.csvfile, delimiter=self.delimiter).writerow(self.head_line)
+
+    def encode(self, latest):
+        columns = [latest[name].tolist() for name in self.head_line]
+        values = [value for row in zip(*columns) for value in row]
+        return (self.row_fmt * len(latest)) % tuple(values)
+
+    def write_encoded(self, encoded):
+        self.csvfile.write(encoded)
+
+    def close(self):
+        self.csvfile.close()
+
+
+class NpyExporter(Exporter):
+    '''
+    One .npy file per column in the folder '<data name>_npy'
+    '''
+    extension = '_npy'
+
+    def open(self, append=False):
+        if not os.path.exists(self.out_path):
+            os.makedirs(self.out_path)
+        self.columns = {name: NpyColumnWriter(os.path.join(self.out_path, f'{name}.npy'), self.dtype[name], append)
+                        for name in self.head_line}
+
+    def write_encoded(self, encoded):
+        for name in self.head_line:
+            self.columns[name].write(encoded[name])
+
+    def close(self):
+        for column in self.columns.values():
+            column.close()
+
+
+class NpzExporter(NpyExporter):
+    '''
+    One array per column in '<data name>.npz', the columns are spooled to disk and zipped at the end
+    '''
+    extension = '.npz'
+
+    def open(self, append=False):
+        self.npz_path = self.out_path
+        self.out_path = tempfile.mkdtemp(dir=os.path.dirname(os.path.abspath(self.npz_path)))
+        if append and os.path.exists(self.npz_path):
+            # unpack the stored columns to the spool folder and continue them there
+            with zipfile.ZipFile(self.npz_path) as npzf:
+                for name in self.head_line:
+                    with npzf.open(f'{name}.npy') as src, open(os.path.join(self.out_path, f'{name}.npy'), 'wb') as dst:
+                        shutil.copyfileobj(src, dst)
+        super().open(append)
+
+    def close(self):
+        super().close()
+        with zipfile.ZipFile(self.npz_path, 'w', zipfile.ZIP_STORED, allowZip64=True) as npzf:
+            for name in self.head_line:
+                npzf.write(os.path.join(self.out_path, f'{name}.npy'), arcname=f'{name}.npy')
+        shutil.rmtree(self.out_path)
+        self.out_path = self.npz_path
+
+
+class ParquetExporter(Exporter):
+    '''
+    Parquet file, a parquet file can not be reopened for writing so appending copies the stored row groups
+    to a new file first (no decoding is repeated)
+    '''
+    extension = '.parquet'
+
+    def open(self, append=False):
+        import pyarrow.parquet
+
+        self.schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(self.dtype[name])) for name in self.head_line])
+        old_path = self.move_aside() if append else None
+        self.writer = pyarrow.parquet.ParquetWriter(self.out_path, self.schema)
+        if old_path is not None:
+            old_file = pyarrow.parquet.ParquetFile(old_path)
+            for i in range(old_file.num_row_groups):
+                self.writer.write_table(old_file.read_row_group(i))
+            old_file.close()
+            os.remove(old_path)
+
+    def move_aside(self):
+        if not os.path.exists(self.out_path):
+            return None
+        old_path = f'{self.out_path}.old'
+        os.replace(self.out_path, old_path)
+        return old_path
+
+    def table(self, latest):
+        import pyarrow
+
+        return pyarrow.Table.from_arrays([pyarrow.array(latest[name]) for name in self.head_line], schema=self.schema)
+
+    def write_encoded(self, encoded):
+        if len(encoded):
+            self.writer.write_table(self.table(encoded))
+
+    def close(self):
+        self.writer.close()
+
+
+class ArrowExporter(ParquetExporter):
+    '''
+    Arrow IPC (feather v2) file
+    '''
+    extension = '.arrow'
+
+    def open(self, append=False):
+        import pyarrow.ipc
+
+        self.schema = pyarrow.schema([(name, pyarrow.from_numpy_dtype(self.dtype[name])) for name in self.head_line])
+        old_path = self.move_aside() if append else None
+        self.sink = pyarrow.OSFile(self.out_path, 'wb')
+        self.writer = pyarrow.ipc.new_file(self.sink, self.schema)
+        if old_path is not None:
+            with pyarrow.OSFile(old_path, 'rb') as old_sink:
+                reader = pyarrow.ipc.open_file(old_sink)
+                for i in range(reader.num_record_batches):
+                    self.writer.write_batch(reader.get_batch(i))
+            os.remove(old_path)
+
+    def close(self):
+        self.writer.close()
+        self.sink.close()
+
+
+EXPORTERS = {
+    'csv': CsvExporter,
+    'npy': NpyExporter,
+    'npz': NpzExporter,
+    'parquet': ParquetExporter,
+    'arrow': ArrowExporter,
+}
+
+
+def create_exporters(export_formats, data_path, decoder, csv_precision=None, csv_delimiter=','):
+    '''
+    export_formats: a format name or a list of them, see available_formats()
+    csv_precision, csv_delimiter: see CsvExporter
+    '''
+    if isinstance(export_formats, str):
+        export_formats = [export_formats]
+    exporters = []
+    for export_format in export_formats:
+        if export_format not in available_formats():
+            raise ValueError(f"export format '{export_format}' is not available")
+        if export_format == 'csv':
+            exporters.append(CsvExporter(data_path, decoder, csv_precision, csv_delimiter))
+        else:
+            exporters.append(EXPORTERS[export_format](data_path, decoder))
+    return exporters
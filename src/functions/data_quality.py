@@ -0,0 +1,219 @@
+import os
+import json
+import numpy as np
+
+from ..common.packet_schema import get_schema, scaler
+from .packet_framer import PacketFramer
+from .packet_decoder import PacketDecoder
+
+QUALITY_CHUNK_SIZE = 1 << 22 # 4MB
+QUALITY_SUMMARY_NAME = 'quality_summary.json'
+QUALITY_MAX_EVENTS = 100 # events listed per kind, all events are counted
+TIME_JUMP_FACTOR = 1.5 # a time step longer than this many nominal periods is a jump
+SATURATION_GROUPS = ['accels', 'rates']
+
+
+def quality_path_of(data_path):
+    return f'{data_path[:-4]}.quality.json'
+
+
+class DataQuality:
+    '''
+    Data quality of one log, collected chunk by chunk while it is framed:
+
+    sequence: missing, duplicated and out of order values of the packet counter (schema 'sequence')
+    time: jumps and backward steps of the device time (schema 'time') against its median period
+    checksum failures: header candidates which failed the checksum, and their rate
+    unframed bytes: bytes which belong to no packet, as regions between packets
+    saturation: packets with a raw accel or rate value at the limit of its integer type
+
+    check() frames the log, save() writes the report '<data name>.quality.json'
+    '''
+    def __init__(self, data_path, data_type, packet_length):
+        self.data_path = data_path
+        self.data_type = data_type
+        self.packet_length = packet_length
+        schema = get_schema(data_type, packet_length)
+        self.checksum = schema.checksum
+        self.sequence_field, self.sequence_wrap = schema.sequence or (None, None)
+        self.time_field, _, self.time_wrap = schema.time or (None, None, None)
+        self.time_scale = scaler(schema.scales.get(self.time_field))
+        self.limits = {}
+        for name, fmt, _, group in schema.fields:
+            kind = schema.raw_dtype.fields[name][0]
+            if group in SATURATION_GROUPS and kind.kind in 'iu':
+                info = np.iinfo(kind)
+                self.limits[name] = (info.min, info.max)
+
+        self.framer = PacketFramer(schema.header, packet_length, schema.checksum)
+        self.decoder = PacketDecoder(data_type, packet_length)
+        self.packets = 0
+        self.checksum_failures = 0
+        self.unframed_regions = 0
+        self.largest_unframed = 0
+        self.last_offset = None
+        self.last_sequence = None
+        self.last_time = None
+        self.period = None
+        self.counts = {'missing': 0, 'duplicates': 0, 'out of order': 0, 'time jumps': 0, 'time backwards': 0}
+        self.events = {'sequence': [], 'time': [], 'unframed': []}
+        self.largest_jump = 0.0
+        self.saturated = {name: 0 for name in self.limits}
+
+    def event(self, kind, offsets, packets, values, label, names=None):
+        '''
+        List the first QUALITY_MAX_EVENTS events of a kind, names: the name of each event if the kind has several
+        '''
+        room = max(QUALITY_MAX_EVENTS - len(self.events[kind]), 0)
+        for i, (offset, packet, value) in enumerate(zip(offsets[:room].tolist(), packets[:room].tolist(), values[:room].tolist())):
+            event = {'offset': offset, 'packet': packet, label: value}
+            if names is not None:
+                event['kind'] = names[i]
+            self.events[kind].append(event)
+
+    def add(self, accepted, rejected, raw):
+        '''
+        accepted, rejected: file offsets of the accepted packets and of the rejected header candidates
+        raw: the unscaled fields of the accepted packets, see PacketDecoder.raw_at()
+        '''
+        if self.checksum is not None:
+            self.checksum_failures += len(rejected)
+        if len(accepted) == 0:
+            return
+        accepted = accepted.astype(np.int64)
+        packets = np.arange(self.packets, self.packets + len(accepted))
+
+        # bytes between the end of a packet and the start of the next one (or from the start of the file)
+        previous_end = np.concatenate([[0 if self.last_offset is None else self.last_offset + self.packet_length], accepted[:-1] + self.packet_length])
+        gaps = accepted - previous_end
+        at = np.flatnonzero(gaps > 0)
+        self.unframed_regions += len(at)
+        if len(at):
+            self.largest_unframed = max(self.largest_unframed, int(gaps[at].max()))
+            self.event('unframed', previous_end[at], packets[at], gaps[at], 'bytes')
+
+        if self.sequence_field is not None:
+            wrap = self.sequence_wrap
+            sequence = raw[self.sequence_field].astype(np.int64)
+            last = sequence[0] - 1 if self.last_sequence is None else self.last_sequence
+            step = (sequence - np.concatenate([[last], sequence[:-1]])) % wrap
+            # a counter which went back is out of order, the counter of the packets after it is compared with
+            # the last packet in order so the packets are not counted as missing twice
+            out_of_order = step > wrap // 2
+            in_order = np.flatnonzero(~out_of_order)
+            ordered = sequence[in_order]
+            step[in_order] = (ordered - np.concatenate([[last], ordered[:-1]])) % wrap
+            out_of_order[in_order] = step[in_order] > wrap // 2
+            missing = ~out_of_order & (step > 1)
+            duplicates = ~out_of_order & (step == 0)
+            self.counts['missing'] += int((step[missing] - 1).sum())
+            self.counts['duplicates'] += int(duplicates.sum())
+            self.counts['out of order'] += int(out_of_order.sum())
+            at = np.flatnonzero(missing | duplicates | out_of_order)
+            names = np.where(out_of_order[at], 'out of order', np.where(duplicates[at], 'duplicate', 'missing'))
+            self.event('sequence', accepted[at], packets[at], np.where(out_of_order[at], step[at] - wrap, step[at]), 'step', names.tolist())
+            if len(in_order):
+                self.last_sequence = int(ordered[-1])
+
+        if self.time_field is not None:
+            time = raw[self.time_field].astype('f8')
+            if self.time_scale is not None:
+                time = self.time_scale(time)
+            previous = np.concatenate([[time[0] if self.last_time is None else self.last_time], time[:-1]])
+            dt = time - previous
+            if self.time_wrap is not None:
+                dt = np.where(dt < -self.time_wrap / 2, dt + self.time_wrap, dt)
+            first = 1 if self.last_time is None else 0 # the first packet of the log has no time step
+            dt, offsets, numbers = dt[first:], accepted[first:], packets[first:]
+            if self.period is None and np.any(dt > 0):
+                self.period = float(np.median(dt[dt > 0])) # nominal period from the first chunk
+            if self.period is not None:
+                jumps = dt > self.period * TIME_JUMP_FACTOR
+                backwards = dt <= 0
+                self.counts['time jumps'] += int(jumps.sum())
+                self.counts['time backwards'] += int(backwards.sum())
+                if jumps.any():
+                    self.largest_jump = max(self.largest_jump, float(dt[jumps].max()))
+                at = np.flatnonzero(jumps | backwards)
+                self.event('time', offsets[at], numbers[at], dt[at], 'step', np.where(jumps[at], 'jump', 'backwards').tolist())
+            self.last_time = float(time[-1])
+
+        for name, (low, high) in self.limits.items():
+            values = raw[name]
+            self.saturated[name] += int(np.count_nonzero((values == low) | (values == high)))
+
+        self.packets += len(accepted)
+        self.last_offset = int(accepted[-1])
+
+    def check(self, chunk_size=QUALITY_CHUNK_SIZE):
+        '''
+        Frame the whole log, yields the progress
+        '''
+        progress_length = max(os.path.getsize(self.data_path), 1)
+        with open(self.data_path, 'rb') as dataf:
+            for base, data, result in self.framer.stream(dataf, chunk_size):
+                self.add(result.accepted + base, result.rejected + base, self.decoder.raw_at(data, result.accepted))
+                yield ((base + result.consumed) / progress_length) * 100
+
+    def report(self):
+        file_size = os.path.getsize(self.data_path)
+        unframed = file_size - self.packets * self.packet_length
+        trailing = file_size - (self.last_offset + self.packet_length) if self.last_offset is not None else file_size
+        candidates = self.packets + self.checksum_failures
+        report = {
+            'data': os.path.basename(self.data_path),
+            'packet type': self.data_type,
+            'packet length': self.packet_length,
+            'file size': file_size,
+            'packets': self.packets,
+            'checksum failures': self.checksum_failures if self.checksum is not None else None,
+            'checksum failure rate': self.checksum_failures / candidates if self.checksum is not None and candidates else None,
+            'unframed bytes': unframed,
+            'unframed regions': self.unframed_regions + int(trailing > 0),
+            'largest unframed region': max(self.largest_unframed, trailing),
+            'sequence': None,
+            'time': None,
+            'saturation': self.saturated,
+        }
+        if self.sequence_field is not None:
+            report['sequence'] = {'field': self.sequence_field, 'missing': self.counts['missing'],
+                                  'duplicates': self.counts['duplicates'], 'out of order': self.counts['out of order'],
+                                  'events': self.events['sequence']}
+        if self.time_field is not None:
+            report['time'] = {'field': self.time_field, 'period': self.period, 'jumps': self.counts['time jumps'],
+                              'backwards': self.counts['time backwards'], 'largest jump': self.largest_jump,
+                              'events': self.events['time']}
+        report['unframed events'] = self.events['unframed']
+        report['clean'] = (unframed == 0 and not self.checksum_failures and not any(self.saturated.values())
+                           and not any(self.counts.values()))
+        return report
+
+    def save(self):
+        report = self.report()
+        with open(quality_path_of(self.data_path), 'w') as qualityf:
+            json.dump(report, qualityf, indent=4)
+        return report
+
+
+def summary_row(report):
+    '''
+    The counts of a quality report without the event lists, one row of the folder summary
+    '''
+    row = {key: value for key, value in report.items() if key not in ['sequence', 'time', 'unframed events', 'saturation']}
+    for key in ['sequence', 'time']:
+        for name, value in (report.get(key) or {}).items():
+            if name not in ['field', 'events']:
+                row[f'{key} {name}'] = value
+    row['saturated packets'] = sum((report.get('saturation') or {}).values())
+    return row
+
+
+def save_quality_summary(folder, reports):
+    '''
+    Write the summary of the quality reports of many logs to '<folder>/quality_summary.json'
+    '''
+    summary = {report['data']: summary_row(report) for report in reports}
+    summary_path = os.path.join(folder, QUALITY_SUMMARY_NAME)
+    with open(summary_path, 'w') as summaryf:
+        json.dump(summary, summaryf, indent=4)
+    return summary_path
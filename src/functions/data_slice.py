@@ -0,0 +1,156 @@
+import numpy as np
+
+DECIMATION_MODES = ['pick', 'mean', 'fir']
+SLICE_CHUNK_SIZE = 1 << 22 # 4MB
+FIR_TAPS_PER_FACTOR = 8 # the anti-alias filter spans this many output samples
+
+
+def slice_path_of(data_path, packet_range=None, time_range=None, decimate=1, decimation='pick'):
+    '''
+    The log path the outputs of a slice are named after, e.g. 'imu_S1_x_p1000-5000_mean10.bin'
+    '''
+    suffix = ''
+    if packet_range is not None:
+        suffix += f'_p{packet_range[0]}-{packet_range[1]}'
+    if time_range is not None:
+        suffix += f'_t{time_range[0]:g}-{time_range[1]:g}'
+    if decimate > 1:
+        suffix += f'_{decimation}{decimate}'
+    return f'{data_path[:-4]}{suffix}.bin'
+
+
+def fir_taps(factor, taps_per_factor=FIR_TAPS_PER_FACTOR):
+    '''
+    Hamming windowed sinc low pass with the cutoff at the Nyquist frequency of the decimated rate, unity gain at DC
+    '''
+    half = taps_per_factor * factor // 2
+    n = np.arange(-half, half + 1)
+    h = np.sinc(n / factor) * np.hamming(len(n))
+    return h / h.sum()
+
+
+class Decimator:
+    '''
+    Reduce the sample rate of decoded rows by an integer factor, block by block with the state carried
+    between blocks, so the result does not depend on how the log is split.
+
+    pick: keep every Nth row
+    mean: the mean of every N rows
+    fir: low pass filter the channels with fir_taps() before keeping every Nth row, the filter is centered
+         on the kept row (no delay) and the first and last rows are repeated at the ends of the log
+
+    Counters (packet counters, device time) are never averaged or filtered, they are taken from the kept row
+    (the first row of the block for mean).
+
+    groups: {column name: channel group}
+    '''
+    def __init__(self, factor, mode='pick', groups=None):
+        if mode not in DECIMATION_MODES:
+            raise ValueError(f'unknown decimation {mode}, choose from {DECIMATION_MODES}')
+        self.factor = int(factor)
+        self.mode = mode
+        self.groups = groups or {}
+        self.taps = fir_taps(self.factor) if mode == 'fir' else None
+        self.half = len(self.taps) // 2 if mode == 'fir' else 0
+        self.position = 0 # row number of the first row of self.rows
+        self.rows = None # rows carried to the next block
+
+    def channels(self, rows):
+        return [name for name in rows.dtype.names if self.groups.get(name) != 'counters']
+
+    def set_column(self, out, name, values):
+        if out.dtype[name].kind in 'iu':
+            values = np.round(values)
+        out[name] = values
+
+    def process(self, rows, final=False):
+        '''
+        rows: the next decoded rows of the log
+        final: no rows follow, the rows carried over are flushed
+
+        returns the decimated rows which are complete
+        '''
+        if self.factor <= 1:
+            return rows
+        if self.mode == 'pick':
+            keep = (self.position + np.arange(len(rows))) % self.factor == 0
+            self.position += len(rows)
+            return rows[keep]
+        if self.rows is None:
+            if not len(rows):
+                return rows
+            if self.mode == 'fir':
+                rows = np.concatenate([np.repeat(rows[:1], self.half), rows]) # first row repeated before the log
+                self.position = -self.half
+            self.rows = rows
+        else:
+            self.rows = np.concatenate([self.rows, rows])
+        if self.mode == 'mean':
+            return self.block_mean(final)
+        return self.filter(final)
+
+    def block_mean(self, final):
+        rows = self.rows
+        blocks = len(rows) // self.factor
+        if final and len(rows) % self.factor:
+            blocks += 1 # the last short block
+        used = min(blocks * self.factor, len(rows))
+        starts = np.arange(blocks) * self.factor
+        counts = np.diff(np.concatenate([starts, [used]]))
+        out = rows[starts].copy()
+        for name in self.channels(rows):
+            sums = np.add.reduceat(rows[name][:used].astype('f8'), starts) if blocks else np.empty(0)
+            self.set_column(out, name, sums / counts)
+        self.rows = rows[used:]
+        self.position += used
+        return out
+
+    def filter(self, final):
+        rows = self.rows
+        if final and len(rows):
+            rows = np.concatenate([rows, np.repeat(rows[-1:], self.half)]) # last row repeated after the log
+        # rows[i] is a complete output when it has self.half rows on both sides
+        centers = np.arange(self.half, len(rows) - self.half)
+        centers = centers[(self.position + centers) % self.factor == 0]
+        out = rows[centers].copy()
+        for name in self.channels(rows):
+            values = np.convolve(rows[name].astype('f8'), self.taps, mode='valid') if len(rows) >= len(self.taps) else np.empty(0)
+            self.set_column(out, name, values[centers - self.half])
+        drop = max(len(rows) - 2 * self.half, 0)
+        self.rows = rows[drop:]
+        self.position += drop
+        return out
+
+
+class IndexSlice:
+    '''
+    Read a packet range of a log through its packet index, only the bytes of the range are read and decoded.
+
+    index: the PacketIndex of the log
+    start, stop: the packet numbers of the range
+    '''
+    def __init__(self, index, decoder, start, stop):
+        self.index = index
+        self.decoder = decoder
+        self.start = max(start, 0)
+        self.stop = min(stop, len(index))
+
+    def __len__(self):
+        return max(self.stop - self.start, 0)
+
+    def read(self, chunk_size=SLICE_CHUNK_SIZE):
+        '''
+        yields (rows decoded so far, decoded rows) block by block
+        '''
+        packet_length = self.decoder.packet_length
+        with open(self.index.data_path, 'rb') as dataf:
+            first = self.start
+            while first < self.stop:
+                # the packets whose bytes fit in one chunk, at least one (packets do not overlap)
+                offsets = self.index.offsets[first:min(first + chunk_size // packet_length + 1, self.stop)].astype(np.int64)
+                last = max(int(np.searchsorted(offsets, offsets[0] + chunk_size - packet_length, side='right')), 1)
+                offsets = offsets[:last]
+                dataf.seek(int(offsets[0]))
+                data = dataf.read(int(offsets[-1] - offsets[0]) + packet_length)
+                first += len(offsets)
+                yield first - self.start, self.decoder.decode_at(data, offsets - offsets[0])
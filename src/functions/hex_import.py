@@ -0,0 +1,55 @@
+import os
+import binascii
+
+HEX_CHUNK_SIZE = 1 << 22 # 4MB of text
+WHITESPACE = b' \t\r\n\v\f'
+
+
+def bin_path_of(txt_path):
+    return f'{txt_path[:-4]}.bin'
+
+
+def bin_is_current(txt_path, bin_path):
+    '''
+    The .bin was converted from the current content of the .txt
+    '''
+    return os.path.exists(bin_path) and os.path.getmtime(bin_path) >= os.path.getmtime(txt_path)
+
+
+def hex_to_bin(txt_path, bin_path=None, chunk_size=HEX_CHUNK_SIZE):
+    '''
+    Convert a hex text dump to a binary log chunk by chunk, spaces and line breaks anywhere are ignored.
+
+    A digit left over at the end of a chunk is carried to the next one, the .bin is replaced only
+    when the whole dump was converted.
+    '''
+    bin_path = bin_path or bin_path_of(txt_path)
+    tmp_path = f'{bin_path}.part'
+    carry = b''
+    try:
+        with open(txt_path, 'rb') as txtf, open(tmp_path, 'wb') as binf:
+            while True:
+                text = txtf.read(chunk_size)
+                if not text:
+                    break
+                digits = carry + text.translate(None, WHITESPACE)
+                even = len(digits) & ~1
+                binf.write(binascii.unhexlify(digits[:even]))
+                carry = digits[even:]
+        if carry:
+            raise ValueError(f'{txt_path}: odd number of hex digits')
+        os.replace(tmp_path, bin_path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+    return bin_path
+
+
+def import_hex_file(txt_path, bin_path=None):
+    '''
+    Convert the dump unless its .bin is up to date, returns the path of the .bin
+    '''
+    bin_path = bin_path or bin_path_of(txt_path)
+    if not bin_is_current(txt_path, bin_path):
+        hex_to_bin(txt_path, bin_path)
+    return bin_path
@@ -1,30 +1,23 @@
 import os
-import csv
 import time
 import struct
-import serial
 
-from ..communication.aceinna_uart import Uart
-from ..front.data_visual import Visual
+from ..common.crc import calc_crc
 from ..front.setting_table import SettingTable
 
+# The serial port, numpy, the parse modules and matplotlib are imported by the functions which use them,
+# so the tool starts fast and e.g. a field read does not load the plotting stack (see perf_anal.py startup)
+PARSE_CHUNK_SIZE = 1 << 22 # 4MB
+MIXED_DATA_TYPE = 'mixed' # log holding several packet types
+
 class IMUFunc:
     def __init__(self, com=None, baud=None, odr=None):
         if com != None:
+            from ..communication.aceinna_uart import Uart
             self.uut = Uart(com, baud, odr)
         else:
             self.uut = None
-        self.packet_info = {
-            'S1': ([0x55, 0x55, 0x53, 0x31], 31),
-            'S2': ([0x55, 0x55, 0x53, 0x32], 45),
-            'A1': ([0x55, 0x55, 0x41, 0X31], 39),
-            'A2': ([0x55, 0x55, 0x41, 0x32], 37),
-            'FM': ([0x55, 0x55, 0x46, 0x4D], 95),
-            'a2': ([0x55, 0x55, 0x61, 0x32], 55),
-            'S3': ([0x55, 0xAA, 0x24], 40),
-            'AT': ([0xBD, 0XDB, 0x54], 39)
-        }
-
+        self.detected_types = {} # (data path, size, mtime): packet types found in the content
         self.user_command = {
             'GP': [0x55, 0x55, 0x47, 0x50],
             'WF': [0x55, 0x55, 0x57, 0x46],
@@ -54,50 +47,103 @@ class IMUFunc:
             return product_info
         return None
 
-    def imu_data_record(self, data_type, logf_name, stdscr=None):
+    def imu_data_record(self, data_type, logf_name, stdscr=None, log_options=None):
+        import serial
+
         try:
             self.uut.ser_init()
-            self.uut.data_log(data_type, logf_name, stdscr)
+            self.uut.data_log(data_type, logf_name, stdscr, log_options)
             self.uut.ser_close()
         except serial.serialutil.SerialException as e:
             stdscr.addstr(6, 3, e.strerror)
 
-    def imu_data_parse(self, data_path=None):
-        data_file_name = data_path.split('\\')[-1] # get the file name
-        data_type = data_file_name.split('_')[1] # get the packet type
-        if data_type.find('.') != -1:
-            data_type = data_type.split('.')[0]
-        if data_type == 'S1':
-            head_line = ['xAccel', 'yAccel', 'zAccel', 'xRate', 'yRate', 'zRate', 'xRateTemp', 'yRateTemp', 'zRateTemp', 'boardTemp', 'timer', 'BITstatus']
-            for progress in self.parse_to_csvf(data_path, data_type, head_line):
-                yield progress
-        elif data_type == 'S2':
-            head_line = ['gps_week', 'gps_time_of_week', 'x_accel', 'y_accel', 'z_accel', 'x_gyro', 'y_gyro', 'z_gyro', 'temp', 'master_bit']
-            for progress in self.parse_to_csvf(data_path, data_type, head_line):
-                yield progress
-        elif data_type == 'S3':
-            head_line = ['num', 'xRate', 'yRate', 'zRate', 'xAccel', 'yAccel', 'zAccel',  'boardTempCounts', 'supplierid', 'productid']
-            for progress in self.parse_to_csvf_li(data_path, data_type, head_line):
-                yield progress
-        elif data_type == 'A1':
-            head_line = ['rollAngle', 'pitchAngle', 'yawAngleMag', 'xRateCorrected', 'yRateCorrected', 'zRateCorrected', 'xAccel', 'yAccel', 'zAccel', 'xRateTemp', 'timeITOW', 'BITstatus']
-            for progress in self.parse_to_csvf(data_path, data_type, head_line):
-                yield progress
-        elif data_type == 'A2':
-            head_line = ['rollAngle', 'pitchAngle', 'yawAngleTrue', 'xRateCorrected', 'yRateCorrected', 'zRateCorrected', 'xAccel', 'yAccel', 'zAccel', 'xRateTemp', 'yRateTemp', 'zRateTemp', 'timeITOW', 'BITstatus']
-            for progress in self.parse_to_csvf(data_path, data_type, head_line):
-                yield progress
-        elif data_type == 'FM':
-            head_line = ['xAccelCounts1', 'yAccelCounts1', 'zAccelCounts1', 'xRateCounts1', 'yRateCounts1', 'zRateCounts1', 'TempCounts1', 'xAccelCounts2', 'yAccelCounts2', 'zAccelCounts2',
-            'xRateCounts2', 'yRateCounts2', 'zRateCounts2', 'TempCounts2', 'xAccelCounts3', 'yAccelCounts3', 'zAccelCounts3', 'xRateCounts3', 'yRateCounts3', 'zRateCounts3', 'TempCounts3',
-            'xAccelCounts4', 'yAccelCounts4', 'zAccelCounts4', 'xRateCounts4', 'yRateCounts4', 'zRateCounts4', 'TempCounts4', 'sensorSubset', 'sampleIdx']
-            for progress in self.parse_to_csvf(data_path, data_type, head_line):
+    def imu_data_capture(self, data_type, logf_name, duration=None, max_packets=None, log_options=None):
+        '''
+        Log for a fixed duration (seconds) or number of packets without a UI, yields the number of packets written
+        '''
+        from ..common.packet_schema import get_schema
+
+        self.uut.ser_init()
+        if get_schema(data_type).variable_length:
+            self.uut.pkt_info_update(data_type)
+        try:
+            for packets in self.uut.data_record(data_type, logf_name, duration, max_packets, log_options):
+                yield packets
+        finally:
+            self.uut.ser_close()
+
+    def imu_data_parse(self, data_path=None, export_formats='csv', export_options=None, incremental=False, use_cache=False, cache_hash=False,
+                       stats=False, packet_range=None, time_range=None, decimate=1, decimation='pick'):
+        '''
+        data_path: The path of the data to be parsed
+        export_formats: 'csv', 'npy', 'npz', 'parquet', 'arrow' or a list of them
+        export_options: {'csv_precision': {group: digits}, 'csv_delimiter': ','}
+        incremental: Only parse what was appended to the log since the last incremental parse
+        use_cache: Return at once if the outputs of the log are up to date, see parse_cache.ParseCache
+        cache_hash: Compare the content hash as well when the mtime of the log changed
+        stats: Write the channel statistics '<data name>.stats.json' as well, see channel_stats.LogStats
+        packet_range: (first, stop) packet numbers to export, only these packets are read, see parse_slice()
+        time_range: (start, end) device time to export, in the unit of the packet index time
+        decimate: Export every Nth sample only
+        decimation: 'pick' (every Nth row), 'mean' (mean of N rows) or 'fir' (anti-alias filter, then every Nth row)
+
+        A log holding several packet types is split into one output per type in a single pass,
+        see packet_demux.PacketDemux (without incremental parse, cache, ranges or decimation).
+        '''
+        from ..common.packet_schema import decodable_types
+        from .packet_demux import PacketDemux
+        from .parse_cache import ParseCache
+
+        self.check_slice(data_path, packet_range, time_range, decimate)
+        data_type = self.get_data_type(data_path)
+        if data_type in decodable_types() and (packet_range is not None or time_range is not None or decimate > 1):
+            for progress in self.parse_slice(data_path, data_type, export_formats, export_options, packet_range, time_range,
+                                             decimate, decimation):
                 yield progress
-        elif data_type == 'AT':
-            head_line = ['xRate', 'yRate', 'zRate', 'xAccel', 'yAccel', 'zAccel', 'Temp', 'Fixed value 0', 'Flags0', 'Flags1', 'Frame count', 'GPS Week', 'GPS TimeOfWeek', 'year', 'month',
-            'day', 'hour', 'minute', 'second', 'milliseconds']
-            for progress in self.parse_to_csvf_nio(data_path, data_type, head_line):
+            return
+        if data_type == MIXED_DATA_TYPE:
+            demux = PacketDemux(data_path, self.get_data_types(data_path), export_formats, export_options, stats)
+            for progress in demux.parse():
                 yield progress
+            return
+        if data_type not in decodable_types():
+            return
+        if use_cache:
+            cache = ParseCache.of(data_path, cache_hash)
+            settings = ParseCache.settings(export_formats, export_options, True, stats)
+            out_paths = self.output_paths(data_path, data_type, export_formats, export_options, True, stats)
+            if cache.is_current(data_path, out_paths, settings):
+                yield 100
+                return
+        for progress in self.parse_to_file(data_path, data_type, export_formats, export_options, incremental=incremental, stats=stats):
+            yield progress
+        if use_cache:
+            cache.record(data_path, out_paths, settings)
+
+    def check_slice(self, data_path, packet_range=None, time_range=None, decimate=1):
+        '''
+        Raise a ValueError if a range or decimation is asked for a log holding several packet types
+        '''
+        if (packet_range is not None or time_range is not None or decimate > 1) and self.get_data_type(data_path) == MIXED_DATA_TYPE:
+            raise ValueError(f'{data_path} holds several packet types, ranges and decimation need a log of one type')
+
+    def imu_data_allan(self, data_path, rate, workers=None, plots=True):
+        '''
+        Allan deviation and noise density of the accel and gyro channels of a static log,
+        see allan_analysis.AllanAnalysis
+
+        rate: The sample rate of the log in Hz
+        '''
+        from ..common.packet_schema import decodable_types
+        from .allan_analysis import AllanAnalysis, ALLAN_GROUPS
+
+        data_type = self.get_data_type(data_path)
+        if data_type not in decodable_types():
+            return
+        channels, groups = self.load_channels(data_path, data_type, ALLAN_GROUPS)
+        channels = {name: x for name, x in channels.items() if len(x) >= 3} # two clusters of one sample at least
+        for progress in AllanAnalysis(data_path, rate, workers, plots=plots).run(channels, groups):
+            yield progress
 
     def imu_data_visual(self, stdscr, data_type, maxt, dt):
         '''
@@ -106,16 +152,19 @@ class IMUFunc:
         maxt: Maximum time limit for data visualization
         dt: Update rate of data visualization
         '''
+        from ..common.packet_schema import get_schema
+        from ..front.data_visual import Visual # matplotlib
+
         self.uut.ser_init()
         self.uut.pkt_info_update(data_type)
-        parser = eval(f'self.{data_type}_parse')
+        schema = get_schema(data_type, self.uut.packet_lengths.get(data_type))
+        if not schema.decodable:
+            self.uut.ser_close()
+            stdscr.addstr(2, 0, f"{data_type} packets can not be visualized")
+            return
+        parser = schema.unpack
         emitter = self.uut.realtime_data
-        if data_type == 'FM':
-            data_length = self.uut.pkt_info_dict[data_type][1]
-            chip_num = int((data_length - 11) / 28)
-            vis = Visual(stdscr, data_type, maxt, dt, emitter, chip_num)
-        else:
-            vis = Visual(stdscr, data_type, maxt, dt, emitter)
+        vis = Visual(stdscr, data_type, maxt, dt, emitter, len(schema.plot['accels']), len(schema.plot['angles']) != 0)
         vis.start(parser)
         self.uut.isLog = False
         time.sleep(0.1)
@@ -183,333 +232,284 @@ class IMUFunc:
         self.uut.ser_close()
         return None
         
-    def imu_field_setting_temporary(self, stdscr, id_list, info=None):
-        cmd = bytes(self.user_command['SF'])
+    def imu_set_field_val(self, values, permanent=False):
+        '''
+        values: {field id: value as a hex string}, e.g. {1: '1', 3: '5331'}
+        permanent: Write the fields to the EEPROM (WF), otherwise set them until the next reboot (SF)
+
+        returns True if the device acknowledged the fields
+        '''
+        cmd = bytes(self.user_command['WF' if permanent else 'SF'])
         packet_payload = cmd
-        packet = None
+        num_fields = len(values)
+        payload_length = num_fields * 4 + 1
+        packet_payload += struct.pack('>B', payload_length)
+        packet_payload += struct.pack('>B', num_fields)
+        for id in values:
+            if id != 3:
+                packet_payload += struct.pack('>H', id)
+                packet_payload += struct.pack('>H', int(values[id], 16))
+            else:
+                packet_payload += struct.pack('>H', id)
+                packet_payload += bytes.fromhex(values[id])
+        crc = bytes(self.calc_crc(packet_payload[2:]))
+        packet = packet_payload + crc
+        self.uut.ser_init()
+        resp_length = num_fields * 2 + 1 + 7
+        result = self.uut.write_read_response(packet, resp_length)
+        self.uut.ser_close()
+        return result[0]
+
+    def imu_field_setting_temporary(self, stdscr, id_list, info=None):
         table = SettingTable(info)
         modified_values = table.start(stdscr, id_list)
         if modified_values != None:
-            num_fields = len(modified_values)
-            payload_length = num_fields * 4 + 1
-            packet_payload += struct.pack('>B', payload_length)
-            packet_payload += struct.pack('>B', num_fields)
-            for id in modified_values:
-                if id != 3:
-                    packet_payload += struct.pack('>H', id)
-                    packet_payload += struct.pack('>H', int(modified_values[id], 16))
-                else:
-                    packet_payload += struct.pack('>H', id)
-                    packet_payload += bytes.fromhex(modified_values[id])
-            crc = bytes(self.calc_crc(packet_payload[2:]))
-            packet = packet_payload + crc
-        if packet is not None:
-            self.uut.ser_init()
-            resp_length = num_fields * 2 + 1 + 7
-            result = self.uut.write_read_response(packet, resp_length)
-            if result[0] == True:
+            if self.imu_set_field_val(modified_values):
                 stdscr.addstr(2, 0, "Set fields successfully.")
-                self.uut.ser_close()
-                key = stdscr.getch()
-                while key != ord('m') and key != ord('M'):
-                    key = stdscr.getch()
-            elif result[0] == False:
+            else:
                 stdscr.addstr(2, 0, "Set fields failed.")
-                self.uut.ser_close()
+            key = stdscr.getch()
+            while key != ord('m') and key != ord('M'):
                 key = stdscr.getch()
-                while key != ord('m') and key != ord('M'):
-                    key = stdscr.getch()
-            else:
-                self.uut.ser_close()
 
     def imu_field_setting_permanent(self, stdscr, id_list, info=None):
-        cmd = bytes(self.user_command['WF'])
-        packet_payload = cmd
-        packet = None
         table = SettingTable(info)
         modified_values = table.start(stdscr, id_list)
         if modified_values != None:
-            num_fields = len(modified_values)
-            payload_length = num_fields * 4 + 1
-            packet_payload += struct.pack('>B', payload_length)
-            packet_payload += struct.pack('>B', num_fields)
-            for id in modified_values:
-                if id != 3:
-                    packet_payload += struct.pack('>H', id)
-                    packet_payload += struct.pack('>H', int(modified_values[id], 16))
-                else:
-                    packet_payload += struct.pack('>H', id)
-                    packet_payload += bytes.fromhex(modified_values[id])
-            crc = bytes(self.calc_crc(packet_payload[2:]))
-            packet = packet_payload + crc
-        if packet is not None:
-            self.uut.ser_init()
-            resp_length = num_fields * 2 + 1 + 7
-            result = self.uut.write_read_response(packet, resp_length)
-            if result[0] == True:
+            if self.imu_set_field_val(modified_values, permanent=True):
                 stdscr.addstr(2, 0, "Write fields successfully, please reboot device.")
-                self.uut.ser_close()
-                key = stdscr.getch()
-                while key != ord('m') and key != ord('M'):
-                    key = stdscr.getch()
-            elif result[0] == False:
+            else:
                 stdscr.addstr(2, 0, "Write fields failed.")
-                self.uut.ser_close()
+            key = stdscr.getch()
+            while key != ord('m') and key != ord('M'):
                 key = stdscr.getch()
-                while key != ord('m') and key != ord('M'):
-                    key = stdscr.getch()
-            else:
-                self.uut.ser_close()
 
 #---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # subfunctions
 
-    def parse_to_csvf(self, data_path, data_type, head_line):
+    def parse_to_file(self, data_path, data_type, export_formats='csv', export_options=None, write_index=True, chunk_size=PARSE_CHUNK_SIZE,
+                      incremental=False, stats=False):
         '''
         data_path: The path of the data to be parsed
         data_type: The type of the data to be parsed
-        head_line: The header of the csv
-        '''
-        dataf = open(data_path, 'rb')
-        data = dataf.read()
-        packet_type_payload = bytes(self.packet_info[data_type][0])
-        packet_length = self.packet_info[data_type][1]
-
-        progress = 0
-        progress_length = len(data)
-        progress_step = packet_length
-
-        with open(f'{data_path[:-4]}.csv', 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(head_line)
-            head_line_length = len(head_line)
-            progress = 0
-            for i in range(len(data)):
-                packet_msg = data[i: i+packet_length]
-                packet_type_pos = packet_msg.find(packet_type_payload)
-                if packet_type_pos == 0:
-                    crc_check_payload = packet_msg[2: -2]
-                    crc = packet_msg[-2:]
-                    cal_crc = bytes(self.calc_crc(crc_check_payload))
-                    if cal_crc != crc:
-                        print('CRC ERROR!')
-                    if len(packet_msg) == packet_length:
-                        payload = packet_msg[5:-2]
-                        latest = eval(f'self.{data_type}_parse')(payload)
-                        data_line = [latest[i] for i in range(head_line_length)]
-                        writer.writerow(data_line)
-                        progress += (progress_step / progress_length) * 100
-                        yield progress
-    
-    def parse_to_csvf_li(self, data_path, data_type, head_line):
+        export_formats: The output formats, see data_export.available_formats()
+        export_options: The keyword arguments of data_export.create_exporters()
+        write_index: Write the packet index sidecar '<data name>.idx.npz' as well
+        chunk_size: The data is read and parsed chunk by chunk, so the memory does not grow with the file size
+        incremental: Save a checkpoint '<data name>.ckpt.json' after the run, the next run only parses the bytes
+                     appended to the log since then and appends the new rows to the outputs
+        stats: Write the channel statistics '<data name>.stats.json' as well
         '''
-        This function only for S3 packet
-
-        data_path: The path of the data to be parsed
-        data_type: The type of the data to be parsed
-        head_line: The header of the csv
-        '''
-        dataf = open(data_path, 'rb')
-        data = dataf.read()
-        packet_type_payload = bytes(self.packet_info[data_type][0])
-        packet_length = self.packet_info[data_type][1]
-
-        progress = 0
-        progress_length = len(data)
-        progress_step = packet_length
-
-        with open(f'{data_path[:-4]}.csv', 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(head_line)
-            head_line_length = len(head_line)
-            for i in range(len(data)):
-                packet_msg = data[i: i+packet_length]
-                packet_type_pos = packet_msg.find(packet_type_payload)
-                if packet_type_pos == 0:
-                    crc = packet_msg[-1]
-                    cal_crc = sum(packet_msg[2: -1]) & 0xFF
-                    if cal_crc != crc:
-                        print('CRC ERROR!')
-                    if len(packet_msg) == packet_length:
-                        payload = packet_msg[3:-1]
-                        latest = eval(f'self.{data_type}_parse')(payload)
-                        data_line = [latest[i] for i in range(head_line_length)]
-                        writer.writerow(data_line)
-                        progress += (progress_step / progress_length) * 100
-                        yield progress
-    
-    def parse_to_csvf_nio(self, data_path, data_type, head_line):
+        from .packet_decoder import PacketDecoder
+        from .packet_index import PacketIndexBuilder
+        from .data_export import create_exporters
+        from .channel_stats import LogStats
+        from .parse_checkpoint import ParseCheckpoint
+
+        packet_length = self.get_packet_length(data_path, data_type)
+        framer = self.create_framer(data_type, packet_length)
+        decoder = PacketDecoder(data_type, packet_length)
+        index_builder = PacketIndexBuilder(data_path, data_type, packet_length) if write_index else None
+        exporters = create_exporters(export_formats, data_path, decoder, **(export_options or {}))
+        log_stats = LogStats(data_path) if stats else None
+
+        checkpoint = ParseCheckpoint.load(data_path) if incremental else None
+        resume = (checkpoint is not None
+                  and checkpoint.matches(data_type, packet_length, export_formats, export_options, write_index, stats)
+                  and checkpoint.can_resume(self.output_paths(data_path, data_type, export_formats, export_options, write_index, stats)))
+        start = checkpoint.offset if resume else 0
+        rows = checkpoint.rows if resume else 0
+        last_end = start
+        if resume and index_builder is not None:
+            index_builder.resume(start, checkpoint.index_state)
+        if resume and log_stats is not None:
+            log_stats.set_state(checkpoint.stats_state)
+        progress_length = max(os.path.getsize(data_path) - start, 1)
+
+        with open(data_path, 'rb') as dataf:
+            for exporter in exporters:
+                exporter.open(append=resume)
+            try:
+                for base, data, result in framer.stream(dataf, chunk_size, start):
+                    latest = decoder.decode_at(data, result.accepted)
+                    for exporter in exporters:
+                        exporter.write(latest)
+                    if index_builder is not None:
+                        index_builder.add(result.accepted + base, result.rejected + base, latest)
+                    if log_stats is not None:
+                        log_stats.add(data_type, decoder, latest)
+                    if len(result.accepted):
+                        last_end = base + int(result.accepted[-1]) + packet_length
+                    rows += len(latest)
+                    yield ((base + result.consumed - start) / progress_length) * 100
+            finally:
+                for exporter in exporters:
+                    exporter.close()
+        if index_builder is not None:
+            index_builder.save()
+        if log_stats is not None:
+            log_stats.save()
+        if incremental:
+            ParseCheckpoint.after_run(data_path, data_type, packet_length, export_formats, export_options, write_index,
+                                      last_end, rows, index_builder.state() if index_builder is not None else None,
+                                      log_stats.state() if log_stats is not None else None).save()
+
+    def load_channels(self, data_path, data_type, groups, chunk_size=PARSE_CHUNK_SIZE):
         '''
-        This function only for AT packet
+        Decode the output columns of the given channel groups of a whole log
 
-        data_path: The path of the data to be parsed
-        data_type: The type of the data to be parsed
-        head_line: The header of the csv
-        '''
-        dataf = open(data_path, 'rb')
-        data = dataf.read()
-        packet_type_payload = bytes(self.packet_info[data_type][0])
-        packet_length = self.packet_info[data_type][1]
-
-        progress = 0
-        progress_length = len(data)
-        progress_step = packet_length
-
-        with open(f'{data_path[:-4]}.csv', 'w', newline='') as csvfile:
-            writer = csv.writer(csvfile)
-            writer.writerow(head_line)
-            head_line_length = len(head_line)
-            for i in range(len(data)):
-                packet_msg = data[i: i+packet_length]
-                packet_type_pos = packet_msg.find(packet_type_payload)
-                if packet_type_pos == 0:
-                    if len(packet_msg) == packet_length:
-                        payload = packet_msg[3:-2]
-                        latest = eval(f'self.{data_type}_parse')(payload)
-                        data_line = [latest[i] for i in range(head_line_length)]
-                        writer.writerow(data_line)
-                        progress += (progress_step / progress_length) * 100
-                        yield progress
+        returns ({channel name: float64 samples}, {channel name: channel group})
+        '''
+        import numpy as np
+        from .packet_decoder import PacketDecoder
+
+        packet_length = self.get_packet_length(data_path, data_type)
+        framer = self.create_framer(data_type, packet_length)
+        decoder = PacketDecoder(data_type, packet_length)
+        names = [name for name in decoder.head_line if decoder.groups[name] in groups]
+        blocks = {name: [] for name in names}
+        with open(data_path, 'rb') as dataf:
+            for base, data, result in framer.stream(dataf, chunk_size):
+                latest = decoder.decode_at(data, result.accepted)
+                for name in names:
+                    blocks[name].append(latest[name].astype('f8'))
+        channels = {name: np.concatenate(blocks[name]) if blocks[name] else np.empty(0) for name in names}
+        return channels, {name: decoder.groups[name] for name in names}
+
+    def parse_slice(self, data_path, data_type, export_formats='csv', export_options=None, packet_range=None, time_range=None,
+                    decimate=1, decimation='pick'):
+        '''
+        Export a packet or device time range of a log, decimated, to '<data name>_<range>_<decimation>' outputs
+        (see data_slice.slice_path_of()). The packet index of the log is used to read only the bytes of the range,
+        it is built first if it is missing or out of date.
+        '''
+        from .packet_decoder import PacketDecoder
+        from .packet_index import PacketIndex
+        from .data_export import create_exporters
+        from .data_slice import Decimator, IndexSlice, slice_path_of
 
-#---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
-# Parse functions
-
-    def S1_parse(self, payload):
-        fmt = '>hhhhhhhhhhHH'
-        data = struct.unpack(fmt, payload)
-        xAccel = data[0] * 20 / 2**16
-        yAccel = data[1] * 20 / 2**16
-        zAccel = data[2] * 20 / 2**16
-        xRate = data[3] * 1260 / 2**16
-        yRate = data[4] * 1260 / 2**16
-        zRate = data[5] * 1260 / 2**16
-        xRateTemp = data[6] * 200 / 2**16
-        yRateTemp = data[7] * 200 / 2**16
-        zRateTemp = data[8] * 200 / 2**16
-        boardTemp = data[9] * 200 / 2**16
-        timer = data[10] * 15.259022
-        BITstatus = data[11]
-
-        return xAccel, yAccel, zAccel, xRate, yRate, zRate, xRateTemp, yRateTemp, zRateTemp, boardTemp, timer, BITstatus
-
-    def S2_parse(self, payload):
-        gps_fmt = '<HI'
-        fmt = '<fffffffI'
-        gps_data = struct.unpack(gps_fmt, payload[:6])
-        data = struct.unpack(fmt, payload[6:])
-        gps_week = gps_data[0]
-        gps_time_of_week = gps_data[1]
-        x_accel = data[0]
-        y_accel = data[1]
-        z_accel = data[2]
-        x_gyro = data[3]
-        y_gyro = data[4]
-        z_gyro = data[5]
-        temp = data[6]
-        master_bits = data[7]
-        
-        return gps_week, gps_time_of_week, x_accel, y_accel, z_accel, x_gyro, y_gyro, z_gyro, temp, master_bits
-
-    def S3_parse(self, payload):
-        fmt = '<I' + 'i'*6 + 'h' +'H'+'I'
-        parse_data = struct.unpack(fmt, payload)
-        num = parse_data[0]
-        xRateCounts = parse_data[1]
-        yRateCounts = parse_data[2]
-        zRateCounts = parse_data[3]
-        xAccelCounts = parse_data[4]
-        yAccelCounts = parse_data[5]
-        zAccelCounts = parse_data[6]
-        systemp = parse_data[7]
-        supplierid = parse_data[8]
-        productid = parse_data[9]
-
-
-        xAccel = round(xAccelCounts * 0.000001, 5) * 0.1
-        yAccel = round(yAccelCounts * 0.000001, 5) * 0.1
-        zAccel = round(zAccelCounts * 0.000001, 5) * 0.1
-        xRate = round(xRateCounts * 0.000001, 5)
-        yRate = round(yRateCounts * 0.000001, 5)
-        zRate = round(zRateCounts * 0.000001, 5)
-        boardTempCounts = round(systemp * 0.008, 3)
-
-        return num,  xRate, yRate, zRate, xAccel, yAccel, zAccel,boardTempCounts, supplierid, productid
-
-    def A1_parse(self, payload):
-        fmt = '>hhhhhhhhhhhhhIH'
-        parse_data = struct.unpack(fmt, payload)
-
-        rollAngle = parse_data[0] * (360 / 2**16)
-        pitchAngle = parse_data[1] * (360 / 2**16)
-        yawAngle = parse_data[2] * (360 / 2**16)
-        xRateCorrected = parse_data[3] * (1260 / 2**16)
-        yRateCorrected = parse_data[4] * (1260 / 2**16)
-        zRateCorrected = parse_data[5] * (1260 / 2**16)
-        xAccel = parse_data[6] * (20 / 2**16)
-        yAccel = parse_data[7] * (20 / 2**16)
-        zAccel = parse_data[8] * (20 / 2**16)
-        xMag = parse_data[9] * (2 / 2**16)
-        yMag = parse_data[10] * (2 / 2**16)
-        zMag = parse_data[11] * (2 / 2**16)
-        xRateTemp = parse_data[12] * (200 / 2**16)
-        timeITOW = parse_data[13]
-        BITstatus = parse_data[14]
-
-        return rollAngle, pitchAngle, yawAngle, xRateCorrected, yRateCorrected, zRateCorrected, xAccel, yAccel, zAccel, xMag, yMag, zMag, xRateTemp, timeITOW, BITstatus
-
-    def A2_parse(self, payload):
-        fmt = '>hhhhhhhhhhhhIH'
-        parse_data = struct.unpack(fmt, payload)
-        rollAngle = parse_data[0] * (360 / 2**16)
-        pitchAngle = parse_data[1] * (360 / 2**16)
-        yawAngle = parse_data[2] * (360 / 2**16)
-        xRateCorrected = parse_data[3] * (1260 / 2**16)
-        yRateCorrected = parse_data[4] * (1260 / 2**16)
-        zRateCorrected = parse_data[5] * (1260 / 2**16)
-        xAccel = parse_data[6] * (20 / 2**16)
-        yAccel = parse_data[7] * (20 / 2**16)
-        zAccel = parse_data[8] * (20 / 2**16)
-        xRateTemp = parse_data[9] * (200 / 2**16)
-        yRateTemp = parse_data[10] * (200 / 2**16)
-        zRateTemp = parse_data[11] * (200 / 2**16)
-        timeITOW = parse_data[12]
-        BITstatus = parse_data[13]
-        return rollAngle, pitchAngle, yawAngle, xRateCorrected, yRateCorrected, zRateCorrected, xAccel, yAccel, zAccel, xRateTemp, yRateTemp, zRateTemp, timeITOW, BITstatus
-
-    def FM_parse(self, payload, chip_num):
-        if len(payload) > (chip_num * 28) + 4:
-            fmt = '<' + 'i'*chip_num*7 + 'H'*3
+        if PacketIndex.exists(data_path):
+            index = PacketIndex(data_path)
         else:
-            fmt = '<' + 'i'*chip_num*7 + 'H'*2
-        parse_data = struct.unpack(fmt, payload)
-
-        return parse_data
-
-    def AT_parse(self, payload):
-        fmt = '<hhhhhhhBBBHHIHBBBBBH'
-        parse_data = struct.unpack(fmt, payload)
-        xRate = parse_data[0] * (300/32768)
-        yRate = parse_data[1] * (300/32768)
-        zRate = parse_data[2] * (300/32768)
-        xAccel = parse_data[3] * (12/32768)
-        yAccel = parse_data[4] * (12/32768)
-        zAccel = parse_data[5] * (12/32768)
-        Temp = parse_data[6] * (200.0/32768)
-        FixVal = parse_data[7]
-        Flags0 = parse_data[8]
-        Flags1 = parse_data[9]
-        FramCounts = parse_data[10]
-        GpsWeek = parse_data[11]
-        TimeOfWeek = parse_data[12] * (1E-03)
-        year = parse_data[13]
-        month = parse_data[14]
-        day = parse_data[15]
-        hour = parse_data[16]
-        minute = parse_data[17]
-        second = parse_data[18]
-        milliseconds = parse_data[19]
-
-        return  xRate, yRate, zRate, xAccel, yAccel, zAccel, Temp, FixVal, Flags0, Flags1, FramCounts, GpsWeek, TimeOfWeek, year, month, day, hour, minute, second, milliseconds
+            index = self.imu_build_index(data_path)
+        start, stop = 0, len(index)
+        if packet_range is not None:
+            start, stop = max(start, packet_range[0]), min(stop, packet_range[1])
+        if time_range is not None:
+            start, stop = max(start, index.find_time(time_range[0])), min(stop, index.find_time(time_range[1]))
+        decoder = PacketDecoder(data_type, index.packet_length)
+        packets = IndexSlice(index, decoder, start, stop)
+        decimator = Decimator(decimate, decimation, decoder.groups)
+        out_path = slice_path_of(data_path, packet_range, time_range, decimate, decimation)
+        exporters = create_exporters(export_formats, out_path, decoder, **(export_options or {}))
+        progress_length = max(len(packets), 1)
+        for exporter in exporters:
+            exporter.open()
+        try:
+            for done, latest in packets.read():
+                latest = decimator.process(latest, final=done == len(packets))
+                for exporter in exporters:
+                    exporter.write(latest)
+                yield done / progress_length * 100
+            if len(packets) == 0:
+                yield 100
+        finally:
+            for exporter in exporters:
+                exporter.close()
+
+    def output_paths(self, data_path, data_type, export_formats='csv', export_options=None, write_index=True, stats=False):
+        '''
+        The files written by parse_to_file()
+        '''
+        from .packet_decoder import PacketDecoder
+        from .packet_index import index_path_of
+        from .data_export import create_exporters
+        from .channel_stats import stats_path_of
+
+        decoder = PacketDecoder(data_type, self.get_packet_length(data_path, data_type))
+        out_paths = [exporter.out_path for exporter in create_exporters(export_formats, data_path, decoder, **(export_options or {}))]
+        if write_index:
+            out_paths.append(index_path_of(data_path))
+        if stats:
+            out_paths.append(stats_path_of(data_path))
+        return out_paths
+
+    def imu_build_index(self, data_path):
+        '''
+        Write the packet index sidecar of a log without parsing it to a file, returns the PacketIndex
+        '''
+        from .packet_index import build_index
+
+        data_type = self.get_data_type(data_path)
+        packet_length = self.get_packet_length(data_path, data_type)
+        return build_index(data_path, data_type, packet_length, self.create_framer(data_type, packet_length))
+
+    def create_framer(self, data_type, packet_length):
+        from ..common.packet_schema import get_schema
+        from .packet_framer import PacketFramer
+
+        schema = get_schema(data_type, packet_length)
+        return PacketFramer(schema.header, packet_length, schema.checksum)
+
+    def get_packet_length(self, data_path, data_type):
+        from ..common.packet_schema import get_schema
+
+        schema = get_schema(data_type)
+        packet_length = schema.packet_length
+        if schema.variable_length:
+            detected = self.get_data_types(data_path).get(data_type) # checked by the checksum already
+            if detected is not None:
+                return detected
+            with open(data_path, 'rb') as dataf:
+                packet_length = self.probe_packet_length(dataf.read(PARSE_CHUNK_SIZE), schema)
+        return packet_length
+
+    def get_data_type(self, data_path):
+        '''
+        Get the packet type of a log: the type found in its content, MIXED_DATA_TYPE if there are several.
+        The type in the file name is used if the content has no known packets.
+        '''
+        data_types = self.get_data_types(data_path)
+        if len(data_types) > 1:
+            return MIXED_DATA_TYPE
+        if len(data_types) == 1:
+            return list(data_types)[0]
+        return self.get_name_data_type(data_path)
+
+    def get_data_types(self, data_path):
+        '''
+        {packet type: packet length} of the packet types found in the content, see packet_demux.detect_packet_types()
+        '''
+        from .packet_demux import detect_packet_types
+
+        stat = os.stat(data_path)
+        key = (os.path.abspath(data_path), stat.st_size, stat.st_mtime_ns)
+        if key not in self.detected_types:
+            self.detected_types[key] = detect_packet_types(data_path)
+        return self.detected_types[key]
+
+    def get_name_data_type(self, data_path):
+        '''
+        Get the packet type from the file name, 'device name'_'packet type'_'suffix'.bin
+        '''
+        data_file_name = os.path.basename(data_path.replace('\\', '/')) # get the file name
+        name_parts = data_file_name.split('_')
+        if len(name_parts) < 2:
+            return None
+        data_type = name_parts[1] # get the packet type
+        if data_type.find('.') != -1:
+            data_type = data_type.split('.')[0]
+        return data_type
+
+    def probe_packet_length(self, data, schema):
+        '''
+        Get the packet length from the length byte of the first packet with a valid checksum, FM packets vary
+        with the number of chips. The default length of the schema if there is none.
+        '''
+        from .packet_demux import probe_length
+
+        packet_length = probe_length(data, schema)
+        return packet_length if packet_length is not None else schema.packet_length
 
 #---------------------------------------------------------------------------------------------------------------------------------------------------------------------------------
 # calculate crc
@@ -518,18 +518,7 @@ class IMUFunc:
         '''
         Calculates 16-bit CRC-CCITT
         '''
-        crc = 0x1D0F
-        for bytedata in payload:
-            crc = crc ^ (bytedata << 8)
-            i = 0
-            while i < 8:
-                if crc & 0x8000:
-                    crc = (crc << 1) ^ 0x1021
-                else:
-                    crc = crc << 1
-                i += 1
-
-        crc = crc & 0xffff
+        crc = calc_crc(payload)
         crc_msb = (crc & 0xFF00) >> 8
         crc_lsb = (crc & 0x00FF)
-        return [crc_msb, crc_lsb]
\ No newline at end of file
+        return [crc_msb, crc_lsb]
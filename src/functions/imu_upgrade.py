@@ -3,6 +3,8 @@ import serial
 import time
 
 from ..communication.aceinna_uart import Uart
+from ..common.crc import calc_crc
+from ..common.progress import ProgressThrottle
 
 LOCKEEPROM = [0x4c, 0x45]
 LOCKAPP = [0x4c, 0x41]
@@ -35,17 +37,7 @@ class IMU330BA:
     def calc_crc(self, payload):
         '''Calculates CRC per 380 manual
         '''
-        crc = 0x1D0F
-        for bytedata in payload:
-            crc = crc ^ (bytedata << 8)
-            for i in range(0, 8):
-                if crc & 0x8000:
-                    crc = (crc << 1) ^ 0x1021
-                else:
-                    crc = crc << 1
-
-        crc = crc & 0xffff
-        return crc
+        return calc_crc(payload)
 
     def build_content(self, content):
         len_mod = len(content) % 16
@@ -324,7 +316,7 @@ class IMU330BA:
         fw = self.build_content(fw)
         fs_len = len(fw)
 
-        progress = 0
+        throttle = ProgressThrottle()
 
         time.sleep(1)
         while write_len < fs_len:
@@ -333,6 +325,7 @@ class IMU330BA:
             write_buf = fw[write_len:(write_len + packet_data_len)]
             self.write_block(write_buf, packet_data_len, write_len)
             write_len += packet_data_len
-            progress += (max_data_len / fs_len) * 100
-            yield progress
+            progress = (write_len / fs_len) * 100
+            if throttle.update(progress):
+                yield progress
             
@@ -0,0 +1,63 @@
+import numpy as np
+
+from ..common.packet_schema import get_schema
+
+
+class PacketDecoder:
+    '''
+    Decode a batch of packets into one numpy structured array, the scaling is applied column-wise.
+
+    data_type: The type of the packets
+    packet_length: The length of a whole packet (header + payload + crc), only needed for FM
+    '''
+    def __init__(self, data_type, packet_length=None):
+        schema = get_schema(data_type, packet_length)
+        if not schema.decodable:
+            raise ValueError(f'{data_type} packets have no decoder')
+        self.data_type = data_type
+        self.packet_length = schema.packet_length
+        self.head_line = schema.columns
+        self.fields = schema.fields
+        self.scales = schema.scales
+        self.groups = schema.groups
+        self.raw_dtype = schema.raw_dtype
+        self.dtype = schema.dtype
+
+    def gather(self, data, offsets):
+        '''
+        Copy the packets starting at offsets out of data into a (n, packet_length) uint8 array
+        '''
+        buf = np.frombuffer(data, dtype=np.uint8)
+        offsets = np.asarray(offsets, dtype=np.int64)
+        return buf[offsets[:, None] + np.arange(self.packet_length)]
+
+    def raw_at(self, data, offsets):
+        '''
+        The unscaled fields of the packets starting at offsets of data
+        '''
+        return self.gather(data, offsets).reshape(-1).view(self.raw_dtype)
+
+    def decode(self, packets):
+        '''
+        packets: bytes of back-to-back packets, or a (n, packet_length) uint8 array
+        '''
+        if isinstance(packets, np.ndarray):
+            raw = np.ascontiguousarray(packets, dtype=np.uint8).reshape(-1).view(self.raw_dtype)
+        else:
+            raw = np.frombuffer(packets, dtype=self.raw_dtype)
+        out = np.empty(len(raw), dtype=self.dtype)
+        for name in self.head_line:
+            scale = self.scales[name]
+            if scale is None:
+                out[name] = raw[name]
+            elif callable(scale):
+                out[name] = scale(raw[name].astype('f8'))
+            else:
+                out[name] = raw[name] * scale
+        return out
+
+    def decode_at(self, data, offsets):
+        '''
+        Decode the packets starting at offsets of data
+        '''
+        return self.decode(self.gather(data, offsets))
@@ -0,0 +1,176 @@
+import os
+import numpy as np
+
+from ..common.packet_schema import get_schema, decodable_types
+from .packet_framer import PacketFramer
+from .packet_decoder import PacketDecoder
+from .data_export import create_exporters
+from .channel_stats import LogStats
+
+DETECT_SAMPLE_SIZE = 1 << 20 # 1MB
+DETECT_SAMPLES = 4
+DETECT_MIN_PACKETS = 3
+DEMUX_CHUNK_SIZE = 1 << 22 # 4MB
+
+
+def probe_length(data, schema, max_candidates=16):
+    '''
+    Length of a variable length packet type: the first header candidate whose length byte
+    gives a packet with a valid checksum
+    '''
+    buf = np.frombuffer(data, dtype=np.uint8)
+    candidates = PacketFramer(schema.header, schema.packet_length).find_headers(buf)
+    for pos in candidates[:max_candidates].tolist():
+        if pos + 5 > len(buf):
+            break
+        packet_length = int(buf[pos + 4]) + 7
+        if pos + packet_length > len(buf):
+            continue
+        try:
+            get_schema(schema.data_type, packet_length)
+        except ValueError:
+            continue
+        if PacketFramer(schema.header, packet_length, schema.checksum).check(buf, np.array([pos]))[0]:
+            return packet_length
+    return None
+
+
+def chained(offsets, packet_length):
+    '''
+    Keep the packets which follow or are followed by another packet directly,
+    packets without a checksum are only trusted in a back-to-back run
+    '''
+    return offsets[np.isin(offsets + packet_length, offsets) | np.isin(offsets - packet_length, offsets)]
+
+
+def detect_packet_types(data_path, sample_size=DETECT_SAMPLE_SIZE, samples=DETECT_SAMPLES, min_packets=DETECT_MIN_PACKETS):
+    '''
+    Find the packet types in a log from its content: a few windows spread over the file are framed
+    with every known packet type, the types with enough valid packets are present.
+
+    returns {packet type: packet length}, the most frequent type first
+    '''
+    file_size = os.path.getsize(data_path)
+    starts = sorted(set(np.linspace(0, max(file_size - sample_size, 0), samples).astype(np.int64).tolist()))
+    counts = {}
+    lengths = {}
+    with open(data_path, 'rb') as dataf:
+        for start in starts:
+            dataf.seek(start)
+            data = dataf.read(sample_size)
+            for data_type in decodable_types():
+                schema = get_schema(data_type)
+                packet_length = lengths.get(data_type, schema.packet_length)
+                if schema.variable_length and data_type not in lengths:
+                    packet_length = probe_length(data, schema)
+                    if packet_length is None:
+                        continue
+                accepted = PacketFramer(schema.header, packet_length, schema.checksum).frame(data).accepted
+                if schema.checksum is None:
+                    accepted = chained(accepted, packet_length)
+                if len(accepted):
+                    counts[data_type] = counts.get(data_type, 0) + len(accepted)
+                    lengths[data_type] = packet_length
+    present = sorted((data_type for data_type in counts if counts[data_type] >= min_packets), key=lambda t: -counts[t])
+    return {data_type: lengths[data_type] for data_type in present}
+
+
+class PacketDemux:
+    '''
+    Parse a log holding several packet types in one read of the file, every type goes to its own outputs
+    named '<data name>_<packet type>' (e.g. imu_S1_0801_A1.csv).
+
+    packet_types: {packet type: packet length}, see detect_packet_types()
+    export_formats: The output formats, see data_export.available_formats()
+    export_options: The keyword arguments of data_export.create_exporters()
+    stats: Write the channel statistics of all types to '<data name>.stats.json'
+    '''
+    def __init__(self, data_path, packet_types, export_formats='csv', export_options=None, stats=False):
+        self.data_path = data_path
+        self.packet_types = packet_types
+        self.log_stats = LogStats(data_path) if stats else None
+        self.framers = {}
+        self.decoders = {}
+        self.exporters = {}
+        for data_type, packet_length in packet_types.items():
+            schema = get_schema(data_type, packet_length)
+            self.framers[data_type] = PacketFramer(schema.header, packet_length, schema.checksum)
+            self.decoders[data_type] = PacketDecoder(data_type, packet_length)
+            self.exporters[data_type] = create_exporters(export_formats, self.type_path(data_type), self.decoders[data_type],
+                                                         **(export_options or {}))
+
+    def type_path(self, data_type):
+        return f'{self.data_path[:-4]}_{data_type}.bin'
+
+    def output_paths(self):
+        return [exporter.out_path for exporters in self.exporters.values() for exporter in exporters]
+
+    def parse(self, chunk_size=DEMUX_CHUNK_SIZE):
+        '''
+        Frame every type in each chunk, yields the progress.
+
+        Each type keeps its own resume point, so the result is the same as framing the log once per type;
+        the bytes from the earliest resume point are carried to the next chunk.
+        '''
+        progress_length = max(os.path.getsize(self.data_path), 1)
+        starts = {data_type: 0 for data_type in self.packet_types}
+        base = 0
+        carry = b''
+        for exporters in self.exporters.values():
+            for exporter in exporters:
+                exporter.open()
+        try:
+            with open(self.data_path, 'rb') as dataf:
+                while True:
+                    chunk = dataf.read(chunk_size)
+                    final = len(chunk) < chunk_size
+                    data = carry + chunk
+                    view = memoryview(data)
+                    found = {}
+                    for data_type, framer in self.framers.items():
+                        offset = starts[data_type] - base
+                        result = framer.frame(view[offset:], final)
+                        found[data_type] = result.accepted + offset
+                        starts[data_type] = base + offset + result.consumed
+                    self.drop_unchecked(found)
+                    for data_type, offsets in found.items():
+                        latest = self.decoders[data_type].decode_at(data, offsets)
+                        for exporter in self.exporters[data_type]:
+                            exporter.write(latest)
+                        if self.log_stats is not None:
+                            self.log_stats.add(data_type, self.decoders[data_type], latest)
+                    if final:
+                        break
+                    resume = min(starts.values())
+                    carry = data[resume - base:]
+                    base = resume
+                    yield (base / progress_length) * 100
+        finally:
+            for exporters in self.exporters.values():
+                for exporter in exporters:
+                    exporter.close()
+        if self.log_stats is not None:
+            self.log_stats.save()
+        yield 100
+
+    def drop_unchecked(self, found):
+        '''
+        Packets without a checksum which overlap a checked packet of another type are payload bytes
+        which happen to look like a header
+        '''
+        checked = [data_type for data_type in found if self.framers[data_type].checksum is not None]
+        if not checked:
+            return
+        packet_starts = np.concatenate([found[data_type] for data_type in checked])
+        packet_ends = np.concatenate([found[data_type] + self.framers[data_type].packet_length for data_type in checked])
+        order = np.argsort(packet_starts, kind='stable')
+        packet_starts = packet_starts[order]
+        packet_ends = np.maximum.accumulate(packet_ends[order]) if len(order) else packet_ends
+        for data_type in found:
+            framer = self.framers[data_type]
+            if framer.checksum is not None or len(packet_starts) == 0:
+                continue
+            offsets = found[data_type]
+            idx = np.searchsorted(packet_starts, offsets + framer.packet_length, side='left') - 1
+            overlap = (idx >= 0) & (packet_ends[np.maximum(idx, 0)] > offsets)
+            found[data_type] = offsets[~overlap]
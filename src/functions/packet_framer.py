@@ -0,0 +1,120 @@
+import collections
+import numpy as np
+
+from ..common.crc import check_crc_batch, check_sum8_batch
+
+FrameResult = collections.namedtuple('FrameResult', ['accepted', 'rejected', 'consumed'])
+
+
+class PacketFramer:
+    '''
+    Find every packet of one type in a buffer in a single pass.
+
+    header: The header bytes of the packet
+    packet_length: The length of a whole packet
+    checksum: 'crc' (CRC-CCITT), 'sum8' (8-bit sum) or None if the packet has no checksum
+    '''
+    def __init__(self, header, packet_length, checksum=None):
+        self.header = np.frombuffer(bytes(header), dtype=np.uint8)
+        self.packet_length = packet_length
+        self.checksum = checksum
+
+    def find_headers(self, buf):
+        '''
+        Offsets of all header candidates in buf (uint8 array)
+        '''
+        header_length = len(self.header)
+        n = len(buf) - header_length + 1
+        if n <= 0:
+            return np.empty(0, dtype=np.int64)
+        mask = buf[:n] == self.header[0]
+        for k in range(1, header_length):
+            mask &= buf[k: n + k] == self.header[k]
+        return np.flatnonzero(mask)
+
+    def check(self, buf, offsets, block_size=65536):
+        '''
+        Check the checksum of the packets at offsets, block by block
+        '''
+        valid = np.ones(len(offsets), dtype=bool)
+        if self.checksum is None:
+            return valid
+        check = check_crc_batch if self.checksum == 'crc' else check_sum8_batch
+        span = np.arange(self.packet_length)
+        for i in range(0, len(offsets), block_size):
+            block = offsets[i: i + block_size]
+            valid[i: i + len(block)] = check(buf[block[:, None] + span])
+        return valid
+
+    def frame(self, data, final=True):
+        '''
+        data: bytes-like buffer
+        final: False if more data follows, the packet cut at the end of data is left unconsumed
+
+        returns FrameResult:
+            accepted: offsets of the packets with valid length and checksum
+            rejected: offsets of the header candidates outside accepted packets that failed the checks
+            consumed: number of bytes fully processed, the remaining bytes should be carried to the next call
+        '''
+        buf = np.frombuffer(data, dtype=np.uint8)
+        length = self.packet_length
+        candidates = self.find_headers(buf)
+        complete = candidates + length <= len(buf)
+        incomplete = candidates[~complete]
+        candidates = candidates[complete]
+        valid = self.check(buf, candidates)
+
+        # skip past accepted packets: a valid candidate is only taken if it starts after the previous packet
+        accepted = candidates[valid]
+        if len(accepted) > 1 and np.any(np.diff(accepted) < length):
+            keep = []
+            next_free = 0
+            for pos in accepted.tolist():
+                if pos >= next_free:
+                    keep.append(pos)
+                    next_free = pos + length
+            accepted = np.array(keep, dtype=np.int64)
+
+        rejected = self.outside(candidates[~valid], accepted)
+        incomplete = self.outside(incomplete, accepted)
+        last_end = int(accepted[-1]) + length if len(accepted) else 0
+        if final:
+            rejected = np.concatenate([rejected, incomplete])
+            consumed = len(buf)
+        elif len(incomplete):
+            consumed = int(incomplete[0])
+        else:
+            consumed = max(last_end, len(buf) - len(self.header) + 1, 0)
+        return FrameResult(accepted.astype(np.int64), rejected.astype(np.int64), consumed)
+
+    def stream(self, f, chunk_size=1 << 22, start=0):
+        '''
+        Frame a file chunk by chunk with bounded memory, the bytes of a packet cut by
+        the chunk boundary are carried over to the next chunk.
+
+        f: file opened in binary mode
+        yields (base, data, result), base is the file offset of data[0]
+        '''
+        f.seek(start)
+        base = start
+        carry = b''
+        while True:
+            chunk = f.read(chunk_size)
+            final = len(chunk) < chunk_size
+            data = carry + chunk
+            result = self.frame(data, final=final)
+            yield base, data, result
+            if final:
+                break
+            carry = data[result.consumed:]
+            base += result.consumed
+
+    def outside(self, offsets, accepted):
+        '''
+        Drop the offsets which lie inside an accepted packet
+        '''
+        if len(accepted) == 0 or len(offsets) == 0:
+            return offsets
+        idx = np.searchsorted(accepted, offsets, side='right') - 1
+        inside = (idx >= 0) & (offsets < accepted[np.maximum(idx, 0)] + self.packet_length)
+        return offsets[~inside]
@@ -0,0 +1,162 @@
+import os
+import numpy as np
+
+from ..common.packet_schema import get_schema
+from .packet_decoder import PacketDecoder
+
+PACKET_OK = 1
+PACKET_REJECTED = 0
+
+
+def index_path_of(data_path):
+    return f'{data_path[:-4]}.idx.npz'
+
+
+class PacketIndexBuilder:
+    '''
+    Collect the packet offsets, device time and checksum status while a log is framed,
+    save() writes them to the sidecar '<data name>.idx.npz'.
+    The device time is the 'time' field of the packet schema, counters which wrap around
+    (S1 timer, S3 num, FM sampleIdx) are unwrapped so the time keeps increasing: a drop of more than half the
+    wrap-around period is a wrap, a smaller one an out of order or glitched value.
+    '''
+    def __init__(self, data_path, data_type, packet_length):
+        self.data_path = data_path
+        self.data_type = data_type
+        self.packet_length = packet_length
+        self.time_field, self.week_field, self.wrap = get_schema(data_type, packet_length).time
+        self.offsets = []
+        self.status = []
+        self.times = []
+        self.weeks = []
+        self.last_time = None
+        self.wrap_count = 0
+
+    def unwrap(self, time):
+        if self.wrap is None or len(time) == 0:
+            return time
+        previous = np.concatenate([[time[0] if self.last_time is None else self.last_time], time[:-1]])
+        wraps = self.wrap_count + np.cumsum(time < previous - self.wrap / 2) # smaller steps back are jitter, not a wrap
+        self.last_time = time[-1]
+        self.wrap_count = int(wraps[-1])
+        return time + wraps * self.wrap
+
+    def state(self):
+        return [None if self.last_time is None else float(self.last_time), self.wrap_count]
+
+    def resume(self, offset, state):
+        '''
+        Continue the saved index of the log from the file offset where the incremental parse restarts,
+        state: the state() of the builder which saved it
+        '''
+        with np.load(index_path_of(self.data_path)) as idx:
+            keep = idx['offset'] < offset
+            self.offsets = [idx['offset'][keep]]
+            self.status = [idx['status'][keep]]
+            self.times = [idx['time'][keep]]
+            self.weeks = [idx['week'][keep]]
+        self.last_time, self.wrap_count = state
+
+    def add(self, accepted, rejected, latest):
+        '''
+        accepted, rejected: file offsets of the accepted packets and of the rejected header candidates
+        latest: decoded rows of the accepted packets
+        '''
+        time = self.unwrap(latest[self.time_field].astype('f8'))
+        if self.week_field is not None:
+            week = latest[self.week_field].astype(np.uint16)
+        else:
+            week = np.zeros(len(time), dtype=np.uint16)
+        offsets = np.concatenate([accepted, rejected]).astype(np.uint64)
+        order = np.argsort(offsets, kind='stable')
+        self.offsets.append(offsets[order])
+        self.status.append(np.concatenate([np.full(len(accepted), PACKET_OK, dtype=np.uint8),
+                                           np.full(len(rejected), PACKET_REJECTED, dtype=np.uint8)])[order])
+        self.times.append(np.concatenate([time, np.full(len(rejected), np.nan)])[order])
+        self.weeks.append(np.concatenate([week, np.zeros(len(rejected), dtype=np.uint16)])[order])
+
+    def save(self):
+        np.savez_compressed(index_path_of(self.data_path),
+                            offset=np.concatenate(self.offsets or [np.empty(0, np.uint64)]),
+                            status=np.concatenate(self.status or [np.empty(0, np.uint8)]),
+                            time=np.concatenate(self.times or [np.empty(0)]),
+                            week=np.concatenate(self.weeks or [np.empty(0, np.uint16)]),
+                            data_type=self.data_type,
+                            packet_length=self.packet_length,
+                            file_size=os.path.getsize(self.data_path),
+                            time_field=self.time_field)
+
+
+class PacketIndex:
+    '''
+    Random access into a raw log through its sidecar index.
+
+    packet numbers count the accepted packets only, like the rows of the parsed output
+    '''
+    def __init__(self, data_path):
+        self.data_path = data_path
+        with np.load(index_path_of(data_path)) as idx:
+            self.data_type = str(idx['data_type'])
+            self.packet_length = int(idx['packet_length'])
+            self.file_size = int(idx['file_size'])
+            self.time_field = str(idx['time_field'])
+            self.status = idx['status']
+            valid = self.status == PACKET_OK
+            self.offsets = idx['offset'][valid]
+            self.time = idx['time'][valid]
+            self.week = idx['week'][valid]
+
+    @staticmethod
+    def exists(data_path):
+        '''
+        The index is usable if it was built from the current content of the log
+        '''
+        index_path = index_path_of(data_path)
+        if not os.path.exists(index_path):
+            return False
+        with np.load(index_path) as idx:
+            return int(idx['file_size']) == os.path.getsize(data_path)
+
+    def __len__(self):
+        return len(self.offsets)
+
+    def packet_offset(self, n):
+        return int(self.offsets[n])
+
+    def find_time(self, t, week=None):
+        '''
+        Number of the first packet at or after the device time t (and gps week)
+        '''
+        if week is None:
+            after = self.time >= t
+        else:
+            after = (self.week > week) | ((self.week == week) & (self.time >= t))
+        if not np.any(after):
+            return len(self.offsets)
+        return int(np.argmax(after))
+
+    def read_packets(self, start, stop):
+        '''
+        Decode the packets [start, stop) without framing the log again
+        '''
+        offsets = self.offsets[start:stop].astype(np.int64)
+        decoder = PacketDecoder(self.data_type, self.packet_length)
+        if len(offsets) == 0:
+            return decoder.decode(np.empty((0, self.packet_length), dtype=np.uint8))
+        with open(self.data_path, 'rb') as dataf:
+            dataf.seek(int(offsets[0]))
+            data = dataf.read(int(offsets[-1] - offsets[0]) + self.packet_length)
+        return decoder.decode_at(data, offsets - offsets[0])
+
+
+def build_index(data_path, data_type, packet_length, framer, chunk_size=1 << 22):
+    '''
+    Dedicated indexer: frame the log and write its sidecar index without exporting the data
+    '''
+    decoder = PacketDecoder(data_type, packet_length)
+    builder = PacketIndexBuilder(data_path, data_type, packet_length)
+    with open(data_path, 'rb') as dataf:
+        for base, data, result in framer.stream(dataf, chunk_size):
+            builder.add(result.accepted + base, result.rejected + base, decoder.decode_at(data, result.accepted))
+    builder.save()
+    return PacketIndex(data_path)
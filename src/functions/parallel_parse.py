@@ -0,0 +1,288 @@
+import os
+import collections
+import concurrent.futures
+
+from .imu_func import IMUFunc, MIXED_DATA_TYPE
+from .packet_decoder import PacketDecoder
+from .data_export import create_exporters
+from ..common.packet_schema import get_schema, decodable_types
+from .packet_index import PacketIndexBuilder
+from .parse_checkpoint import ParseCheckpoint
+from .parse_cache import ParseCache
+from .channel_stats import ChannelStats, LogStats, stats_channels
+from .data_quality import DataQuality, save_quality_summary
+
+PARALLEL_CHUNK_SIZE = 1 << 24 # 16MB
+PARSE_DATA_TYPES = decodable_types()
+
+
+def parse_range(data_path, data_type, packet_length, start, stop, export_formats='csv', export_options=None, stats=False):
+    '''
+    Worker of ParallelParser: decode the packets which start in [start, stop) of the file
+
+    returns (offset of the first packet, end offset of the last packet, rows encoded for each exporter,
+             (accepted offsets, rejected offsets, device time columns) for the packet index,
+             channel statistics of the rows or None)
+    '''
+    framer = IMUFunc().create_framer(data_type, packet_length)
+    decoder = PacketDecoder(data_type, packet_length)
+    with open(data_path, 'rb') as dataf:
+        dataf.seek(start)
+        data = dataf.read(stop - start + packet_length - 1)
+    result = framer.frame(data)
+    accepted = result.accepted[result.accepted < stop - start]
+    rejected = result.rejected[result.rejected < stop - start]
+    latest = decoder.decode_at(data, accepted)
+    exporters = create_exporters(export_formats, data_path, decoder, **(export_options or {}))
+    encoded = [exporter.encode(latest) for exporter in exporters]
+    index_rows = (accepted + start, rejected + start, {name: latest[name] for name in get_schema(data_type, packet_length).time[:2] if name is not None})
+    chunk_stats = None
+    if stats:
+        chunk_stats = ChannelStats(stats_channels(decoder))
+        chunk_stats.add(latest)
+    if len(accepted) == 0:
+        return None, None, encoded, index_rows, chunk_stats
+    return int(accepted[0]) + start, int(accepted[-1]) + start + packet_length, encoded, index_rows, chunk_stats
+
+
+def check_quality(data_path):
+    '''
+    Worker of check_files_quality(): the quality report of one log, None if its packet type is not decodable
+    '''
+    imu_func = IMUFunc()
+    data_type = imu_func.get_data_type(data_path)
+    if data_type not in PARSE_DATA_TYPES:
+        return None
+    quality = DataQuality(data_path, data_type, imu_func.get_packet_length(data_path, data_type))
+    for _ in quality.check():
+        pass
+    return quality.save()
+
+
+def check_files_quality(data_paths, workers=None):
+    '''
+    Check the quality of many logs on a process pool, one log per task, yields the progress.
+    The counts of all logs are collected in 'quality_summary.json' in the folder of the first log.
+    '''
+    reports = []
+    if data_paths:
+        with concurrent.futures.ProcessPoolExecutor(max_workers=workers or os.cpu_count() or 1) as executor:
+            for i, report in enumerate(executor.map(check_quality, data_paths)):
+                if report is not None:
+                    reports.append(report)
+                yield (i + 1) / len(data_paths) * 100
+        save_quality_summary(os.path.dirname(os.path.abspath(data_paths[0])), reports)
+    yield 100
+
+
+class ParallelParser:
+    '''
+    Parse logs on a process pool: every file is split into chunks which are framed and decoded concurrently,
+    the results are written back in file order.
+
+    workers: The number of worker processes, defaults to the number of cores
+    chunk_size: The number of bytes parsed by one task
+    export_formats: The output formats, see data_export.available_formats()
+    export_options: The keyword arguments of data_export.create_exporters()
+    write_index: Write the packet index sidecar of every file as well
+    incremental: Save a parse checkpoint of every file, files which only grew since their checkpoint
+                 are continued from it in this process instead of being parsed again on the pool
+    use_cache: Skip the files whose outputs are up to date, see parse_cache.ParseCache
+    cache_hash: Compare the content hash as well when the mtime of a file changed
+    stats: Write the channel statistics of every file as well, the statistics of the chunks are merged in file order
+    packet_range, time_range, decimate, decimation: Export a decimated range of every file instead,
+                 see IMUFunc.imu_data_parse(), the files are read through their packet index in this process
+
+    results: {data path: {'status': 'parsed', 'cached', 'no packets' or 'not decodable', 'rows': exported rows or None}}
+             of the files of the last parse_files(), a file which failed has no entry
+    '''
+    def __init__(self, workers=None, chunk_size=PARALLEL_CHUNK_SIZE, export_formats='csv', export_options=None, write_index=True,
+                 incremental=False, use_cache=False, cache_hash=False, stats=False, packet_range=None, time_range=None,
+                 decimate=1, decimation='pick'):
+        self.workers = workers if workers is not None else (os.cpu_count() or 1)
+        self.chunk_size = chunk_size
+        self.export_formats = export_formats
+        self.export_options = export_options
+        self.write_index = write_index
+        self.incremental = incremental
+        self.use_cache = use_cache
+        self.cache_hash = cache_hash
+        self.stats = stats
+        self.slice_options = None
+        if packet_range is not None or time_range is not None or decimate > 1:
+            self.slice_options = {'packet_range': packet_range, 'time_range': time_range, 'decimate': decimate, 'decimation': decimation}
+        self.settings = ParseCache.settings(export_formats, export_options, write_index, stats)
+        self.imu_func = IMUFunc()
+        self.decoder = None
+        self.exporters = []
+        self.index_builder = None
+        self.log_stats = None
+        self.last_end = None
+        self.rows = 0
+        self.results = {}
+
+    def resumable(self, data_path):
+        '''
+        The file has a checkpoint of the same parse settings and was only appended to since then
+        '''
+        data_type = self.imu_func.get_data_type(data_path)
+        if not self.incremental or data_type not in PARSE_DATA_TYPES:
+            return False
+        checkpoint = ParseCheckpoint.load(data_path)
+        if checkpoint is None:
+            return False
+        packet_length = self.imu_func.get_packet_length(data_path, data_type)
+        return (checkpoint.matches(data_type, packet_length, self.export_formats, self.export_options, self.write_index, self.stats)
+                and checkpoint.can_resume(self.output_paths(data_path)))
+
+    def output_paths(self, data_path):
+        data_type = self.imu_func.get_data_type(data_path)
+        return self.imu_func.output_paths(data_path, data_type, self.export_formats, self.export_options, self.write_index, self.stats)
+
+    def cached(self, data_path):
+        '''
+        The outputs of the file are up to date
+        '''
+        if not self.use_cache or self.imu_func.get_data_type(data_path) not in PARSE_DATA_TYPES:
+            return False
+        return ParseCache.of(data_path, self.cache_hash).is_current(data_path, self.output_paths(data_path), self.settings)
+
+    def check_slice(self, data_paths):
+        '''
+        Raise a ValueError before anything is written if a range or decimation is exported from a mixed type log
+        '''
+        if self.slice_options is not None:
+            for data_path in data_paths:
+                self.imu_func.check_slice(data_path, self.slice_options['packet_range'], self.slice_options['time_range'],
+                                          self.slice_options['decimate'])
+
+    def result(self, data_path, rows=None):
+        '''
+        The entry of a parsed file in self.results, rows: the number of exported rows if it is known
+        '''
+        data_type = self.imu_func.get_data_type(data_path)
+        if data_type != MIXED_DATA_TYPE and data_type not in PARSE_DATA_TYPES:
+            return {'status': 'not decodable', 'rows': 0}
+        return {'status': 'no packets' if rows == 0 else 'parsed', 'rows': rows}
+
+    def record(self, data_path):
+        if self.use_cache:
+            ParseCache.of(data_path, self.cache_hash).record(data_path, self.output_paths(data_path), self.settings)
+
+    def make_tasks(self, data_paths):
+        tasks = []
+        for data_path in data_paths:
+            data_type = self.imu_func.get_data_type(data_path)
+            if data_type not in PARSE_DATA_TYPES:
+                continue
+            packet_length = self.imu_func.get_packet_length(data_path, data_type)
+            file_size = os.path.getsize(data_path)
+            starts = list(range(0, file_size, self.chunk_size)) or [0]
+            for i, start in enumerate(starts):
+                stop = min(start + self.chunk_size, file_size)
+                tasks.append((data_path, data_type, packet_length, start, stop, i == len(starts) - 1))
+        return tasks
+
+    def parse_files(self, data_paths):
+        '''
+        Parse the files to the export formats, yields the progress of all files together, see self.results
+        '''
+        self.results = {}
+        if self.slice_options is not None:
+            self.check_slice(data_paths)
+            for i, data_path in enumerate(data_paths):
+                for progress in self.imu_func.imu_data_parse(data_path, self.export_formats, self.export_options, **self.slice_options):
+                    yield (i * 100 + progress) / len(data_paths)
+                self.results[data_path] = self.result(data_path)
+            yield 100
+            return
+        for data_path in data_paths:
+            if self.cached(data_path):
+                self.results[data_path] = {'status': 'cached', 'rows': None}
+        data_paths = [data_path for data_path in data_paths if data_path not in self.results]
+        mixed = [data_path for data_path in data_paths if self.imu_func.get_data_type(data_path) == MIXED_DATA_TYPE]
+        resumed = [data_path for data_path in data_paths if data_path not in mixed and self.resumable(data_path)]
+        tasks = self.make_tasks([data_path for data_path in data_paths if data_path not in resumed and data_path not in mixed])
+        task_paths = set(task[0] for task in tasks)
+        for data_path in data_paths:
+            if data_path not in resumed and data_path not in mixed and data_path not in task_paths:
+                self.results[data_path] = self.result(data_path) # not decodable
+        # resumed and mixed type files are parsed in this process, in one pass each
+        serial_lengths = [os.path.getsize(data_path) - ParseCheckpoint.load(data_path).offset for data_path in resumed]
+        serial_lengths += [os.path.getsize(data_path) for data_path in mixed]
+        progress_length = max(sum(task[4] - task[3] for task in tasks) + sum(serial_lengths), 1)
+        progress = 0
+        if not tasks and not resumed and not mixed:
+            yield 100 # everything is up to date
+        for data_path, serial_length in zip(resumed + mixed, serial_lengths):
+            for file_progress in self.parse_serial(data_path, data_path in mixed):
+                yield progress + file_progress * serial_length / progress_length
+            progress += serial_length / progress_length * 100
+            if data_path not in mixed:
+                self.record(data_path)
+            self.results[data_path] = self.result(data_path, None if data_path in mixed else ParseCheckpoint.load(data_path).rows)
+        with concurrent.futures.ProcessPoolExecutor(max_workers=self.workers) as executor:
+            pending = collections.deque()
+            for task in tasks:
+                pending.append((task, executor.submit(parse_range, *task[:5], self.export_formats, self.export_options, self.stats)))
+                if len(pending) >= self.workers * 2:
+                    progress += self.write_result(*pending.popleft()) / progress_length * 100
+                    yield progress
+            while pending:
+                progress += self.write_result(*pending.popleft()) / progress_length * 100
+                yield progress
+
+    def parse_serial(self, data_path, mixed):
+        if mixed:
+            return self.imu_func.imu_data_parse(data_path, self.export_formats, self.export_options, stats=self.stats)
+        data_type = self.imu_func.get_data_type(data_path)
+        return self.imu_func.parse_to_file(data_path, data_type, self.export_formats, self.export_options, self.write_index,
+                                           incremental=True, stats=self.stats)
+
+    def write_result(self, task, future):
+        '''
+        Write the rows of one finished task to its outputs, returns the number of bytes parsed
+        '''
+        data_path, data_type, packet_length, start, stop, is_last = task
+        first, end, encoded, index_rows, chunk_stats = future.result()
+        if start == 0:
+            self.decoder = PacketDecoder(data_type, packet_length)
+            self.log_stats = LogStats(data_path) if self.stats else None
+            self.exporters = create_exporters(self.export_formats, data_path, self.decoder, **(self.export_options or {}))
+            for exporter in self.exporters:
+                exporter.open()
+            if self.write_index:
+                self.index_builder = PacketIndexBuilder(data_path, data_type, packet_length)
+            self.last_end = None
+            self.rows = 0
+        if first is not None and self.last_end is not None and first < self.last_end:
+            # the first packet overlaps the last packet of the previous chunk, re-frame from where that packet ends
+            first, end, encoded, index_rows, chunk_stats = parse_range(data_path, data_type, packet_length, self.last_end, max(stop, self.last_end),
+                                                                       self.export_formats, self.export_options, self.stats)
+        if self.last_end is not None:
+            # header candidates inside the last packet of the previous chunk, the serial framer drops them as well
+            accepted, rejected, times = index_rows
+            index_rows = (accepted, rejected[rejected >= self.last_end], times)
+        if end is not None:
+            self.last_end = end
+        self.rows += len(index_rows[0])
+        for exporter, rows in zip(self.exporters, encoded):
+            exporter.write_encoded(rows)
+        if self.write_index:
+            self.index_builder.add(*index_rows)
+        if self.log_stats is not None:
+            self.log_stats.merge(data_type, self.decoder, chunk_stats)
+        if is_last:
+            for exporter in self.exporters:
+                exporter.close()
+            if self.write_index:
+                self.index_builder.save()
+            if self.log_stats is not None:
+                self.log_stats.save()
+            if self.incremental:
+                ParseCheckpoint.after_run(data_path, data_type, packet_length, self.export_formats, self.export_options, self.write_index,
+                                          self.last_end or 0, self.rows, self.index_builder.state() if self.write_index else None,
+                                          self.log_stats.state() if self.log_stats is not None else None).save()
+            self.record(data_path)
+            self.results[data_path] = self.result(data_path, self.rows)
+        return stop - start
@@ -0,0 +1,81 @@
+import os
+import json
+import hashlib
+
+from .parse_checkpoint import normalize_formats
+
+PARSER_VERSION = 1 # bump when the parsed output of the same log changes, so the cached outputs are parsed again
+PARSE_CACHE_NAME = 'parse_cache.json'
+HASH_CHUNK_SIZE = 1 << 22
+
+
+def file_hash(data_path):
+    h = hashlib.blake2b(digest_size=16)
+    with open(data_path, 'rb') as dataf:
+        for chunk in iter(lambda: dataf.read(HASH_CHUNK_SIZE), b''):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+class ParseCache:
+    '''
+    Manifest 'parse_cache.json' in the folder of the logs, it remembers which logs were parsed with which settings:
+    {file name: {'size', 'mtime', 'hash', 'parser version', 'settings', 'outputs'}}
+
+    A log is skipped if its size and mtime (or, with use_hash, its content) are unchanged,
+    it was parsed by this parser version with the same settings and the outputs are still there.
+    '''
+    def __init__(self, folder, use_hash=False):
+        self.manifest_path = os.path.join(folder, PARSE_CACHE_NAME)
+        self.use_hash = use_hash
+        self.entries = {}
+        if os.path.exists(self.manifest_path):
+            try:
+                with open(self.manifest_path) as cachef:
+                    self.entries = json.load(cachef)
+            except ValueError:
+                self.entries = {}
+
+    @classmethod
+    def of(cls, data_path, use_hash=False):
+        return cls(os.path.dirname(os.path.abspath(data_path)), use_hash)
+
+    @staticmethod
+    def settings(export_formats, export_options, write_index, stats=False):
+        return json.loads(json.dumps({'export formats': normalize_formats(export_formats),
+                                      'export options': export_options or {},
+                                      'write index': write_index,
+                                      'stats': stats}))
+
+    def is_current(self, data_path, out_paths, settings):
+        entry = self.entries.get(os.path.basename(data_path))
+        if entry is None or entry['parser version'] != PARSER_VERSION or entry['settings'] != settings:
+            return False
+        if not all(os.path.exists(out_path) for out_path in out_paths):
+            return False
+        stat = os.stat(data_path)
+        if entry['size'] != stat.st_size:
+            return False
+        if entry['mtime'] == stat.st_mtime_ns:
+            return True
+        if self.use_hash and entry['hash'] is not None and entry['hash'] == file_hash(data_path):
+            entry['mtime'] = stat.st_mtime_ns # same content, e.g. the log was copied
+            self.save()
+            return True
+        return False
+
+    def record(self, data_path, out_paths, settings):
+        stat = os.stat(data_path)
+        self.entries[os.path.basename(data_path)] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'hash': file_hash(data_path) if self.use_hash else None,
+            'parser version': PARSER_VERSION,
+            'settings': settings,
+            'outputs': [os.path.basename(out_path) for out_path in out_paths],
+        }
+        self.save()
+
+    def save(self):
+        with open(self.manifest_path, 'w') as cachef:
+            json.dump(self.entries, cachef, indent=4)
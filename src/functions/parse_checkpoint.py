@@ -0,0 +1,104 @@
+import os
+import json
+
+
+def checkpoint_path_of(data_path):
+    return f'{data_path[:-4]}.ckpt.json'
+
+
+def resume_offset(last_end, file_size, packet_length):
+    '''
+    Where the next run has to start framing: after the last accepted packet, and early enough
+    to catch a packet which was still being written when the log was parsed
+    '''
+    return max(last_end, file_size - packet_length + 1, 0)
+
+
+def normalize_formats(export_formats):
+    if isinstance(export_formats, str):
+        return [export_formats]
+    return list(export_formats)
+
+
+class ParseCheckpoint:
+    '''
+    State of the last parse of a log which is still growing, saved to '<data name>.ckpt.json'.
+
+    offset: file offset the next run starts framing at
+    tail: hex of the bytes from offset to the end of the file (the partial trailing packet),
+          used to make sure the log was only appended to since the last run
+    rows: number of rows in the outputs
+    index_state: (last device time, wrap count) of the packet index builder
+    stats_state: accumulators of the channel statistics, None if no statistics are computed
+    '''
+    def __init__(self, data_path, data_type, packet_length, export_formats, export_options, write_index,
+                 offset=0, tail='', rows=0, index_state=None, stats_state=None):
+        self.data_path = data_path
+        self.data_type = data_type
+        self.packet_length = packet_length
+        self.export_formats = normalize_formats(export_formats)
+        self.export_options = export_options or {}
+        self.write_index = write_index
+        self.offset = offset
+        self.tail = tail
+        self.rows = rows
+        self.index_state = index_state
+        self.stats_state = stats_state
+
+    @classmethod
+    def load(cls, data_path):
+        ckpt_path = checkpoint_path_of(data_path)
+        if not os.path.exists(ckpt_path):
+            return None
+        try:
+            with open(ckpt_path) as ckptf:
+                p = json.load(ckptf)
+            return cls(data_path, p['data type'], p['packet length'], p['export formats'], p['export options'],
+                       p['write index'], p['offset'], p['tail'], p['rows'], p['index state'], p.get('stats state'))
+        except (ValueError, KeyError):
+            return None
+
+    @classmethod
+    def after_run(cls, data_path, data_type, packet_length, export_formats, export_options, write_index,
+                  last_end, rows, index_state=None, stats_state=None):
+        offset = resume_offset(last_end, os.path.getsize(data_path), packet_length)
+        with open(data_path, 'rb') as dataf:
+            dataf.seek(offset)
+            tail = dataf.read().hex()
+        return cls(data_path, data_type, packet_length, export_formats, export_options, write_index,
+                   offset, tail, rows, index_state, stats_state)
+
+    def save(self):
+        p = {
+            'data type': self.data_type,
+            'packet length': self.packet_length,
+            'export formats': self.export_formats,
+            'export options': self.export_options,
+            'write index': self.write_index,
+            'offset': self.offset,
+            'tail': self.tail,
+            'rows': self.rows,
+            'index state': self.index_state,
+            'stats state': self.stats_state,
+        }
+        with open(checkpoint_path_of(self.data_path), 'w') as ckptf:
+            json.dump(p, ckptf, indent=4)
+
+    def matches(self, data_type, packet_length, export_formats, export_options, write_index, stats=False):
+        return (self.data_type == data_type and self.packet_length == packet_length
+                and self.export_formats == normalize_formats(export_formats)
+                and self.export_options == json.loads(json.dumps(export_options or {}))
+                and self.write_index == write_index and (self.stats_state is not None) == stats)
+
+    def can_resume(self, out_paths):
+        '''
+        The log was only appended to since the last run and all outputs are still there
+        '''
+        tail = bytes.fromhex(self.tail)
+        if os.path.getsize(self.data_path) < self.offset + len(tail):
+            return False
+        with open(self.data_path, 'rb') as dataf:
+            dataf.seek(self.offset)
+            if dataf.read(len(tail)) != tail:
+                return False
+        return all(os.path.exists(out_path) for out_path in out_paths)